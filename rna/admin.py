@@ -2,11 +2,166 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import hashlib
+
 from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.util import lookup_needs_distinct
+from django.contrib.admin.views.main import ChangeList
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.models.query import QuerySet
 from pagedown.widgets import AdminPagedownWidget
 
-from . import models
+from . import models, search
+
+
+def estimate_count(model_class, using=None):
+    """
+    Returns the number of rows in the table of model_class according to
+    the statistics of the database, or None if it keeps none, as SQLite.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    table = model_class._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples FROM pg_class WHERE relname = %s'
+    elif connection.vendor == 'mysql':
+        sql = ('SELECT table_rows FROM information_schema.tables '
+               'WHERE table_schema = DATABASE() AND table_name = %s')
+    else:
+        return None
+    cursor = connection.cursor()
+    cursor.execute(sql, [table])
+    row = cursor.fetchone()
+    if row and row[0] is not None:
+        return int(row[0])
+
+
+class EstimatedCountQuerySet(QuerySet):
+    """
+    Counts the rows of an unfiltered queryset with estimate_count, when
+    there are more than settings.RNA['ADMIN_COUNT_ESTIMATE_THRESHOLD']
+    (100000 by default) of them, instead of an exact COUNT(*) that scans
+    the whole table.
+    """
+
+    def count(self):
+        query = self.query
+        if (self._result_cache is None and not query.where.children and
+                query.low_mark == 0 and query.high_mark is None):
+            estimate = estimate_count(self.model, self.db)
+            if estimate is not None and estimate >= settings.RNA.get(
+                    'ADMIN_COUNT_ESTIMATE_THRESHOLD', 100000):
+                return estimate
+        return super(EstimatedCountQuerySet, self).count()
+
+
+def cached_choices(name, choices):
+    """
+    Returns the result of calling choices, cached under name until a
+    release or note changes, or for settings.RNA['ADMIN_CACHE_TIMEOUT']
+    seconds.
+    """
+    key = 'rna:admin:%s:%s' % (models.notes_version(),
+                               hashlib.md5(name.encode('utf-8')).hexdigest())
+    value = cache.get(key)
+    if value is None:
+        value = choices()
+        cache.set(key, value, settings.RNA.get('ADMIN_CACHE_TIMEOUT'))
+    return value
+
+
+class ReleaseProductFilter(admin.SimpleListFilter):
+    """
+    Filters notes by the product of their releases, with a subquery of the
+    releases table rather than a DISTINCT over the join.
+    """
+    title = 'release product'
+    parameter_name = 'release_product'
+
+    def lookups(self, request, model_admin):
+        return [(p, p) for p in models.Release.PRODUCTS]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(pk__in=models.Note.releases.through.objects
+                                   .filter(release__product=self.value())
+                                   .values('note'))
+
+
+class ReleaseVersionFilter(admin.SimpleListFilter):
+    """
+    Filters notes by the version of their releases. The versions are only
+    listed once a release product is chosen, from the cache.
+    """
+    title = 'release version'
+    parameter_name = 'release_version'
+
+    def get_product(self, request):
+        product = request.GET.get(ReleaseProductFilter.parameter_name)
+        if product in models.Release.PRODUCTS:
+            return product
+
+    def lookups(self, request, model_admin):
+        product = self.get_product(request)
+        if product is None:
+            return []
+        return cached_choices('versions:' + product, lambda: [
+            (v, v) for v in models.Release.objects.filter(product=product)
+            .order_by('-version_key').values_list('version', flat=True)])
+
+    def queryset(self, request, queryset):
+        product = self.get_product(request)
+        if self.value() and product:
+            return queryset.filter(pk__in=models.Note.releases.through.objects
+                                   .filter(release__product=product,
+                                           release__version=self.value())
+                                   .values('note'))
+
+
+class SearchChangeList(ChangeList):
+    """
+    Searches with the full-text search backend rather than LIKE scans of
+    search_fields, which only enable the search box, and also lists the
+    objects whose search_exact_fields of the model admin equal the query.
+    """
+
+    def get_query_set(self, request):
+        search_fields = self.search_fields
+        self.search_fields = ()
+        try:
+            qs = super(SearchChangeList, self).get_query_set(request)
+        finally:
+            self.search_fields = search_fields
+        if not self.query:
+            return qs
+
+        backend = search.get_backend(router.db_for_read(self.model))
+        matches = backend.filter(qs, self.query)
+        use_distinct = False
+        for field in self.model_admin.search_exact_fields:
+            try:
+                matches = matches | qs.filter(**{field: self.query.strip()})
+            except (ValueError, ValidationError):
+                continue
+            use_distinct = (use_distinct or
+                            lookup_needs_distinct(self.lookup_opts, field))
+        return matches.distinct() if use_distinct else matches
+
+
+class SearchAdminMixin(object):
+    search_exact_fields = ()
+
+    def get_changelist(self, request, **kwargs):
+        return SearchChangeList
+
+
+class EstimatedCountAdminMixin(object):
+    def queryset(self, request):
+        return super(EstimatedCountAdminMixin, self).queryset(
+            request)._clone(klass=EstimatedCountQuerySet)
 
 
 class NoteAdminForm(forms.ModelForm):
@@ -16,13 +171,24 @@ class NoteAdminForm(forms.ModelForm):
         model = models.Note
 
 
-class NoteAdmin(admin.ModelAdmin):
+class NoteAdmin(SearchAdminMixin, EstimatedCountAdminMixin,
+                admin.ModelAdmin):
     form = NoteAdminForm
-    list_display = ('id', 'bug', 'tag', 'note', 'created')
+    list_display = ('id', 'bug', 'tag', 'summary', 'release_versions',
+                    'created')
     list_display_links = ('id',)
-    list_filter = ('tag', 'is_known_issue', 'releases__product',
-                   'releases__version')
-    search_fields = ('bug', 'note', 'releases__version')
+    list_filter = ('tag', 'is_known_issue', ReleaseProductFilter,
+                   ReleaseVersionFilter)
+    search_fields = ('note',)
+    search_exact_fields = ('bug', 'releases__version')
+
+    def queryset(self, request):
+        return super(NoteAdmin, self).queryset(request).prefetch_related(
+            'releases')
+
+    def release_versions(self, obj):
+        return ', '.join(release.version for release in obj.releases.all())
+    release_versions.short_description = 'releases'
 
 
 class ReleaseAdminForm(forms.ModelForm):
@@ -35,13 +201,15 @@ class ReleaseAdminForm(forms.ModelForm):
         model = models.Release
 
 
-class ReleaseAdmin(admin.ModelAdmin):
+class ReleaseAdmin(SearchAdminMixin, EstimatedCountAdminMixin,
+                   admin.ModelAdmin):
     form = ReleaseAdminForm
     list_display = ('version', 'product', 'channel', 'is_public',
-                    'release_date', 'text')
+                    'release_date', 'summary')
     list_filter = ('product', 'channel', 'is_public')
     ordering = ('-release_date',)
-    search_fields = ('version', 'text')
+    search_fields = ('text', 'system_requirements')
+    search_exact_fields = ('version',)
 
 
 admin.site.register(models.Note, NoteAdmin)
@@ -0,0 +1,160 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from datetime import datetime, timedelta
+import random
+
+from .. import models
+from ..utils import chunked
+
+
+# The channels and version formats of each major version of a product
+VERSIONS = (('Aurora', '{0}.0a2'), ('Beta', '{0}.0beta'),
+            ('Release', '{0}.0'), ('Release', '{0}.0.1'),
+            ('Release', '{0}.0.2'), ('ESR', '{0}.0esr'))
+WORDS = ('crash', 'fixed', 'when', 'loading', 'pages', 'with', 'large',
+         'images', 'improved', 'startup', 'performance', 'on', 'some',
+         'devices', 'new', 'support', 'for', 'web', 'audio', 'sync',
+         'tabs', 'between', 'desktop', 'and', 'mobile', 'the', 'pdf',
+         'viewer', 'developer', 'tools', 'now', 'show', 'network')
+
+
+class Dataset(object):
+    """
+    Deterministic synthetic releases and notes. Object i, counting from 1,
+    is generated from its own seeded random number generator, so that any
+    object can be produced without the others, and its modified timestamp
+    grows with i.
+    """
+    start = datetime(2012, 1, 1)
+    interval = timedelta(minutes=1)
+
+    def __init__(self, releases=1000, notes=10000, fanout=3, seed=0):
+        """
+        Args:
+            releases (int): Number of releases.
+            notes (int): Number of notes.
+            fanout (int): Maximum number of releases per note.
+            seed (int): Seed of the generated values.
+        """
+        self.releases = releases
+        self.notes = notes
+        self.fanout = fanout
+        self.seed = seed
+
+    def random(self, kind, i):
+        return random.Random((self.seed * 2 + kind) * 10 ** 9 + i)
+
+    def timestamp(self, i):
+        return self.start + self.interval * i
+
+    def index(self, modified):
+        """Returns the first i whose timestamp is at least modified."""
+        delta = modified - self.start
+        seconds = delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+        interval = self.interval.days * 86400 + self.interval.seconds
+        return max(1, -int(-seconds // interval))
+
+    def sentence(self, rng, words=8):
+        return ' '.join(rng.choice(WORDS) for i in range(words)).capitalize()
+
+    def release(self, i):
+        """Returns the field values of release i."""
+        rng = self.random(0, i)
+        product = models.Release.PRODUCTS[(i - 1) % len(
+            models.Release.PRODUCTS)]
+        k = (i - 1) // len(models.Release.PRODUCTS)
+        major = k // len(VERSIONS) + 1
+        channel, version = VERSIONS[k % len(VERSIONS)]
+        return {
+            'id': i,
+            'product': product,
+            'channel': channel,
+            'version': version.format(major),
+            'release_date': self.start + timedelta(days=42 * major),
+            'text': self.sentence(rng, 20),
+            'is_public': rng.random() < 0.9,
+            'bug_list': '',
+            'bug_search_url': '',
+            'system_requirements': self.sentence(rng),
+            'created': self.timestamp(i),
+            'modified': self.timestamp(i),
+        }
+
+    def note(self, i):
+        """
+        Returns the field values of note i, with the ids of its releases
+        in 'releases' and fixed_in_release as an id.
+        """
+        rng = self.random(1, i)
+        base = rng.randint(1, self.releases)
+        releases = sorted(set(
+            min(self.releases, base + rng.randint(0, 7))
+            for j in range(rng.randint(1, self.fanout))))
+        is_known_issue = rng.random() < 0.1
+        tag = rng.choice(('',) + models.Note.TAGS)
+        note = self.sentence(rng)
+        if rng.random() < 0.05:
+            tag = 'Fixed'
+            note = '%s %s' % (self.release(releases[0])['version'], note)
+        fixed_in_release = None
+        if is_known_issue and rng.random() < 0.5:
+            fixed_in_release = rng.choice(releases)
+        return {
+            'id': i,
+            'bug': rng.randint(100000, 1000000),
+            'note': note,
+            'releases': releases,
+            'is_known_issue': is_known_issue,
+            'fixed_in_release': fixed_in_release,
+            'tag': tag,
+            'sort_num': rng.randint(0, 5),
+            'is_public': rng.random() < 0.9,
+            'created': self.timestamp(i),
+            'modified': self.timestamp(i),
+        }
+
+    def serialize_release(self, i, base_url):
+        """Returns release i as served by the API under base_url."""
+        data = self.release(i)
+        data['url'] = '%sreleases/%d/' % (base_url, i)
+        return serialize_dates(data)
+
+    def serialize_note(self, i, base_url):
+        """Returns note i as served by the API under base_url."""
+        data = self.note(i)
+        data['url'] = '%snotes/%d/' % (base_url, i)
+        data['releases'] = ['%sreleases/%d/' % (base_url, r)
+                            for r in data['releases']]
+        if data['fixed_in_release']:
+            data['fixed_in_release'] = '%sreleases/%d/' % (
+                base_url, data['fixed_in_release'])
+        return serialize_dates(data)
+
+    def populate(self, batch_size=1000):
+        """Inserts the dataset into the database in bulk."""
+        for ids in chunked(range(1, self.releases + 1), batch_size):
+            releases = [models.Release(**self.release(i)) for i in ids]
+            for release in releases:
+                release.prepare_save(modified=False)
+            models.Release.objects.bulk_create(releases)
+
+        through = models.Note.releases.through
+        for ids in chunked(range(1, self.notes + 1), batch_size):
+            notes, links = [], []
+            for i in ids:
+                data = self.note(i)
+                links.extend(through(note_id=i, release_id=r)
+                             for r in data.pop('releases'))
+                data['fixed_in_release_id'] = data.pop('fixed_in_release')
+                note = models.Note(**data)
+                note.prepare_save(modified=False)
+                notes.append(note)
+            models.Note.objects.bulk_create(notes)
+            through.objects.bulk_create(links)
+
+
+def serialize_dates(data):
+    return dict((k, v.isoformat() if isinstance(v, datetime) else v)
+                for k, v in data.items())
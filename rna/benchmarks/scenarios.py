@@ -0,0 +1,236 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import tempfile
+import time
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.client import Client
+from django.utils.datastructures import SortedDict
+
+from .. import models
+from ..middleware import QueryRecorder
+
+
+SCENARIOS = SortedDict()
+
+
+class ScenarioError(Exception):
+    pass
+
+
+def scenario(setup=None):
+    """
+    Registers a scenario function, called with a Context and timed, and
+    an optional setup function called with the Context before every run
+    and not timed.
+    """
+    def register(func):
+        SCENARIOS[func.__name__] = (func, setup)
+        return func
+    return register
+
+
+class Context(object):
+    """The state shared by the scenarios of a benchmark run."""
+
+    def __init__(self, dataset, sample_size=20):
+        """
+        Args:
+            dataset (generator.Dataset): The dataset in the database.
+            sample_size (int): Number of objects used by the scenarios
+                that visit single objects, spread evenly over the dataset.
+        """
+        self.dataset = dataset
+        self.client = Client()
+        step = max(1, dataset.releases // sample_size)
+        self.release_ids = range(1, dataset.releases + 1, step)[:sample_size]
+        step = max(1, dataset.notes // sample_size)
+        self.note_ids = range(1, dataset.notes + 1, step)[:sample_size]
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        if response.status_code != 200:
+            raise ScenarioError('GET %s returned %d' % (
+                path, response.status_code))
+        return response
+
+
+@scenario()
+def release_notes(context):
+    """Release.notes() of the sample releases, fetching both groups."""
+    for release in models.Release.objects.filter(pk__in=context.release_ids):
+        new_features, known_issues = release.notes(public_only=True)
+        list(new_features)
+        list(known_issues)
+
+
+@scenario()
+def list_releases(context):
+    context.get('/releases/')
+
+
+@scenario()
+def list_notes_page(context):
+    context.get('/notes/', page_size=100)
+
+
+@scenario()
+def detail_release(context):
+    for pk in context.release_ids:
+        context.get('/releases/%d/' % pk)
+
+
+@scenario()
+def detail_note(context):
+    for pk in context.note_ids:
+        context.get('/notes/%d/' % pk)
+
+
+def clear_cache(context):
+    cache.clear()
+
+
+@scenario(setup=clear_cache)
+def nested_notes(context):
+    """The nested notes of the sample releases, with a cold cache."""
+    for pk in context.release_ids:
+        context.get('/releases/%d/notes/' % pk)
+
+
+@scenario()
+def nested_notes_cached(context):
+    for pk in context.release_ids:
+        context.get('/releases/%d/notes/' % pk)
+
+
+@scenario()
+def filter_releases(context):
+    context.get('/releases/', product='Firefox', channel='Release')
+
+
+@scenario()
+def filter_notes(context):
+    """Filters the second half of the notes, by modification time and tag."""
+    modified = context.dataset.timestamp(context.dataset.notes // 2)
+    context.get('/notes/', modified_after=modified.isoformat(),
+                tag='Fixed', page_size=100)
+
+
+@scenario()
+def export_notes(context):
+    """Streams every note as NDJSON."""
+    context.get('/export/notes.ndjson').content
+
+
+def build_search_index(context):
+    if not getattr(context, 'search_indexed', False):
+        call_command('rnareindex', verbosity=0)
+        context.search_indexed = True
+
+
+@scenario(setup=build_search_index)
+def search(context):
+    """Full-text searches for single words and a phrase."""
+    for query in ('crash', 'startup performance', 'pdf viewer'):
+        context.get('/search/', q=query)
+
+
+def empty_tables(context):
+    """Deletes every synced row directly, without signals."""
+    cursor = connection.cursor()
+    for model_class in (models.Note.releases.through, models.Note,
+                        models.Release, models.SyncState, models.Tombstone):
+        cursor.execute('DELETE FROM %s' % connection.ops.quote_name(
+            model_class._meta.db_table))
+
+
+@scenario(setup=empty_tables)
+def rnasync(context):
+    """A full bulk rnasync of the dataset from the stub server."""
+    call_command('rnasync', bulk=True)
+
+
+@scenario(setup=empty_tables)
+def rnasync_pipeline(context):
+    call_command('rnasync', bulk=True, pipeline=True)
+
+
+def export_dumps(context):
+    """
+    Exports the dataset to NDJSON dumps on the first run, then empties the
+    tables.
+    """
+    if not getattr(context, 'dumps', None):
+        directory = tempfile.mkdtemp(prefix='rnabench')
+        context.dumps = []
+        for name in ('releases', 'notes'):
+            path = os.path.join(directory, '%s.ndjson' % name)
+            with open(path, 'wb') as f:
+                f.write(context.get('/export/%s.ndjson' % name).content)
+            context.dumps.append(path)
+    empty_tables(context)
+
+
+@scenario(setup=export_dumps)
+def rnaimport(context):
+    """A bulk rnaimport of the dataset from NDJSON dumps."""
+    call_command('rnaimport', *context.dumps, verbosity=0)
+
+
+def run(context, names=None, repeat=5, callback=None):
+    """
+    Runs each named scenario, or all of them, once to warm up and then
+    repeat times, and returns a SortedDict of their results. callback is
+    called with the name and results of each scenario as it completes.
+    """
+    results = SortedDict()
+    for name in names or SCENARIOS:
+        func, setup = SCENARIOS[name]
+        times = []
+        for i in range(repeat + 1):
+            if setup:
+                setup(context)
+            with QueryRecorder() as recorder:
+                start = time.time()
+                func(context)
+                elapsed = time.time() - start
+            if i:
+                times.append(elapsed)
+        results[name] = summarize(times, recorder.count)
+        if callback:
+            callback(name, results[name])
+    return results
+
+
+def summarize(times, queries):
+    """Returns the statistics of the timings of a scenario, in seconds."""
+    ordered = sorted(times)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        median = ordered[middle]
+    else:
+        median = (ordered[middle - 1] + ordered[middle]) / 2.0
+    return {'times': times, 'min': ordered[0], 'max': ordered[-1],
+            'mean': sum(times) / len(times), 'median': median,
+            'queries': queries}
+
+
+def compare(baseline, results, threshold=0.1):
+    """
+    Compares the median times of the scenarios in both results, returning
+    a list of (name, baseline median, median, ratio, regressed) tuples,
+    where regressed is True if the ratio exceeds 1 + threshold.
+    """
+    comparison = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['median'], result['median']
+        ratio = new / old if old else float('inf')
+        comparison.append((name, old, new, ratio, ratio > 1 + threshold))
+    return comparison
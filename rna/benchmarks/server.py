@@ -0,0 +1,101 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import re
+from SocketServer import ThreadingMixIn
+import threading
+from urlparse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.utils.dateparse import parse_datetime
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(object):
+    """
+    Serves a generator.Dataset the way the RNA API does, from a background
+    thread, so that rnasync can be benchmarked without a remote server.
+    Collections are paginated in (modified, pk) order, which for a Dataset
+    is pk order, and accept the page_size and modified_after params.
+    """
+    page_size = 100
+    path_regex = re.compile(r'^/(releases|notes)/(?:(\d+)/)?$')
+
+    def __init__(self, dataset, host='127.0.0.1', port=0):
+        self.dataset = dataset
+        self.server = make_server(host, port, self.app,
+                                  server_class=ThreadingWSGIServer,
+                                  handler_class=QuietHandler)
+        self.url = 'http://%s:%d/' % self.server.server_address
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def app(self, environ, start_response):
+        match = self.path_regex.match(environ['PATH_INFO'])
+        if environ['PATH_INFO'] == '/':
+            body = {'notes': self.url + 'notes/',
+                    'releases': self.url + 'releases/'}
+        elif match:
+            body = self.collection(match.group(1), match.group(2),
+                                   parse_qs(environ.get('QUERY_STRING', '')))
+        else:
+            body = None
+        if body is None:
+            start_response('404 NOT FOUND',
+                           [('Content-Type', 'application/json')])
+            return [json.dumps({'detail': 'Not found'})]
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [json.dumps(body)]
+
+    def collection(self, name, pk, params):
+        """
+        Returns the serialized object pk of the named collection, or a page
+        of the collection without pk, or None if there is no such object.
+        """
+        count = getattr(self.dataset, name)
+        serialize = getattr(self.dataset, 'serialize_' + name[:-1])
+        if pk is not None:
+            pk = int(pk)
+            if 1 <= pk <= count:
+                return serialize(pk, self.url)
+            return None
+
+        page_size = int(params.get('page_size', [self.page_size])[0])
+        start = int(params.get('cursor', [0])[0]) + 1
+        if 'modified_after' in params:
+            start = max(start, self.dataset.index(
+                parse_datetime(params['modified_after'][0])))
+        end = min(count, start + page_size - 1)
+        next_url = None
+        if end < count:
+            next_url = '%s%s/?page_size=%d&cursor=%d' % (
+                self.url, name, page_size, end)
+        return {'next': next_url,
+                'results': [serialize(i, self.url)
+                            for i in range(start, end + 1)]}
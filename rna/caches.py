@@ -0,0 +1,280 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.utils.importlib import import_module
+import requests
+from requests.structures import CaseInsensitiveDict
+
+try:
+    from collections import OrderedDict
+except ImportError:  # Python 2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+
+def get_cache(backend=None, **options):
+    """
+    Returns a new RestClient response cache.
+
+    Args:
+        backend (str or class): Cache class, or dotted path to one.
+            Defaults to settings.RNA['CACHE']['BACKEND'], and to a plain
+            unbounded dict if that is not set.
+        **options: Keyword arguments for the backend, updating
+            settings.RNA['CACHE']['OPTIONS']
+    """
+    config = settings.RNA.get('CACHE', {})
+    backend = backend or config.get('BACKEND', dict)
+    kwargs = dict(config.get('OPTIONS', {}))
+    kwargs.update(options)
+    if isinstance(backend, basestring):
+        module_name, class_name = backend.rsplit('.', 1)
+        backend = getattr(import_module(module_name), class_name)
+    return backend(**kwargs)
+
+
+def response_size(response):
+    """Returns the size of a cached response body in bytes."""
+    try:
+        return len(response.content)
+    except (AttributeError, TypeError):
+        return 0
+
+
+class LRUCache(object):
+    """
+    Thread safe mapping for RestClient responses, bounded by number of
+    entries and total body size, evicting the least recently used entries
+    first and expiring entries older than their ttl.
+
+    Supports the subset of the dict interface RestClient relies on, so a
+    plain dict remains usable as an unbounded cache backend.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None,
+                 sizeof=response_size, timer=time.time):
+        """
+        Args:
+            max_entries (int): Maximum number of cached entries.
+            max_bytes (int): Maximum sum of sizeof(value) over all entries.
+            ttl (float): Default number of seconds an entry stays fresh.
+            sizeof (callable): Returns the size of a cached value.
+            timer (callable): Returns the current time in seconds.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.timer = timer
+        self.hits = self.misses = self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(key, entry)
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(key, entry):
+                self.misses += 1
+                return default
+            self.hits += 1
+            # Re-insert to mark the entry as most recently used.
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry[0]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._discard(key)
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = self.timer() + ttl if ttl is not None else None
+        size = self.sizeof(value)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (value, expires, size)
+            self.size += size
+            while self._entries and (
+                    (self.max_entries is not None and
+                     len(self._entries) > self.max_entries) or
+                    (self.max_bytes is not None and
+                     self.size > self.max_bytes)):
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def setdefault(self, key, default=None):
+        with self._lock:
+            value = self.get(key, KeyError)
+            if value is KeyError:
+                self.set(key, default)
+                value = default
+            return value
+
+    def stats(self):
+        """Returns a dict of cache counters."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def _expired(self, key, entry):
+        if entry[1] is not None and entry[1] <= self.timer():
+            self._discard(key)
+            return True
+        return False
+
+
+class SQLiteCache(object):
+    """
+    Persistent RestClient response cache that stores bodies together with
+    their headers in a SQLite database, so they outlive the process.
+
+    Responses read back from disk have needs_revalidation set until they
+    are stored again, which RestClient uses to send a conditional request
+    (If-None-Match/If-Modified-Since) before reusing the cached body.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Filename of the SQLite database, created if missing.
+        """
+        self.path = path
+        self.hits = self.misses = 0
+        self._fresh = set()
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS rna_response_cache ('
+                'key TEXT PRIMARY KEY, url TEXT, status_code INTEGER, '
+                'headers TEXT, encoding TEXT, content BLOB, stored REAL)')
+            self._connection.commit()
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT 1 FROM rna_response_cache WHERE key = ?',
+                (self._key(key),)).fetchone() is not None
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, response):
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO rna_response_cache '
+                '(key, url, status_code, headers, encoding, content, stored) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self._key(key), response.url, response.status_code,
+                 json.dumps(dict(response.headers)), response.encoding,
+                 sqlite3.Binary(response.content), time.time()))
+            self._connection.commit()
+            self._fresh.add(self._key(key))
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM rna_response_cache').fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute('DELETE FROM rna_response_cache')
+            self._connection.commit()
+            self._fresh.clear()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get(self, key, default=None):
+        key = self._key(key)
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT url, status_code, headers, encoding, content '
+                'FROM rna_response_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            needs_revalidation = key not in self._fresh
+        url, status_code, headers, encoding, content = row
+        response = requests.Response()
+        response.url = url
+        response.status_code = status_code
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response.encoding = encoding
+        response._content = bytes(content)
+        response._content_consumed = True
+        response.needs_revalidation = needs_revalidation
+        return response
+
+    def pop(self, key, default=None):
+        with self._lock:
+            response = self.get(key, default)
+            self._connection.execute(
+                'DELETE FROM rna_response_cache WHERE key = ?',
+                (self._key(key),))
+            self._connection.commit()
+            self._fresh.discard(self._key(key))
+            return response
+
+    def stats(self):
+        """Returns a dict of cache counters."""
+        return {'entries': len(self), 'hits': self.hits,
+                'misses': self.misses}
+
+    def _key(self, key):
+        return json.dumps(key)
@@ -2,19 +2,24 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from multiprocessing.pool import ThreadPool
 import re
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 import requests
+from requests.adapters import HTTPAdapter
+from rest_framework.compat import parse_datetime
 
-from . import models, serializers
+from . import caches, models, serializers, stats, utils
 
 
 class RestClient(object):
     full_url_regex = re.compile('^https?://.*')
+    # a stats.SyncStats recording the cache hits and timings of a sync
+    stats = None
 
-    def __init__(self, base_url='', token='', cache=None):
+    def __init__(self, base_url='', token='', cache=None, session=None):
         """Initialize a RestClient instance.
 
         Args:
@@ -23,68 +28,248 @@ class RestClient(object):
                 Defaults to settings.RNA['BASE_URL']
             token (str): Token to add to Authorization HTTP header.
                 Defaults to settings.RNA.get('TOKEN', '')
-            cache (dict): Defaults to empty dict
+            cache (dict): Mapping used to cache responses, such as a
+                caches.LRUCache. Defaults to caches.get_cache()
+            session (requests.Session): Connection pooling session to
+                send requests with. Defaults to a new session configured
+                by get_session()
         """
         self.base_url = base_url or settings.RNA['BASE_URL']
-        self.cache = cache or {}
+        self.cache = cache if cache is not None else caches.get_cache()
         self.token = token or settings.RNA.get('TOKEN', '')
+        self.session = session or self.get_session()
 
-    def request(self, method, url, **kwargs):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections held by the session."""
+        self.session.close()
+
+    def get_session(self):
+        """
+        Returns a keep-alive requests.Session whose connection pools are
+        sized by settings.RNA['POOL_CONNECTIONS'] (number of hosts to keep
+        pools for), settings.RNA['POOL_MAXSIZE'] (connections kept per
+        host) and settings.RNA['POOL_BLOCK'] (wait for a free connection
+        rather than opening one outside of the pool).
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings.RNA.get('POOL_CONNECTIONS', 10),
+            pool_maxsize=settings.RNA.get('POOL_MAXSIZE', 10),
+            pool_block=settings.RNA.get('POOL_BLOCK', False))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def absolute_url(self, url):
         if self.base_url and not self.full_url_regex.match(url):
             url = self.base_url + url
+        return url
+
+    def request(self, method, url, **kwargs):
+        url = self.absolute_url(url)
         if self.token:
             kwargs.setdefault('headers', {})
             kwargs['headers'].setdefault(
                 'Authorization', 'Token ' + self.token)
         if not settings.RNA.get('VERIFY_SSL_CERT', True):
             kwargs['verify'] = False
-        return requests.request(method, url, **kwargs)
+        response = self.session.request(method, url, **kwargs)
+        if self.stats is not None:
+            self.stats.record_response(response)
+        return response
 
     def delete(self, url='', **kwargs):
-        self.cache.pop(url, None)
+        self.cache.pop(self.absolute_url(url), None)
         return self.request('delete', url, **kwargs)
 
     def get(self, url='', **kwargs):
         if kwargs.get('params', None):
             return self.request('get', url, **kwargs)
-        response = self.cache.get(url)
-        if not response:
-            response = self.request('get', url, **kwargs)
-            if response.status_code == 200:
-                self.cache[url] = response
+        key = self.absolute_url(url)
+        response = self.cache.get(key)
+        if response is None or getattr(response, 'needs_revalidation', False):
+            response = self.revalidate(url, response, **kwargs)
+        elif self.stats is not None:
+            self.stats.count_http('cache_hits')
+        return response
+
+    def revalidate(self, url, cached=None, **kwargs):
+        """
+        Requests url, conditionally on the validators of the cached response
+        if there is one, and returns the cached response if the server
+        answers 304 Not Modified. Successful responses are cached.
+        """
+        if cached is not None:
+            headers = kwargs['headers'] = dict(kwargs.get('headers') or {})
+            if cached.headers.get('ETag'):
+                headers.setdefault('If-None-Match', cached.headers['ETag'])
+            if cached.headers.get('Last-Modified'):
+                headers.setdefault('If-Modified-Since',
+                                   cached.headers['Last-Modified'])
+        response = self.request('get', url, **kwargs)
+        if cached is not None and response.status_code == 304:
+            for header in ('ETag', 'Last-Modified'):
+                if response.headers.get(header):
+                    cached.headers[header] = response.headers[header]
+            response = cached
+            response.needs_revalidation = False
+        if response.status_code == 200:
+            self.cache[self.absolute_url(url)] = response
         return response
 
     def options(self, url='', **kwargs):
-        self.cache.setdefault('OPTIONS', {})
-        if url not in self.cache['OPTIONS']:
-            self.cache['OPTIONS'][url] = self.request('options', url, **kwargs)
-        return self.cache['OPTIONS'][url]
+        key = ('OPTIONS', self.absolute_url(url))
+        response = self.cache.get(key)
+        if response is None:
+            response = self.cache[key] = self.request(
+                'options', url, **kwargs)
+        return response
 
     def post(self, url='', data=None, **kwargs):
-        self.cache.pop(url, None)
+        self.cache.pop(self.absolute_url(url), None)
         return self.request('post', url, data=data, **kwargs)
 
     def put(self, url='', data=None, **kwargs):
-        self.cache.pop(url, None)
+        self.cache.pop(self.absolute_url(url), None)
         return self.request('put', url, data=data, **kwargs)
 
 
 class RestModelClient(RestClient):
     model_map = {}
 
-    def __init__(self, base_url='', token='', cache=None, model_class=None):
+    def __init__(self, base_url='', token='', cache=None, session=None,
+                 model_class=None):
         self.model_class = model_class
+        self.identity_map = {}
         super(RestModelClient, self).__init__(base_url=base_url, token=token,
-                                              cache=cache)
+                                              cache=cache, session=session)
 
-    def model(self, model_class=None, save=False, modified=False, **kwargs):
+    def timer(self, phase):
+        """
+        Returns a context manager timing a phase of syncing model_class with
+        stats, which does nothing without stats.
+        """
+        if self.stats is None:
+            return stats.null_timer()
+        return self.stats.timer(self.model_class, phase)
+
+    def model(self, model_class=None, save=False, modified=False,
+              bulk=False, **kwargs):
+        self.identity_map = {}
         data = self.get(**kwargs).json()
         serializer = self.serializer(model_class or self.model_class)
         if isinstance(data, list):
-            return [self.restore(serializer, d, save, modified) for d in data]
+            return self.restore_many(serializer, data, save, modified, bulk)
         else:
             return self.restore(serializer, data, save, modified)
 
+    def iter_models(self, model_class=None, save=False, modified=False,
+                    bulk=False, chunk_size=None, url='', **kwargs):
+        """
+        Lazily restores the instances of a remote collection, page by page,
+        restoring and saving settings.RNA['SYNC_CHUNK_SIZE'] objects at a
+        time, so that only one page needs to be held in memory.
+        """
+        for instances in self.iter_chunks(model_class, save, modified, bulk,
+                                          chunk_size, url, **kwargs):
+            for instance in instances:
+                yield instance
+
+    def iter_chunks(self, model_class=None, save=False, modified=False,
+                    bulk=False, chunk_size=None, url='', **kwargs):
+        """
+        Like iter_models, but yields the list of instances restored (and
+        saved) together in each chunk.
+        """
+        self.identity_map = {}
+        serializer = self.serializer(model_class or self.model_class)
+        chunk_size = chunk_size or settings.RNA.get('SYNC_CHUNK_SIZE', 500)
+        for page in self.iter_pages(url, **kwargs):
+            for data in utils.chunked(page, chunk_size):
+                yield self.restore_many(serializer, data, save, modified, bulk)
+
+    def iter_pages(self, url='', cursor=None, **kwargs):
+        """
+        Yields the list of serialized objects in each page of a collection,
+        following the next links of paginated responses. An unpaginated
+        response is yielded as a single page. Pages are never cached.
+
+        Objects at or before cursor, a (modified, pk) pair, are skipped.
+        """
+        while url is not None:
+            with self.timer('fetch'):
+                response = self.request('get', url, **kwargs)
+                response.raise_for_status()
+                data = response.json()
+            if isinstance(data, list):
+                data, url = {'results': data}, None
+            else:
+                # next links already include the query string
+                url = data.get('next')
+                kwargs.pop('params', None)
+            page = self.after(data['results'], cursor)
+            if self.stats is not None:
+                self.record_page(data['results'], page)
+            yield page
+
+    def record_page(self, data, page):
+        modified = [parse_datetime(d['modified']) for d in data
+                    if d.get('modified')]
+        self.stats.fetched(self.model_class, data, page,
+                           max(modified) if modified else None)
+
+    def after(self, data, cursor):
+        """
+        Returns the serialized objects in data that come after cursor in
+        (modified, pk) order.
+        """
+        if cursor is None:
+            return data
+        return [d for d in data
+                if (parse_datetime(d['modified']), d['id']) > cursor]
+
+    def restore_many(self, serializer, data, save=False, modified=False,
+                     bulk=False):
+        """
+        Restores a list of instances, resolving all of the hyperlinks they
+        reference in bulk before restoring them one by one. With bulk=True
+        the instances are saved together by utils.bulk_upsert instead of
+        one at a time.
+        """
+        with self.timer('resolve'):
+            self.resolve_hyperlinks(serializer, data, save)
+        if not (save and bulk):
+            return [self.restore(serializer, d, save, modified) for d in data]
+        instances = [self.restore(serializer, d) for d in data]
+        with self.timer('save'):
+            utils.bulk_upsert(serializer.Meta.model, instances,
+                              modified=modified)
+        return instances
+
+    def resolve_hyperlinks(self, serializer, data, save=False):
+        """
+        Loads the instances referenced by the ForeignKey and ManyToManyField
+        hyperlinks in a list of serialized data into the identity map.
+        """
+        urls = {}
+        opts = serializer.Meta.model._meta
+        for field in opts.fields:
+            if isinstance(field, models.models.ForeignKey):
+                urls.setdefault(field.rel.to, set()).update(
+                    d[field.name] for d in data if d.get(field.name))
+        for field in opts.many_to_many:
+            for d in data:
+                urls.setdefault(field.rel.to, set()).update(
+                    d.get(field.name) or [])
+        for model_class, model_urls in urls.items():
+            self.hypermodels(model_urls, model_class, save)
+
     def restore(self, serializer, data, save=False, modified=False):
         data.pop('url', None)
         for field in serializer.Meta.model._meta.fields:
@@ -97,20 +282,25 @@ class RestModelClient(RestClient):
             data[field.name] = [self.hypermodel(url, field.rel.to, save)
                                 for url in data.pop(field.name, [])]
 
-        instance = serializer.restore_object(data)
+        with self.timer('decode'):
+            instance = serializer.restore_object(data)
         if save:
-            serializer.save_object(instance, modified=modified)
+            with self.timer('save'):
+                serializer.save_object(instance, modified=modified)
         return instance
 
     def model_client(self, url_name='', model_class=None, **kwargs):
         # TODO: decide appropriate level of error handling for this method
         if url_name and not model_class:
-            kwargs.setdefault('base_url', self.get().json()[url_name])
             model_class = self.model_map[url_name]
+            if model_class not in self.model_map:
+                kwargs.setdefault('base_url', self.get().json()[url_name])
         model_class = model_class or self.model_class
-        self.model_map.setdefault(
-            model_class,
-            self.__class__(model_class=model_class, **kwargs))
+        if model_class not in self.model_map:
+            kwargs.setdefault('session', self.session)
+            kwargs.setdefault('cache', self.cache)
+            self.model_map[model_class] = self.__class__(
+                model_class=model_class, **kwargs)
         return self.model_map[model_class]
 
     def post_instance(self, instance, url='', **kwargs):
@@ -120,7 +310,15 @@ class RestModelClient(RestClient):
         return self.put(url, self.serialize(instance), **kwargs)
 
     def serialize(self, instance):
-        return self.serializer(instance=instance).data
+        return self.serialize_many([instance])[0]
+
+    def serialize_many(self, instances):
+        """
+        Serializes instances of model_class into dicts with the cached
+        field plan of its client serializer.
+        """
+        return serializers.get_field_plan(self.model_class).serialize_many(
+            instances)
 
     def serializer(self, model_class=None, instance=None):
         model_class = model_class or self.model_class
@@ -130,14 +328,56 @@ class RestModelClient(RestClient):
     def hypermodel(self, url, model_class, save):
         if url:
             base_url, pk = url.rstrip('/').rsplit('/', 1)
+            key = (model_class, pk)
+            if key in self.identity_map:
+                return self.identity_map[key]
             try:
                 instance = model_class.objects.get(pk=pk)
             except ObjectDoesNotExist:
                 instance = self.model_client(
                     base_url=base_url + '/', model_class=model_class,
                     token=self.token).model(url='%s/' % pk, save=save)
+            self.identity_map[key] = instance
             return instance
 
+    def hypermodels(self, urls, model_class, save):
+        """
+        Resolves many hyperlinks to instances of model_class, skipping those
+        already in the identity map, looking the rest up with a single
+        pk__in query, and concurrently fetching any that are still missing
+        from the API using settings.RNA['FETCH_WORKERS'] threads.
+        """
+        missing = {}
+        for url in urls:
+            base_url, pk = url.rstrip('/').rsplit('/', 1)
+            if (model_class, pk) not in self.identity_map:
+                missing.setdefault(base_url + '/', set()).add(pk)
+        pks = set().union(*missing.values())
+        if not pks:
+            return
+        for instance in model_class.objects.filter(pk__in=sorted(pks)):
+            self.identity_map[(model_class, '%s' % instance.pk)] = instance
+            pks.discard('%s' % instance.pk)
+
+        for base_url, base_pks in missing.items():
+            base_pks = sorted(base_pks & pks)
+            if not base_pks:
+                continue
+            client = self.model_client(
+                base_url=base_url, model_class=model_class, token=self.token)
+            client.identity_map = self.identity_map
+            workers = min(len(base_pks), settings.RNA.get('FETCH_WORKERS', 4))
+            pool = ThreadPool(workers)
+            try:
+                data = pool.map(
+                    lambda pk: client.get('%s/' % pk).json(), base_pks)
+            finally:
+                pool.close()
+                pool.join()
+            instances = client.restore_many(client.serializer(), data, save)
+            for pk, instance in zip(base_pks, instances):
+                self.identity_map[(model_class, pk)] = instance
+
 
 class RNAModelClient(RestModelClient):
     model_map = {
@@ -2,16 +2,78 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import ForeignKey
+from rest_framework import status
+from rest_framework.exceptions import APIException
 from rest_framework.filters import DjangoFilterBackend
 import django_filters
 
 from . import fields, models
 
 
+logger = logging.getLogger(__name__)
+
+FILTER_POLICIES = ('all', 'indexed', 'warn', 'reject')
+
+# Compiled AutoFilterSet classes, by (filter set base class, model,
+# excluded fields, policy)
+_filter_classes = {}
+
+
 class ISO8601DateTimeFilter(django_filters.DateTimeFilter):
     field_class = fields.ISO8601DateTimeField
 
 
+class UnindexedFilter(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Filtering or ordering on unindexed fields.'
+
+    def __init__(self, detail=None):
+        self.detail = detail or self.default_detail
+
+
+def get_filter_policy():
+    """
+    Returns settings.RNA['FILTER_POLICY'], which decides what happens to
+    the filters and orderings of automatic filter classes that no index
+    backs:
+
+        'all' (default): they are allowed.
+        'indexed': they are left out, so that their filters are ignored
+            like any unknown parameter, and their orderings match nothing
+            like any invalid one.
+        'warn': they are allowed, but logged as warnings.
+        'reject': they are answered with 400 Bad Request.
+
+    Unless the policy is 'all', results are ordered on an indexed field by
+    default.
+    """
+    policy = settings.RNA.get('FILTER_POLICY', 'all')
+    if policy not in FILTER_POLICIES:
+        raise ImproperlyConfigured(
+            "settings.RNA['FILTER_POLICY'] must be one of %s, not %r" % (
+                ', '.join(FILTER_POLICIES), policy))
+    return policy
+
+
+def indexed_fields(model):
+    """
+    Returns the names of the fields of model that lead an index: primary
+    keys, unique, db_index and foreign key fields, and the first fields of
+    unique_together, which also leads Release's (product, channel,
+    version_key) index.
+    """
+    names = set(f.name for f in model._meta.fields
+                if f.primary_key or f.unique or f.db_index or
+                isinstance(f, ForeignKey))
+    names.update(together[0] for together in model._meta.unique_together)
+    return names
+
+
 class TimestampedFilterBackend(DjangoFilterBackend):
     def get_filter_class(self, view, queryset=None):
         filter_class = getattr(view, 'filter_class', None)
@@ -22,26 +84,107 @@ class TimestampedFilterBackend(DjangoFilterBackend):
             return super(TimestampedFilterBackend, self).get_filter_class(
                 view, queryset=queryset)
 
-        elif queryset and hasattr(queryset, 'model') and issubclass(
-                queryset.model, models.TimeStampedModel):
-            class AutoFilterSet(self.default_filter_set):
-                created_before = ISO8601DateTimeFilter(
-                    name='created', lookup_type='lt')
-                created_after = ISO8601DateTimeFilter(
-                    name='created', lookup_type='gte')
-
-                modified_before = ISO8601DateTimeFilter(
-                    name='modified', lookup_type='lt')
-                modified_after = ISO8601DateTimeFilter(
-                    name='modified', lookup_type='gte')
-
-                class Meta:
-                    model = queryset.model
-                    fields = ['created_before', 'created_after',
-                              'modified_before', 'modified_after']
-                    fields.extend(f.name for f in model._meta.fields
-                                  if f.name not in ('created', 'modified'))
-                    fields = [f for f in fields
-                              if f not in filter_fields_exclude]
-                    order_by = True
+        # Test queryset against None, as its truth value runs the query
+        elif queryset is not None and issubclass(
+                getattr(queryset, 'model', object), models.TimeStampedModel):
+            policy = get_filter_policy()
+            key = (self.default_filter_set, queryset.model,
+                   frozenset(filter_fields_exclude), policy)
+            if key not in _filter_classes:
+                _filter_classes[key] = self.compile_filter_class(
+                    queryset.model, filter_fields_exclude, policy)
+            return _filter_classes[key]
+
+    def compile_filter_class(self, model_class, filter_fields_exclude=(),
+                             policy='all'):
+        """
+        Returns a filter class for model_class, with created_ and
+        modified_ before and after filters, equality filters on every other
+        field not in filter_fields_exclude, and orderings on all of them,
+        as allowed by policy.
+        """
+        indexed = indexed_fields(model_class)
+
+        class AutoFilterSet(self.default_filter_set):
+            created_before = ISO8601DateTimeFilter(
+                name='created', lookup_type='lt')
+            created_after = ISO8601DateTimeFilter(
+                name='created', lookup_type='gte')
+
+            modified_before = ISO8601DateTimeFilter(
+                name='modified', lookup_type='lt')
+            modified_after = ISO8601DateTimeFilter(
+                name='modified', lookup_type='gte')
+
+            class Meta:
+                model = model_class
+                fields = ['created_before', 'created_after',
+                          'modified_before', 'modified_after']
+                fields.extend(f.name for f in model._meta.fields
+                              if f.name not in ('created', 'modified'))
+                fields = [f for f in fields
+                          if f not in filter_fields_exclude]
+                order_by = True
+
+            def get_order_by(self, order_choice):
+                # Break ties on pk, so that results have a total order
+                # that a sync can be resumed from
+                pk = '-pk' if order_choice.startswith('-') else 'pk'
+                return [order_choice, pk]
+
+        AutoFilterSet.unindexed_filters = set(
+            name for name, filter_ in AutoFilterSet.base_filters.items()
+            if filter_.name not in indexed)
+        AutoFilterSet.unindexed_orderings = set(
+            filter_.name for filter_ in AutoFilterSet.base_filters.values()
+            if filter_.name not in indexed)
+        if policy == 'all':
             return AutoFilterSet
+
+        if policy == 'indexed':
+            for name in AutoFilterSet.unindexed_filters:
+                del AutoFilterSet.base_filters[name]
+            AutoFilterSet.unindexed_filters = set()
+            AutoFilterSet.unindexed_orderings = set()
+        # List the indexed orderings first, as the first one is the default
+        names = []
+        for filter_ in AutoFilterSet.base_filters.values():
+            if filter_.name not in names:
+                names.append(filter_.name)
+        names.sort(key=lambda name: name not in indexed)
+        order_by = []
+        for name in names:
+            order_by.extend([name, '-' + name])
+        AutoFilterSet._meta.order_by = order_by
+        return AutoFilterSet
+
+    def filter_queryset(self, request, queryset, view):
+        filter_class = self.get_filter_class(view, queryset)
+        if filter_class:
+            self.check_policy(request, filter_class)
+            return filter_class(request.QUERY_PARAMS, queryset=queryset).qs
+        return queryset
+
+    def check_policy(self, request, filter_class):
+        """
+        Warns about or rejects the filters and ordering of request that no
+        index backs, under the 'warn' and 'reject' policies.
+        """
+        policy = get_filter_policy()
+        if policy not in ('warn', 'reject'):
+            return
+        unindexed = sorted(
+            name for name in getattr(filter_class, 'unindexed_filters', ())
+            if request.QUERY_PARAMS.get(name))
+        ordering = request.QUERY_PARAMS.get(filter_class.order_by_field, '')
+        if ordering.lstrip('-') in getattr(
+                filter_class, 'unindexed_orderings', ()):
+            unindexed.append('%s=%s' % (filter_class.order_by_field,
+                                        ordering))
+        if not unindexed:
+            return
+        message = 'Filtering or ordering on unindexed fields: %s' % (
+            ', '.join(unindexed))
+        if policy == 'reject':
+            raise UnindexedFilter(message)
+        logger.warning('path=%s %s', request.path, message)
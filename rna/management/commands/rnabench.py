@@ -0,0 +1,143 @@
+from datetime import datetime
+import json
+from optparse import make_option
+import os
+import platform
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from ...benchmarks import generator, scenarios, server
+
+
+# The urls module of the package this command is part of, wherever it is
+# imported from
+URLCONF = '%s.urls' % __name__.rsplit('.', 3)[0]
+
+
+class Command(BaseCommand):
+    help = ('Generates a synthetic dataset in a temporary test database and '
+            'times the scenarios in rna.benchmarks.scenarios against it: %s.'
+            % ', '.join(scenarios.SCENARIOS))
+    option_list = BaseCommand.option_list + (
+        make_option('--releases', type='int', dest='releases', default=1000,
+                    help='Number of generated releases.'),
+        make_option('--notes', type='int', dest='notes', default=10000,
+                    help='Number of generated notes.'),
+        make_option('--fanout', type='int', dest='fanout', default=3,
+                    help='Maximum number of releases per generated note.'),
+        make_option('--seed', type='int', dest='seed', default=0,
+                    help='Seed of the generated dataset.'),
+        make_option('--repeat', type='int', dest='repeat', default=5,
+                    help='Number of timed runs of each scenario.'),
+        make_option('--scenario', action='append', dest='scenarios',
+                    default=None,
+                    help='Run only this scenario. May be given repeatedly.'),
+        make_option('--output', dest='output', default=None,
+                    help='Save the results to this JSON file.'),
+        make_option('--compare', dest='compare', default=None,
+                    help='Compare the results with those saved in this '
+                         'JSON file, failing on regressions.'),
+        make_option('--threshold', type='float', dest='threshold',
+                    default=0.1,
+                    help='Relative slowdown of a median time counted as a '
+                         'regression by --compare.'),
+        make_option('--urlconf', dest='urlconf', default=URLCONF,
+                    help='URLconf the scenarios are run against, %s by '
+                         'default.' % URLCONF),
+    )
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(scenarios.SCENARIOS)
+        unknown = [n for n in names if n not in scenarios.SCENARIOS]
+        if unknown:
+            raise CommandError('Unknown scenarios: %s' % ', '.join(unknown))
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        dataset = generator.Dataset(
+            releases=options['releases'], notes=options['notes'],
+            fanout=options['fanout'], seed=options['seed'])
+        verbosity = int(options.get('verbosity', 1))
+        results = self.run(dataset, names, options['repeat'], verbosity,
+                           options['urlconf'])
+        report = {'meta': self.meta(dataset, options), 'results': results}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if baseline is not None:
+            comparison = scenarios.compare(
+                baseline['results'], results, options['threshold'])
+            regressions = [c[0] for c in comparison if c[4]]
+            for name, old, new, ratio, regressed in comparison:
+                self.stdout.write('%-24s %9.1fms -> %9.1fms %+7.1f%%%s\n' % (
+                    name, old * 1000, new * 1000, (ratio - 1) * 100,
+                    ' REGRESSION' if regressed else ''))
+            if regressions:
+                raise CommandError('Regressions: %s' % ', '.join(regressions))
+
+    def run(self, dataset, names, repeat, verbosity=1, urlconf=URLCONF):
+        """
+        Populates a new test database with dataset, runs the scenarios
+        against it with urlconf and destroys it.
+        """
+        try:
+            from south.management.commands import patch_for_test_db_setup
+        except ImportError:
+            pass
+        else:
+            patch_for_test_db_setup()
+        old_name = connection.settings_dict['NAME']
+        if (connection.vendor == 'sqlite' and
+                not connection.settings_dict.get('TEST_NAME')):
+            # the threads of rnasync --pipeline can't share an in-memory
+            # database
+            connection.settings_dict['TEST_NAME'] = os.path.join(
+                tempfile.gettempdir(), 'rnabench.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            start = time.time()
+            dataset.populate()
+            if verbosity > 1:
+                self.stdout.write('Generated %d releases and %d notes in '
+                                  '%.1fs\n' % (dataset.releases,
+                                               dataset.notes,
+                                               time.time() - start))
+            with server.StubServer(dataset) as stub:
+                context = scenarios.Context(dataset)
+                with override_settings(
+                        ROOT_URLCONF=urlconf, DEBUG=False,
+                        RNA=dict(settings.RNA, BASE_URL=stub.url)):
+                    return scenarios.run(context, names, repeat,
+                                         callback=self.report)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def report(self, name, result):
+        self.stdout.write(
+            '%-24s median %9.1fms  min %9.1fms  %5d queries\n' % (
+                name, result['median'] * 1000, result['min'] * 1000,
+                result['queries']))
+
+    def meta(self, dataset, options):
+        return {
+            'date': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'releases': dataset.releases,
+            'notes': dataset.notes,
+            'fanout': dataset.fanout,
+            'seed': dataset.seed,
+            'repeat': options['repeat'],
+        }
@@ -0,0 +1,272 @@
+import gzip
+import json
+import os
+import re
+import time
+from contextlib import closing, contextmanager
+from itertools import islice
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+
+from ... import models, pipeline, stats, utils
+
+
+# The model of a dump, from the hyperlink of its objects or its file name
+SOURCES = {'releases': models.Release, 'notes': models.Note}
+SOURCE_REGEX = re.compile(r'(releases|notes)(?:/\d+/?$|\.)')
+PK_REGEX = re.compile(r'(\d+)/?$')
+
+
+def open_dump(path):
+    """
+    Opens a dump file, decompressing it if its name ends in .gz, and
+    returns it wrapped in a context manager that closes it, which gzip
+    files are not themselves before Python 2.7.
+    """
+    if path.endswith('.gz'):
+        return closing(gzip.open(path, 'rb'))
+    return closing(open(path, 'rb'))
+
+
+def read_dump(f):
+    """
+    Yields the serialized objects of a dump, either a JSON array or
+    newline delimited JSON, one object per line as exported by
+    views.ExportView. Only NDJSON is read lazily.
+    """
+    # Read lines with readline, which can be mixed with read unlike
+    # iteration over a file
+    for number, line in enumerate(iter(f.readline, ''), 1):
+        if not line.strip():
+            continue
+        if line.lstrip().startswith('['):
+            for obj in json.loads(line + f.read()):
+                yield obj
+            return
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise CommandError('%s, line %d: %s' % (
+                getattr(f, 'name', 'dump'), number, e))
+
+
+def hyperlink_pk(value):
+    """
+    Returns the pk of a related object, serialized as a hyperlink or as
+    the pk itself, or None.
+    """
+    if value is None or isinstance(value, (int, long)):
+        return value
+    match = PK_REGEX.search(value)
+    if match is None:
+        raise CommandError('Invalid related object: %r' % value)
+    return int(match.group(1))
+
+
+def decode(model_class, obj):
+    """
+    Returns an unsaved instance of model_class from a serialized object,
+    converting its values with the model fields rather than a serializer.
+    Hyperlinks are reduced to the pks they end with, so that the related
+    objects are never fetched, and the pks of ManyToManyField objects are
+    set in _m2m_data for utils.bulk_upsert.
+    """
+    opts = model_class._meta
+    values = []
+    for field in opts.fields:
+        if field.name not in obj:
+            values.append(field.get_default())
+        elif field.rel is not None:
+            values.append(hyperlink_pk(obj[field.name]))
+        else:
+            values.append(field.to_python(obj[field.name]))
+    # Positional values take the fast path of Model.__init__
+    instance = model_class(*values)
+    instance._m2m_data = dict(
+        (field.name, [hyperlink_pk(v) for v in obj[field.name] or []])
+        for field in opts.many_to_many if field.name in obj)
+    return instance
+
+
+def check_references(model_class, instances, using):
+    """
+    Raises a CommandError if instances of model_class reference related
+    objects that are neither in the database nor among instances, with a
+    query per related model and 500 pks, so that no batch with a dangling
+    reference is ever written.
+    """
+    opts = model_class._meta
+    references = {}
+    for field in opts.fields:
+        if field.rel is not None:
+            references.setdefault(field.rel.to, set()).update(
+                getattr(i, field.attname) for i in instances)
+    for field in opts.many_to_many:
+        for instance in instances:
+            references.setdefault(field.rel.to, set()).update(
+                instance._m2m_data.get(field.name, ()))
+    for related, pks in references.items():
+        pks.discard(None)
+        if related is model_class:
+            pks.difference_update(i.pk for i in instances)
+        missing = set(pks)
+        manager = related._default_manager.db_manager(using)
+        for chunk in utils.chunked(pks, 500):
+            missing.difference_update(manager.filter(
+                pk__in=chunk).values_list('pk', flat=True))
+        if missing:
+            raise CommandError('Missing %s referenced by %s: %s' % (
+                models.model_label(related), models.model_label(model_class),
+                ', '.join(str(pk) for pk in sorted(missing))))
+
+
+@contextmanager
+def deferred_checks(connection):
+    """
+    Turns off the constraint checks of the connection that the database
+    can do without, as loaddata does: foreign key checks on MySQL, where
+    unique indexes are also left unchecked, and on Oracle. PostgreSQL
+    foreign keys are already deferred to the end of each transaction, and
+    SQLite ones not enforced. The references of each batch are checked by
+    check_references before it is written instead.
+    """
+    with connection.constraint_checks_disabled():
+        if connection.vendor == 'mysql':
+            connection.cursor().execute('SET unique_checks=0')
+        try:
+            yield
+        finally:
+            if connection.vendor == 'mysql':
+                connection.cursor().execute('SET unique_checks=1')
+
+
+class Command(BaseCommand):
+    args = '<dump dump ...>'
+    help = ('Loads dumps of releases and notes, as exported by '
+            '/export/releases.ndjson and /export/notes.ndjson, in bulk.')
+    option_list = BaseCommand.option_list + (
+        make_option('--model', dest='model', default=None,
+                    choices=sorted(SOURCES),
+                    help='Model of every dump, instead of the one detected '
+                         'from its objects or file name.'),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=1000,
+                    help='Number of objects written at a time.'),
+        make_option('--stats', action='store_true', dest='stats',
+                    default=False,
+                    help='Print per model counts and timings, throughput '
+                         'and memory use.'),
+        make_option('--stats-file', dest='stats_file', default=None,
+                    help='Write the --stats to this file as JSON.'),
+    )
+
+    def handle(self, *paths, **options):
+        if not paths:
+            raise CommandError('No dumps given')
+        verbosity = int(options.get('verbosity', 1))
+        dumps = [(self.dump_model(path, options['model']), path)
+                 for path in paths]
+        model_classes = pipeline.dependency_order(
+            set(model_class for model_class, path in dumps))
+        dumps.sort(key=lambda dump: model_classes.index(dump[0]))
+
+        using = router.db_for_write(models.Release)
+        connection = connections[using]
+        import_stats = stats.SyncStats(model_classes)
+        import_stats.start()
+        try:
+            with deferred_checks(connection):
+                for model_class, path in dumps:
+                    count = self.load(model_class, path, using,
+                                      options['batch_size'], import_stats,
+                                      verbosity)
+                    if verbosity:
+                        self.stdout.write('Imported %d %s from %s\n' % (
+                            count, models.model_label(model_class), path))
+            self.reset_sequences(model_classes, using)
+        finally:
+            import_stats.stop()
+        if options['stats']:
+            self.stdout.write(import_stats.format())
+        elif verbosity:
+            data = import_stats.as_dict()
+            self.stdout.write('Total: %d objects in %.2fs (%.1f/s)\n' % (
+                data['objects'], data['elapsed'],
+                data['objects_per_second'] or 0))
+        if options['stats_file']:
+            with open(options['stats_file'], 'w') as f:
+                json.dump(import_stats.as_dict(), f, indent=2)
+
+    def reset_sequences(self, model_classes, using):
+        """
+        Moves the pk sequences of model_classes past the pks imported, as
+        loaddata does, for the databases that have them.
+        """
+        connection = connections[using]
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), model_classes)
+        if statements:
+            cursor = connection.cursor()
+            for sql in statements:
+                cursor.execute(sql)
+            transaction.commit_unless_managed(using=using)
+
+    def dump_model(self, path, name=None):
+        """
+        Returns the model of the dump at path: the one named name, else the
+        one its first object links to, else the one in its file name.
+        """
+        if name is not None:
+            return SOURCES[name]
+        try:
+            with open_dump(path) as f:
+                for obj in read_dump(f):
+                    match = SOURCE_REGEX.search(obj.get('url') or '')
+                    if match is not None:
+                        return SOURCES[match.group(1)]
+                    break
+        except IOError as e:
+            raise CommandError(str(e))
+        match = SOURCE_REGEX.search(os.path.basename(path))
+        if match is None:
+            raise CommandError(
+                'Unknown model of %s, pass --model' % path)
+        return SOURCES[match.group(1)]
+
+    def load(self, model_class, path, using, batch_size, import_stats,
+             verbosity=1):
+        """
+        Writes the objects of the dump at path with utils.bulk_upsert,
+        batch_size at a time, keeping their timestamps, and returns their
+        number. The references of each batch are checked before it is
+        written. Each batch is committed on its own, so that an interrupted
+        import can be run again from the start, and is reported with the
+        throughput so far.
+        """
+        count = 0
+        start = time.time()
+        with open_dump(path) as f:
+            objs = read_dump(f)
+            while True:
+                with import_stats.timer(model_class, 'fetch'):
+                    batch = list(islice(objs, batch_size))
+                if not batch:
+                    return count
+                with import_stats.timer(model_class, 'decode'):
+                    instances = [decode(model_class, obj) for obj in batch]
+                modified = [i.modified for i in instances if i.modified]
+                import_stats.fetched(model_class, batch, batch,
+                                     max(modified) if modified else None)
+                with import_stats.timer(model_class, 'resolve'):
+                    check_references(model_class, instances, using)
+                with import_stats.timer(model_class, 'save'):
+                    utils.bulk_upsert(model_class, instances, modified=False,
+                                      using=using, batch_size=batch_size)
+                count += len(instances)
+                if verbosity:
+                    self.stdout.write('%s: %d objects (%.1f/s)\n' % (
+                        models.model_label(model_class), count,
+                        count / max(time.time() - start, 1e-6)))
@@ -0,0 +1,44 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+
+from ... import models, search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of releases and notes.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=500,
+                    help='Number of objects indexed at a time.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        for model_class in (models.Release, models.Note):
+            count = self.reindex(model_class, options['batch_size'])
+            if verbosity:
+                self.stdout.write('Indexed %d %s\n' % (
+                    count, models.model_label(model_class)))
+
+    def reindex(self, model_class, batch_size):
+        """
+        Replaces the index of model_class in a single transaction, reading
+        batch_size objects at a time in pk order, and returns their number.
+        The index is installed first, outside of the transaction, if it
+        does not exist yet.
+        """
+        using = router.db_for_write(model_class)
+        backend = search.install(using)
+        queryset = model_class._default_manager.db_manager(using).only(
+            *search.SEARCH_FIELDS[model_class]).order_by('pk')
+        count = 0
+        with transaction.commit_on_success(using=using):
+            backend.clear(model_class)
+            batch = list(queryset[:batch_size])
+            while batch:
+                backend.index(model_class, batch)
+                count += len(batch)
+                batch = list(queryset.filter(pk__gt=batch[-1].pk)[:batch_size])
+        return count
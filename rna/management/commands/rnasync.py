@@ -1,34 +1,198 @@
+import json
+import logging
+from optparse import make_option
+
+from django.conf import settings
 from django.core.mail import mail_admins
 from django.core.management.base import BaseCommand, CommandError
 from django.core.exceptions import ObjectDoesNotExist
 
 from requests.exceptions import RequestException
 
-from ... import clients
+from ... import clients, models, pipeline, stats
+
+
+logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
     # TODO: args, help, docstrings
+    option_list = BaseCommand.option_list + (
+        make_option('--bulk', action='store_true', dest='bulk', default=False,
+                    help='Write each page with bulk inserts and updates in '
+                         'a single transaction.'),
+        make_option('--pipeline', action='store_true', dest='pipeline',
+                    default=False,
+                    help='Fetch, decode and save concurrently.'),
+        make_option('--workers', type='int', dest='workers', default=None,
+                    help='Number of fetch threads used by --pipeline.'),
+        make_option('--queue-size', type='int', dest='queue_size',
+                    default=None,
+                    help='Number of chunks buffered between --pipeline '
+                         'stages.'),
+        make_option('--resume', action='store_true', dest='resume',
+                    default=False,
+                    help='Only sync the models whose last sync did not '
+                         'complete, continuing from their last checkpoint.'),
+        make_option('--stats', action='store_true', dest='stats',
+                    default=False,
+                    help='Print per model counts and timings, throughput, '
+                         'memory use and lag behind upstream.'),
+        make_option('--stats-file', dest='stats_file', default=None,
+                    help='Write the --stats to this file as JSON.'),
+    )
 
-    def model_params(self, models):
-        params = dict((m, {}) for m in models)
+    def model_params(self, models, states=None):
+        """
+        Returns the query params for the first page of each model's
+        collection: pages of modified objects in (modified, pk) order,
+        starting from the model's sync checkpoint, or else its latest local
+        object.
+        """
+        states = states or {}
+        page_size = settings.RNA.get('SYNC_CHUNK_SIZE', 500)
+        params = dict((m, {'page_size': page_size}) for m in models)
         for m in models:
-            try:
-                latest = m.objects.latest('modified')
-            except ObjectDoesNotExist:
-                pass
+            state = states.get(m)
+            if state is not None and state.modified:
+                modified = state.modified
             else:
-                params[m]['modified_after'] = latest.modified.isoformat()
+                try:
+                    modified = m.objects.latest('modified').modified
+                except ObjectDoesNotExist:
+                    continue
+            params[m]['modified_after'] = modified.isoformat()
+            params[m]['o'] = 'modified'
         return params
 
+    def sync_states(self, model_classes):
+        """Returns the SyncState of each model class, creating missing ones."""
+        return dict(
+            (m, models.SyncState.objects.get_or_create(
+                model=models.model_label(m))[0])
+            for m in model_classes)
+
+    def callbacks(self, states):
+        """
+        Returns the checkpoint and complete callbacks of sync and
+        pipeline.SyncPipeline, recording progress in states.
+        """
+        def checkpoint(model_class, instances):
+            states[model_class].advance(instances)
+
+        def complete(model_class):
+            states[model_class].finish()
+        return {'checkpoint': checkpoint, 'complete': complete}
+
     def handle(self, *args, **options):
-        rc = clients.RNAModelClient()
-        model_params = self.model_params(rc.model_map.values())
-        try:
-            for url_name, model_class in rc.model_map.items():
-                params = model_params[model_class]
-                rc.model_client(url_name).model(save=True, params=params)
-        except RequestException as e:
-            subject = 'Problem connecting to Nucleus'
-            mail_admins(subject, str(e))
-            raise CommandError('%s: %s' % (subject, e))
+        with clients.RNAModelClient() as rc:
+            url_names = dict((model_class, url_name) for url_name, model_class
+                             in rc.model_map.items()
+                             if isinstance(url_name, basestring))
+            model_classes = pipeline.dependency_order(url_names)
+            states = self.sync_states(model_classes)
+            if options['resume']:
+                model_classes = [m for m in model_classes
+                                 if states[m].status != 'complete']
+                if not model_classes:
+                    raise CommandError('Nothing to resume')
+            model_params = self.model_params(model_classes, states)
+            cursors = dict((m, states[m].cursor()) for m in model_classes)
+            sync_stats = None
+            if options['stats'] or options['stats_file']:
+                sync_stats = stats.SyncStats(model_classes)
+                rc.stats = sync_stats
+                sync_stats.start()
+            for model_class in model_classes:
+                states[model_class].start()
+            try:
+                model_clients = [(m, rc.model_client(url_names[m]))
+                                 for m in model_classes]
+                for model_class, client in model_clients:
+                    client.stats = sync_stats
+                if options['pipeline']:
+                    counts = pipeline.SyncPipeline(
+                        model_clients, model_params,
+                        workers=options['workers'],
+                        queue_size=options['queue_size'],
+                        bulk=options['bulk'], cursors=cursors,
+                        **self.callbacks(states)).run()
+                else:
+                    counts = self.sync(model_clients, model_params,
+                                       bulk=options['bulk'], cursors=cursors,
+                                       **self.callbacks(states))
+            except RequestException as e:
+                self.fail(states, model_classes, sync_stats, options)
+                subject = 'Problem connecting to Nucleus'
+                mail_admins(subject, str(e))
+                raise CommandError('%s: %s' % (subject, e))
+            except Exception:
+                self.fail(states, model_classes, sync_stats, options)
+                raise
+            if sync_stats is not None:
+                self.report_stats(sync_stats, model_classes, options)
+
+        if int(options.get('verbosity', 1)) > 1:
+            for model_class in model_classes:
+                self.stdout.write('Synced %d %s\n' % (
+                    counts[model_class], url_names[model_class]))
+
+    def report_stats(self, sync_stats, model_classes, options):
+        """
+        Stops sync_stats and outputs them. Models with nothing new upstream
+        are as recent as their latest local object.
+        """
+        sync_stats.stop()
+        for model_class in model_classes:
+            if sync_stats.model(model_class)['newest_modified'] is None:
+                try:
+                    sync_stats.saw_modified(
+                        model_class,
+                        model_class.objects.latest('modified').modified)
+                except ObjectDoesNotExist:
+                    pass
+        if options['stats']:
+            self.stdout.write(sync_stats.format())
+        if options['stats_file']:
+            with open(options['stats_file'], 'w') as f:
+                json.dump(sync_stats.as_dict(), f, indent=2)
+
+    def fail(self, states, model_classes, sync_stats, options):
+        """
+        Marks the running models failed and outputs the stats of the
+        failed sync, logging rather than raising any error in doing so, to
+        leave the one that failed the sync to be raised.
+        """
+        self.finish(states, model_classes, 'failed')
+        if sync_stats is not None:
+            try:
+                self.report_stats(sync_stats, model_classes, options)
+            except Exception:
+                logger.exception('Could not report the stats of the sync')
+
+    def finish(self, states, model_classes, status):
+        for model_class in model_classes:
+            if states[model_class].status == 'running':
+                states[model_class].finish(status)
+
+    def sync(self, model_clients, model_params, bulk=False, cursors=None,
+             checkpoint=None, complete=None):
+        """
+        Syncs each model in turn, returning the number of instances saved
+        per model class. checkpoint is called with the model class and the
+        instances of each chunk once they have been saved, and complete
+        with the model class once all of them have.
+        """
+        cursors = cursors or {}
+        counts = {}
+        for model_class, client in model_clients:
+            counts[model_class] = 0
+            for instances in client.iter_chunks(
+                    save=True, params=model_params[model_class], bulk=bulk,
+                    cursor=cursors.get(model_class)):
+                if checkpoint:
+                    checkpoint(model_class, instances)
+                counts[model_class] += len(instances)
+            if complete:
+                complete(model_class)
+        return counts
@@ -0,0 +1,134 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from contextlib import contextmanager
+import logging
+import threading
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections, reset_queries
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_keeping = [0]
+
+
+def keep_queries():
+    """
+    Stops connection.queries from being reset at the start of every
+    request, until release_queries is called as many times.
+    """
+    with _lock:
+        if not _keeping[0]:
+            request_started.disconnect(reset_queries)
+        _keeping[0] += 1
+
+
+def release_queries():
+    with _lock:
+        _keeping[0] -= 1
+        if not _keeping[0]:
+            request_started.connect(reset_queries)
+
+
+class QueryRecorder(object):
+    """
+    Records the queries run on a database connection within a with block,
+    along with their time, from the connection's debug cursor.
+
+    With across_requests=True, the queries of requests made within the
+    block, e.g. by the test client, are all kept rather than only those of
+    the last request.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, across_requests=True):
+        self.connection = connections[using]
+        self.across_requests = across_requests
+        self.queries = []
+
+    def __enter__(self):
+        self.use_debug_cursor = self.connection.use_debug_cursor
+        self.connection.use_debug_cursor = True
+        if self.across_requests:
+            keep_queries()
+        self.start = len(self.connection.queries)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def stop(self):
+        self.queries = self.connection.queries[self.start:]
+        self.connection.use_debug_cursor = self.use_debug_cursor
+        if self.across_requests:
+            release_queries()
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time(self):
+        """The total time of the recorded queries, in seconds."""
+        return sum(float(q['time']) for q in self.queries)
+
+    def slowest(self, n=3):
+        """Returns the n slowest recorded queries, slowest first."""
+        return sorted(self.queries, key=lambda q: float(q['time']),
+                      reverse=True)[:n]
+
+
+@contextmanager
+def assert_max_queries(budget, using=DEFAULT_DB_ALIAS):
+    """
+    Fails with an AssertionError listing the queries if the with block
+    runs more than budget queries, e.g.:
+
+        with assert_max_queries(3):
+            self.client.get('/rna/releases/1/notes/')
+    """
+    with QueryRecorder(using) as recorder:
+        yield recorder
+    if recorder.count > budget:
+        raise AssertionError('%d queries exceeded the budget of %d:\n%s' % (
+            recorder.count, budget,
+            '\n'.join(q['sql'] for q in recorder.queries)))
+
+
+class QueryCountMiddleware(object):
+    """
+    Records the queries of each request, adding their number and total
+    time in milliseconds to the response in the X-RNA-Queries and
+    X-RNA-DB-Time headers, and logging them along with the
+    settings.RNA['SLOW_QUERY_COUNT'] (3 by default) slowest statements to
+    the rna.middleware logger.
+    """
+
+    def process_request(self, request):
+        request._rna_query_recorder = QueryRecorder(across_requests=False)
+        request._rna_query_recorder.__enter__()
+
+    def process_response(self, request, response):
+        recorder = getattr(request, '_rna_query_recorder', None)
+        if recorder is None:
+            return response
+        del request._rna_query_recorder
+        recorder.stop()
+        db_time = recorder.time * 1000
+        response['X-RNA-Queries'] = str(recorder.count)
+        response['X-RNA-DB-Time'] = '%.1f' % db_time
+        slowest = recorder.slowest(settings.RNA.get('SLOW_QUERY_COUNT', 3))
+        logger.info(
+            'method=%s path=%s status=%d queries=%d db_time=%.1f',
+            request.method, request.path, response.status_code,
+            recorder.count, db_time,
+            extra={'queries': recorder.count, 'db_time': db_time,
+                   'slowest': [q['sql'] for q in slowest]})
+        for query in slowest:
+            logger.debug('path=%s time=%.1f sql=%s', request.path,
+                         float(query['time']) * 1000, query['sql'])
+        return response
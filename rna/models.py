@@ -3,11 +3,102 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from datetime import datetime
+import operator
+import re
+import threading
+import time
 
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import connection, models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils.datastructures import SortedDict
 from django_extensions.db.fields import CreationDateTimeField
 
+from .signals import bulk_saved
+
+
+def model_label(model_class):
+    """Returns the app_label.modelname label of a model class."""
+    opts = model_class._meta
+    return '%s.%s' % (opts.app_label, opts.object_name.lower())
+
+
+VERSION_REGEX = re.compile(r'^(\d+(?:\.\d+)*)([a-z]*)(\d*)(.*)$', re.I)
+VERSION_SUFFIX_RANKS = {'a': 1, 'alpha': 1, 'b': 2, 'beta': 2, 'rc': 3,
+                        '': 4, 'esr': 5}
+
+
+def version_key(version):
+    """
+    Returns a string that sorts like version, for Release.version_key:
+    numeric segments are zero-padded, with at least four of them, then
+    come the rank of the suffix (alpha, beta and release candidate before
+    the release itself, then ESR) and its number, so that for instance
+    9.0 < 10.0a2 < 10.0beta < 10.0 < 10.0.1 < 10.0esr.
+    """
+    match = VERSION_REGEX.match(version.strip())
+    if not match:
+        return '-' + version
+    segments, suffix, number, rest = match.groups()
+    segments = segments.split('.')
+    segments += ['0'] * (4 - len(segments))
+    # '-' sorts before '.', so that 10.0 < 10.0.0.0.1
+    return '%s-%d%05d%s' % (
+        '.'.join(s.zfill(5) for s in segments),
+        VERSION_SUFFIX_RANKS.get(suffix.lower(), 0), int(number or 0), rest)
+
+
+SUMMARY_LENGTH = 100
+# Markdown links and images, emphasis, headings, code, quotes and HTML tags
+MARKDOWN_REGEX = re.compile(
+    r'!?\[([^\]]*)\]\([^)]*\)|[*`#>]+|(?<!\w)_+|_+(?!\w)|<[^>]+>')
+
+
+def unmark(match):
+    """Replaces a MARKDOWN_REGEX match by its text, if any."""
+    if match.group(1) is not None:
+        return match.group(1)
+    # Tags may separate words
+    return ' ' if match.group(0).startswith('<') else ''
+
+
+def summarize(text, length=SUMMARY_LENGTH):
+    """
+    Returns the start of markdown text as plain text on a single line, for
+    the summaries shown in admin changelists: links keep their text, other
+    markup is dropped, and text longer than length is cut at a word
+    boundary and ends with an ellipsis.
+    """
+    text = ' '.join(MARKDOWN_REGEX.sub(unmark, text or '').split())
+    if len(text) <= length:
+        return text
+    cut = text[:length]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut[:length - 1].rstrip() + u'\u2026'
+
+
+# Maps products to the product of their equivalent releases
+EQUIVALENT_PRODUCTS = {'Firefox': 'Firefox for Android',
+                       'Firefox for Android': 'Firefox'}
+EQUIVALENTS_BATCH_SIZE = 100
+
+
+def equivalent_q(product, channel, major_version_key):
+    """
+    Returns a Q object matching the releases of product in channel with
+    the major version of major_version_key, a range over the
+    (product, channel, version_key) index.
+    """
+    # All the keys of a major version start with its padded number and a
+    # dot, and '/' comes right after '.'
+    return models.Q(product=product, channel=channel,
+                    version_key__gte=major_version_key + '.',
+                    version_key__lt=major_version_key + '/')
+
 
 class TimeStampedModel(models.Model):
     """
@@ -23,10 +114,17 @@ class TimeStampedModel(models.Model):
         abstract = True
 
     def save(self, *args, **kwargs):
-        if kwargs.pop('modified', True):
-            self.modified = datetime.now()
+        self.prepare_save(modified=kwargs.pop('modified', True))
         super(TimeStampedModel, self).save(*args, **kwargs)
 
+    def prepare_save(self, modified=True):
+        """
+        Sets the values that are computed when the instance is written,
+        called by save and by bulk writes that bypass it.
+        """
+        if modified:
+            self.modified = datetime.now()
+
 
 class Release(TimeStampedModel):
     CHANNELS = ('Nightly', 'Aurora', 'Beta', 'Release', 'ESR')
@@ -38,16 +136,25 @@ class Release(TimeStampedModel):
     channel = models.CharField(max_length=255,
                                choices=[(c, c) for c in CHANNELS])
     version = models.CharField(max_length=255)
-    release_date = models.DateTimeField()
+    version_key = models.CharField(max_length=255, db_index=True,
+                                   editable=False, serialize=False)
+    release_date = models.DateTimeField(db_index=True)
     text = models.TextField(blank=True)
     is_public = models.BooleanField(default=False)
     bug_list = models.TextField(blank=True)
     bug_search_url = models.CharField(max_length=2000, blank=True)
     system_requirements = models.TextField(blank=True)
+    summary = models.CharField(max_length=255, blank=True, editable=False,
+                               serialize=False)
 
     def major_version(self):
         return self.version.split('.', 1)[0]
 
+    def prepare_save(self, modified=True):
+        super(Release, self).prepare_save(modified=modified)
+        self.version_key = version_key(self.version)
+        self.summary = summarize(self.text)
+
     def get_bug_search_url(self):
         return self.bug_search_url or (
             'https://bugzilla.mozilla.org/buglist.cgi?'
@@ -58,6 +165,13 @@ class Release(TimeStampedModel):
             'v1=mozilla{version}&v2=fixed%2Cverified&limit=0'.format(
                 version=self.major_version()))
 
+    def major_version_key(self):
+        """
+        Returns the start of the version key of every release with the
+        same major version, up to but not including the first dot.
+        """
+        return version_key(self.major_version()).split('.')[0]
+
     def equivalent_release_for_product(self, product):
         """
         Returns the release for a specified product with the same
@@ -65,14 +179,13 @@ class Release(TimeStampedModel):
         or None if no such releases exist
         """
         releases = self._default_manager.filter(
-            version__startswith=self.major_version() + '.',
-            channel=self.channel, product=product).order_by('-version')
+            equivalent_q(product, self.channel, self.major_version_key()))
+        releases = releases.order_by('-version_key')
         if not getattr(settings, 'DEV', False):
             releases = releases.filter(is_public=True)
+        releases = releases[:1]
         if releases:
-            return sorted(
-                releases, reverse=True,
-                key=lambda r: len(r.version.split('.')))[0]
+            return releases[0]
 
     def equivalent_android_release(self):
         if self.product == 'Firefox':
@@ -82,29 +195,137 @@ class Release(TimeStampedModel):
         if self.product == 'Firefox for Android':
             return self.equivalent_release_for_product('Firefox')
 
+    @classmethod
+    def equivalent_releases(cls, releases):
+        """
+        Returns a dict mapping the id of each of releases to the release
+        that equivalent_android_release or equivalent_desktop_release
+        would return for it, or None, resolving all of them together with
+        a query per EQUIVALENTS_BATCH_SIZE distinct (product, channel,
+        major version) groups.
+        """
+        groups = cls.equivalent_groups(releases)
+        latest = {}
+        for candidates in cls.equivalent_candidates(groups):
+            for candidate in candidates:
+                key = (candidate.product, candidate.channel,
+                       candidate.version_key.split('.')[0])
+                if (key not in latest or
+                        candidate.version_key > latest[key].version_key):
+                    latest[key] = candidate
+
+        equivalents = dict((release.id, None) for release in releases)
+        for key, ids in groups.items():
+            for id in ids:
+                equivalents[id] = latest.get(key)
+        return equivalents
+
+    @classmethod
+    def equivalent_groups(cls, releases):
+        """
+        Returns a dict mapping the (product, channel, major version key)
+        groups that the equivalents of releases belong to, to the ids of
+        those releases.
+        """
+        groups = {}
+        for release in releases:
+            product = EQUIVALENT_PRODUCTS.get(release.product)
+            if product:
+                groups.setdefault(
+                    (product, release.channel, release.major_version_key()),
+                    []).append(release.id)
+        return groups
+
+    @classmethod
+    def equivalent_candidates(cls, groups):
+        """
+        Yields querysets of the releases in groups that can be returned as
+        equivalents, EQUIVALENTS_BATCH_SIZE groups at a time.
+        """
+        keys = list(groups)
+        for i in range(0, len(keys), EQUIVALENTS_BATCH_SIZE):
+            candidates = cls._default_manager.filter(reduce(operator.or_, [
+                equivalent_q(*key)
+                for key in keys[i:i + EQUIVALENTS_BATCH_SIZE]]))
+            if not getattr(settings, 'DEV', False):
+                candidates = candidates.filter(is_public=True)
+            yield candidates
+
+    @classmethod
+    def equivalents_modified(cls, releases):
+        """
+        Returns the latest modified timestamp and the number of the
+        releases that equivalent_releases picks the equivalents of
+        releases from, with an aggregate query per EQUIVALENTS_BATCH_SIZE
+        groups, so that validators can change along with them.
+        """
+        latest, count = None, 0
+        for candidates in cls.equivalent_candidates(
+                cls.equivalent_groups(releases)):
+            stats = candidates.aggregate(
+                latest=models.Max('modified'), count=models.Count('id'))
+            count += stats['count']
+            if stats['latest'] and (latest is None or
+                                    stats['latest'] > latest):
+                latest = stats['latest']
+        return latest, count
+
     def notes(self, public_only=False):
         """
-        Retrieve a list of Note instances that should be shown for this
-        release, grouped as either new features or known issues, and sorted
-        first by sort_num highest to lowest, which is applied to both groups,
-        and then for new features we also sort by tag in the order specified
-        by Note.TAGS, with untagged notes coming first, then finally moving
-        any note with the fixed tag that starts with the release version to
-        the top, for what we call "dot fixes".
+        Retrieve the notes that should be shown for this release, grouped
+        as either new features or known issues, each as a queryset sorted
+        the same way as ordered_notes.
+        """
+        notes = self.ordered_notes(public_only=public_only)
+        known_issue = (models.Q(is_known_issue=True) &
+                       ~models.Q(fixed_in_release=self))
+        return notes.exclude(known_issue), notes.filter(known_issue)
+
+    def ordered_notes(self, public_only=False):
+        """
+        Returns a single queryset of the notes for this release: first the
+        new features, then the known issues. Known issues are sorted by
+        sort_num highest to lowest. New features are sorted by the same,
+        then by tag in the order specified by Note.TAGS, with untagged
+        notes coming first, and finally any note with the fixed tag that
+        starts with the release version is moved to the top, for what we
+        call "dot fixes". Ties are broken by id.
+
+        The classification is computed by the database, so that the notes
+        can be fetched, sliced or paginated with one query.
         """
-        tag_index = dict((tag, i) for i, tag in enumerate(Note.TAGS))
-        notes = self.note_set.order_by('-sort_num')
+        qn = connection.ops.quote_name
+        column = dict((f, '%s.%s' % (qn(Note._meta.db_table), qn(f)))
+                      for f in ('is_known_issue', 'fixed_in_release_id',
+                                'tag', 'note'))
+        known_issue = (
+            '{is_known_issue} = %s AND ({fixed_in_release_id} IS NULL OR '
+            '{fixed_in_release_id} <> %s)').format(**column)
+        known_issue_params = [True, self.pk]
+        tag_ranks = ' '.join(['WHEN %s THEN {0}'.format(i)
+                              for i in range(len(Note.TAGS))])
+
+        select = SortedDict()
+        select_params = []
+        select['known_issue'] = 'CASE WHEN %s THEN 1 ELSE 0 END' % known_issue
+        select_params += known_issue_params
+        select['dot_fix'] = (
+            'CASE WHEN {known_issue} THEN 0 WHEN {tag} = %s AND '
+            'SUBSTR({note}, 1, %s) = %s THEN 1 ELSE 0 END').format(
+                known_issue=known_issue, **column)
+        select_params += known_issue_params + [
+            'Fixed', len(self.version), self.version]
+        select['tag_rank'] = (
+            'CASE WHEN {known_issue} THEN 0 ELSE CASE {tag} {tag_ranks} '
+            'ELSE 0 END END').format(
+                known_issue=known_issue, tag_ranks=tag_ranks, **column)
+        select_params += known_issue_params + list(Note.TAGS)
+
+        notes = self.note_set.extra(select=select, select_params=select_params)
         if public_only:
             notes = notes.filter(is_public=True)
-        known_issues = [n for n in notes if n.is_known_issue_for(self)]
-        new_features = sorted(
-            sorted(
-                (n for n in notes if not n.is_known_issue_for(self)),
-                key=lambda note: tag_index.get(note.tag, 0)),
-            key=lambda n: n.tag == 'Fixed' and n.note.startswith(self.version),
-            reverse=True)
-
-        return new_features, known_issues
+        return notes.order_by('known_issue', '-dot_fix', 'tag_rank',
+                              '-sort_num', 'id')
 
     def __unicode__(self):
         return '{product} v{version} {channel}'.format(
@@ -112,7 +333,9 @@ class Release(TimeStampedModel):
 
     class Meta:
         # TODO: see if this has a significant performance impact
-        ordering = ('product', '-version', 'channel')
+        ordering = ('product', '-version_key', 'channel')
+        # Migration 0010 also indexes (product, channel, version_key), for
+        # equivalent_q
         unique_together = (('product', 'version'),)
 
 
@@ -130,9 +353,134 @@ class Note(TimeStampedModel):
                            choices=[(t, t) for t in TAGS])
     sort_num = models.IntegerField(default=0)
     is_public = models.BooleanField(default=True)
+    summary = models.CharField(max_length=255, blank=True, editable=False,
+                               serialize=False)
+
+    def prepare_save(self, modified=True):
+        super(Note, self).prepare_save(modified=modified)
+        self.summary = summarize(self.note)
 
     def is_known_issue_for(self, release):
-        return self.is_known_issue and self.fixed_in_release != release
+        # Compare ids to avoid loading fixed_in_release
+        return self.is_known_issue and (
+            self.fixed_in_release_id != getattr(release, 'id', None))
 
     def __unicode__(self):
         return self.note
+
+
+class SyncState(models.Model):
+    """
+    Progress of rnasync for one model: the (modified, pk) cursor of the
+    newest object in the last committed batch, and the status of the
+    latest run.
+    """
+    STATUSES = ('running', 'failed', 'complete')
+
+    model = models.CharField(max_length=255, unique=True)
+    modified = models.DateTimeField(null=True, blank=True)
+    last_pk = models.IntegerField(null=True, blank=True)
+    status = models.CharField(max_length=255,
+                              choices=[(s, s) for s in STATUSES])
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def cursor(self):
+        if self.modified:
+            return self.modified, self.last_pk
+
+    def advance(self, instances):
+        """Moves the cursor past instances, which have been committed."""
+        for instance in instances:
+            if self.modified is None or (
+                    (instance.modified, instance.pk) > self.cursor()):
+                self.modified, self.last_pk = instance.modified, instance.pk
+        self.save()
+
+    def start(self):
+        self.status = 'running'
+        self.started = datetime.now()
+        self.finished = None
+        self.save()
+
+    def finish(self, status='complete'):
+        self.status = status
+        self.finished = datetime.now()
+        self.save()
+
+    def __unicode__(self):
+        return '{model} {status}'.format(model=self.model, status=self.status)
+
+
+class Tombstone(models.Model):
+    """
+    Records the deletion of a release or note, so that the change feed can
+    tell mirrors to delete their copy.
+    """
+    model = models.CharField(max_length=255)
+    object_id = models.IntegerField()
+    modified = models.DateTimeField(db_index=True)
+
+    def __unicode__(self):
+        return '{model} {object_id} deleted'.format(
+            model=self.model, object_id=self.object_id)
+
+
+@receiver(post_delete, sender=Release)
+@receiver(post_delete, sender=Note)
+def create_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(model=model_label(sender), object_id=instance.pk,
+                             modified=datetime.now())
+
+
+NOTES_VERSION_KEY = 'rna:notes-version'
+NOTES_VERSION_TIMEOUT = 30 * 24 * 60 * 60  # the longest memcached allows
+_notes_changed = threading.local()
+
+
+def notes_version():
+    """
+    Returns the version of the cached release notes, which is bumped
+    whenever a release or note changes.
+    """
+    version = cache.get(NOTES_VERSION_KEY)
+    if version is None:
+        # Start from the clock, so that an evicted version never comes back
+        version = int(time.time() * 1000)
+        cache.add(NOTES_VERSION_KEY, version, NOTES_VERSION_TIMEOUT)
+        version = cache.get(NOTES_VERSION_KEY, version)
+    return version
+
+
+def bump_notes_version():
+    try:
+        return cache.incr(NOTES_VERSION_KEY)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(NOTES_VERSION_KEY, version, NOTES_VERSION_TIMEOUT)
+        return version
+
+
+@receiver(post_save, sender=Release)
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Release)
+@receiver(post_delete, sender=Note)
+@receiver(m2m_changed, sender=Note.releases.through)
+@receiver(bulk_saved, sender=Release)
+@receiver(bulk_saved, sender=Note)
+def invalidate_notes(sender, **kwargs):
+    bump_notes_version()
+    # A request could cache the old notes again before the transaction of
+    # this change commits, so bump once more when the request is done
+    _notes_changed.pending = True
+
+
+@receiver(request_finished)
+def invalidate_notes_after_request(sender, **kwargs):
+    if getattr(_notes_changed, 'pending', False):
+        _notes_changed.pending = False
+        bump_notes_version()
+
+
+# Connect the receivers that keep the search index in sync
+from . import search  # noqa
@@ -0,0 +1,160 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import base64
+from datetime import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.http import urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def encode_cursor(values):
+    """
+    Returns an opaque, URL safe cursor for a list of keyset values.
+    Datetimes are encoded in ISO 8601 format.
+    """
+    values = [v.isoformat() if isinstance(v, datetime) else v
+              for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values)).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the list of keyset values in a cursor made by encode_cursor,
+    or None if cursor is empty. Raises ValueError for invalid cursors.
+    """
+    if not cursor:
+        return None
+    try:
+        cursor = str(cursor)
+        values = json.loads(base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def get_page_size(request, default=None):
+    """
+    Returns the page_size query param of request, bounded by
+    settings.RNA['MAX_PAGE_SIZE'] (1000 by default), or else default,
+    which defaults to settings.RNA['PAGE_SIZE'] (100 by default).
+    """
+    max_page_size = settings.RNA.get('MAX_PAGE_SIZE', 1000)
+    default = default or settings.RNA.get('PAGE_SIZE', 100)
+    try:
+        page_size = int(request.QUERY_PARAMS['page_size'])
+    except (KeyError, ValueError):
+        return min(default, max_page_size)
+    return max(1, min(page_size, max_page_size))
+
+
+def keyset_q(fields, values):
+    """
+    Returns a Q object matching the rows that come strictly after values
+    when ordered by fields, all ascending:
+    (a > x) | (a = x & b > y) | ...
+    """
+    q = None
+    for i, field in enumerate(fields):
+        after = dict(zip(fields[:i], values[:i]))
+        after[field + '__gt'] = values[i]
+        q = Q(**after) if q is None else q | Q(**after)
+    return q
+
+
+def keyset_value(obj, field):
+    """Returns the value of field in a model instance or a values() row."""
+    if isinstance(obj, dict):
+        return obj[field]
+    return getattr(obj, field)
+
+
+class KeysetPaginationMixin(object):
+    """
+    Opt-in keyset pagination for list views. Requests with a page_size or
+    cursor param are answered with a page of results ordered by one of
+    keyset_orderings, chosen with the ordering param, and the URL of the
+    next page, whose opaque cursor holds the ordering values of the last
+    object. Each page is a single indexed range query, so deep pages cost
+    the same as the first one. Other requests are listed in full.
+    """
+    keyset_orderings = {'modified': ('modified', 'id')}
+    default_keyset_ordering = 'modified'
+
+    def list(self, request, *args, **kwargs):
+        params = request.QUERY_PARAMS
+        if 'page_size' not in params and 'cursor' not in params:
+            return super(KeysetPaginationMixin, self).list(
+                request, *args, **kwargs)
+
+        try:
+            ordering, fields, values = self.get_keyset(request)
+        except ValueError as e:
+            return Response({'detail': '%s.' % e},
+                            status=status.HTTP_400_BAD_REQUEST)
+        page_size = get_page_size(request)
+        queryset = self.filter_queryset(self.get_queryset()).order_by(*fields)
+        if values is not None:
+            queryset = queryset.filter(keyset_q(fields, values))
+        # One more object than page_size tells whether there is a next page
+        serializer = self.get_serializer(queryset[:page_size + 1], many=True)
+        data = serializer.data
+        # Model instances, or values() rows for a ValuesListSerializer
+        self.object_list = list(serializer.object)
+
+        next_url = None
+        if len(data) > page_size:
+            data = data[:page_size]
+            last = self.object_list[page_size - 1]
+            params = dict(params.items())
+            params['cursor'] = encode_cursor(
+                [ordering] + [keyset_value(last, f) for f in fields])
+            next_url = request.build_absolute_uri('?' + urlencode(params))
+        return Response({'next': next_url, 'results': data})
+
+    def get_keyset(self, request):
+        """
+        Returns the name and fields of the requested ordering, and the
+        values of those fields in the cursor, converted by the model
+        fields, or None without a cursor. Raises ValueError for unknown
+        orderings and invalid cursors.
+        """
+        values = decode_cursor(request.QUERY_PARAMS.get('cursor'))
+        if values is not None:
+            if not values or not isinstance(values[0], basestring):
+                raise ValueError('Invalid cursor')
+            ordering, values = values[0], values[1:]
+        else:
+            ordering = request.QUERY_PARAMS.get(
+                'ordering', self.default_keyset_ordering)
+        if ordering not in self.keyset_orderings:
+            raise ValueError('Invalid ordering')
+        fields = self.keyset_orderings[ordering]
+        if values is not None:
+            if len(values) != len(fields):
+                raise ValueError('Invalid cursor')
+            values = [self.keyset_field_value(f, v)
+                      for f, v in zip(fields, values)]
+        return ordering, fields, values
+
+    def keyset_field_value(self, field, value):
+        """
+        Returns a cursor value converted by the model field it is for.
+        Raises ValueError for values the field cannot hold.
+        """
+        try:
+            value = self.model._meta.get_field(field).to_python(value)
+        except (ValidationError, TypeError):
+            raise ValueError('Invalid cursor')
+        if value is None:
+            raise ValueError('Invalid cursor')
+        return value
@@ -0,0 +1,249 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from Queue import Empty, Full, Queue
+import sys
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.utils import six
+
+from . import models, utils
+
+
+DONE = object()
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+def dependency_order(model_classes):
+    """
+    Returns model_classes sorted so that every model comes after the models
+    it references with a ForeignKey or ManyToManyField.
+    """
+    model_classes = list(model_classes)
+    ordered = []
+
+    def visit(model_class, path):
+        if model_class in ordered or model_class in path:
+            return
+        for dependency in dependencies(model_class, model_classes):
+            visit(dependency, path + [model_class])
+        ordered.append(model_class)
+
+    for model_class in model_classes:
+        visit(model_class, [])
+    return ordered
+
+
+def dependencies(model_class, model_classes):
+    """
+    Returns the models in model_classes, other than model_class itself,
+    that model_class references with a ForeignKey or ManyToManyField.
+    """
+    opts = model_class._meta
+    related = [f.rel.to for f in opts.fields + opts.many_to_many if f.rel]
+    return [m for m in model_classes if m in related and m is not model_class]
+
+
+class SyncPipeline(object):
+    """
+    Syncs several models with stages running concurrently, connected by
+    bounded queues so that a slow stage holds back the ones feeding it:
+
+    fetch: a pool of `workers` threads walk the pages of each remote
+        collection, taking models in dependency order, and queue them in
+        chunks of raw data.
+    decode: one thread per model restores the chunks into unsaved
+        instances, resolving their hyperlinks. A model is only decoded once
+        the models it depends on have been written.
+    write: the calling thread saves the instances, one model at a time in
+        dependency order, so releases land before the notes referencing
+        them.
+    """
+
+    def __init__(self, model_clients, params=None, workers=None,
+                 queue_size=None, chunk_size=None, bulk=False,
+                 modified=False, cursors=None, checkpoint=None,
+                 complete=None):
+        """
+        Args:
+            model_clients (list): (model class, RestModelClient) pairs.
+            params (dict): Maps model classes to query params for the
+                first page of their collection.
+            workers (int): Maximum number of concurrent fetch threads.
+                Defaults to settings.RNA['SYNC_WORKERS'] or 4.
+            queue_size (int): Maximum number of chunks waiting between two
+                stages. Defaults to settings.RNA['SYNC_QUEUE_SIZE'] or 4.
+            chunk_size (int): Number of objects restored and saved at once.
+                Defaults to settings.RNA['SYNC_CHUNK_SIZE'] or 500.
+            bulk (bool): Save each chunk with utils.bulk_upsert.
+            modified (bool): Update the modified timestamps when saving.
+            cursors (dict): Maps model classes to the (modified, pk) pair
+                of the last object already synced, skipping the objects up
+                to it.
+            checkpoint (callable): Called with the model class and the
+                instances of each chunk once they have been saved.
+            complete (callable): Called with each model class once all of
+                its instances have been saved.
+        """
+        self.clients = dict(model_clients)
+        self.order = dependency_order(self.clients)
+        self.params = params or {}
+        self.workers = workers or settings.RNA.get('SYNC_WORKERS', 4)
+        queue_size = queue_size or settings.RNA.get('SYNC_QUEUE_SIZE', 4)
+        self.chunk_size = chunk_size or settings.RNA.get(
+            'SYNC_CHUNK_SIZE', 500)
+        self.bulk = bulk
+        self.modified = modified
+        self.cursors = cursors or {}
+        self.checkpoint = checkpoint
+        self.complete = complete
+        self.fetched = dict((m, Queue(queue_size)) for m in self.order)
+        self.decoded = dict((m, Queue(queue_size)) for m in self.order)
+        self.written = dict((m, threading.Event()) for m in self.order)
+        self.pending = Queue()
+        for model_class in self.order:
+            self.pending.put(model_class)
+        self.stopped = threading.Event()
+        self.errors = []
+
+    def run(self):
+        """
+        Runs the sync and returns a dict mapping each model class to the
+        number of instances saved. The first exception raised by any stage
+        stops the pipeline and is re-raised here.
+        """
+        threads = []
+        stages = [(self.decode, m) for m in self.order]
+        stages.extend((self.fetch_pending,)
+                      for i in range(min(self.workers, len(self.order))))
+        for stage in stages:
+            thread = threading.Thread(target=self.run_stage, args=stage)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        counts = {}
+        try:
+            for model_class in self.order:
+                counts[model_class] = self.write(model_class)
+                self.written[model_class].set()
+                if self.complete:
+                    self.complete(model_class)
+        except PipelineAborted:
+            pass
+        except Exception:
+            self.errors.insert(0, sys.exc_info())
+            self.stopped.set()
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if self.errors:
+            six.reraise(*self.errors[0])
+        return counts
+
+    def run_stage(self, target, *args):
+        try:
+            target(*args)
+        except PipelineAborted:
+            pass
+        except Exception:
+            self.errors.append(sys.exc_info())
+            self.stopped.set()
+        finally:
+            connection.close()
+
+    def fetch_pending(self):
+        while True:
+            try:
+                model_class = self.pending.get_nowait()
+            except Empty:
+                return
+            self.fetch(model_class)
+
+    def fetch(self, model_class):
+        client = self.clients[model_class]
+        params = self.params.get(model_class, {})
+        cursor = self.cursors.get(model_class)
+        for page in client.iter_pages(params=params, cursor=cursor):
+            for data in utils.chunked(page, self.chunk_size):
+                self.put(self.fetched[model_class], data)
+        self.put(self.fetched[model_class], DONE)
+
+    def decode(self, model_class):
+        client = self.clients[model_class]
+        client.identity_map = {}
+        serializer = client.serializer(model_class)
+        for dependency in dependencies(model_class, self.order):
+            while not self.written[dependency].is_set():
+                self.check()
+                self.written[dependency].wait(0.1)
+        for data in iter(lambda: self.get(self.fetched[model_class]), DONE):
+            self.put(self.decoded[model_class],
+                     client.restore_many(serializer, data))
+        self.put(self.decoded[model_class], DONE)
+
+    def write(self, model_class):
+        count = 0
+        client = self.clients[model_class]
+        serializer = client.serializer(model_class)
+        for instances in iter(lambda: self.get(self.decoded[model_class]),
+                              DONE):
+            self.save_related(instances)
+            with client.timer('save'):
+                if self.bulk:
+                    utils.bulk_upsert(model_class, instances,
+                                      modified=self.modified)
+                else:
+                    for instance in instances:
+                        serializer.save_object(instance,
+                                               modified=self.modified)
+            if self.checkpoint:
+                self.checkpoint(model_class, instances)
+            count += len(instances)
+        return count
+
+    def save_related(self, instances):
+        """
+        Saves the related instances that the decode stage had to fetch from
+        the API, because they were not in the database yet.
+        """
+        related = {}
+        for instance in instances:
+            opts = instance._meta
+            for field in opts.fields:
+                if isinstance(field, models.models.ForeignKey):
+                    obj = getattr(instance, field.get_cache_name(), None)
+                    if obj is not None:
+                        related[id(obj)] = obj
+            for objs in getattr(instance, '_m2m_data', {}).values():
+                related.update((id(obj), obj) for obj in objs)
+        for obj in related.values():
+            if obj._state.adding:
+                obj.save(modified=False)
+
+    def check(self):
+        if self.stopped.is_set():
+            raise PipelineAborted
+
+    def get(self, queue):
+        while True:
+            self.check()
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                pass
+
+    def put(self, queue, item):
+        while True:
+            self.check()
+            try:
+                return queue.put(item, timeout=0.1)
+            except Full:
+                pass
@@ -0,0 +1,282 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import operator
+import re
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.importlib import import_module
+
+from .models import Note, Release
+from .signals import bulk_saved
+from .utils import chunked
+
+
+# The text fields of each model in the full-text index
+SEARCH_FIELDS = {
+    Note: ('note',),
+    Release: ('text', 'system_requirements'),
+}
+
+TERM_REGEX = re.compile(r'\w+', re.U)
+
+_backends = {}
+
+
+def get_backend(using=None):
+    """
+    Returns the search backend of the database alias using, created on the
+    first call for each alias by get_backend_class. Backends whose index
+    is not installed yet fall back to LikeBackend until install is called.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    try:
+        return _backends[using]
+    except KeyError:
+        pass
+    backend = get_backend_class(using)(using)
+    if not backend.installed():
+        backend = LikeBackend(using)
+    return _backends.setdefault(using, backend)
+
+
+def get_backend_class(using):
+    """
+    Returns the search backend class of the database alias using, from
+    settings.RNA['SEARCH_BACKEND'], a class or dotted path to one.
+    Defaults to SQLiteFTS5Backend on SQLite builds with FTS5, and to
+    LikeBackend elsewhere.
+    """
+    backend = settings.RNA.get('SEARCH_BACKEND')
+    if backend is None:
+        if SQLiteFTS5Backend.available(connections[using]):
+            return SQLiteFTS5Backend
+        return LikeBackend
+    if isinstance(backend, basestring):
+        module_name, class_name = backend.rsplit('.', 1)
+        return getattr(import_module(module_name), class_name)
+    return backend
+
+
+def install(using=None):
+    """
+    Installs the index of the search backend of the database alias using,
+    and returns the backend, which get_backend returns from then on.
+    Installing may run DDL, which SQLite commits the open transaction
+    before, so it is done by migrations and rnareindex, outside of any
+    transaction, and never while saving.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    backend = get_backend_class(using)(using)
+    backend.install()
+    _backends[using] = backend
+    return backend
+
+
+def terms(query):
+    """Returns the words of a search query."""
+    return TERM_REGEX.findall(query or '')
+
+
+class LikeBackend(object):
+    """
+    Full-text search over the SEARCH_FIELDS of a database's releases and
+    notes, matching the objects that contain all the terms of a query.
+
+    This base backend keeps no index: it scans the fields with case
+    insensitive LIKE queries, for the databases no other backend supports,
+    and ranks objects by modified timestamp, newest first. Backends with
+    an index subclass it, keep their index in sync through index, delete
+    and clear, and override the queries. No backend commits: its writes
+    are part of the caller's transaction.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+
+    def install(self):
+        """Creates the index, if missing."""
+
+    def installed(self):
+        """Returns whether the index exists."""
+        return True
+
+    def index(self, model_class, instances):
+        """Adds or updates instances of model_class in the index."""
+
+    def delete(self, model_class, pks):
+        """Removes the objects of model_class with pks from the index."""
+
+    def clear(self, model_class):
+        """Removes every object of model_class from the index."""
+
+    def filter(self, queryset, query):
+        """Returns the objects of queryset that match query."""
+        words = terms(query)
+        if not words:
+            return queryset.none()
+        for word in words:
+            queryset = queryset.filter(reduce(operator.or_, [
+                Q(**{field + '__icontains': word})
+                for field in SEARCH_FIELDS[queryset.model]]))
+        return queryset
+
+    def search(self, model_class, query, offset=0, limit=None):
+        """
+        Returns a list of the (pk, score) pairs of the objects of
+        model_class that match query, best first, from offset and up to
+        limit of them.
+        """
+        queryset = self.filter(
+            model_class._default_manager.db_manager(self.using).all(), query)
+        pks = queryset.order_by('-modified', '-pk').values_list(
+            'pk', flat=True)
+        end = None if limit is None else offset + limit
+        return [(pk, 0.0) for pk in pks[offset:end]]
+
+    def count(self, model_class, query):
+        """Returns the number of objects of model_class matching query."""
+        return self.filter(
+            model_class._default_manager.db_manager(self.using).all(),
+            query).count()
+
+
+class SQLiteFTS5Backend(LikeBackend):
+    """
+    Indexes each model in an SQLite FTS5 table named after its own, with
+    the pk of each object as rowid, and ranks matches by BM25. The tables
+    are created by migration 0013, or by rnareindex through install.
+    """
+
+    @classmethod
+    def available(cls, connection):
+        if connection.vendor != 'sqlite':
+            return False
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA compile_options')
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+    def table(self, model_class):
+        return '%s_search' % model_class._meta.db_table
+
+    def cursor(self):
+        return connections[self.using].cursor()
+
+    def install(self):
+        cursor = self.cursor()
+        for model_class, fields in SEARCH_FIELDS.items():
+            cursor.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, '
+                "tokenize = 'porter unicode61')" % (
+                    self.table(model_class), ', '.join(fields)))
+
+    def installed(self):
+        connection = connections[self.using]
+        tables = connection.introspection.table_names()
+        return all(self.table(model_class) in tables
+                   for model_class in SEARCH_FIELDS)
+
+    def match(self, query):
+        """
+        Returns an FTS5 query matching all the terms of query, each quoted
+        so that none is taken for an operator, or None if it has none.
+        """
+        words = terms(query)
+        if words:
+            return ' '.join('"%s"' % word for word in words)
+
+    def index(self, model_class, instances):
+        if not instances:
+            return
+        fields = SEARCH_FIELDS[model_class]
+        cursor = self.cursor()
+        for chunk in chunked(instances, 500):
+            self.delete_rows(cursor, model_class, [i.pk for i in chunk])
+            cursor.executemany(
+                'INSERT INTO %s (rowid, %s) VALUES (%s)' % (
+                    self.table(model_class), ', '.join(fields),
+                    ', '.join(['%s'] * (len(fields) + 1))),
+                [[i.pk] + [getattr(i, f) for f in fields] for i in chunk])
+
+    def delete_rows(self, cursor, model_class, pks):
+        cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (
+            self.table(model_class), ', '.join(['%s'] * len(pks))), pks)
+
+    def delete(self, model_class, pks):
+        cursor = self.cursor()
+        for chunk in chunked(pks, 500):
+            self.delete_rows(cursor, model_class, chunk)
+
+    def clear(self, model_class):
+        self.cursor().execute(
+            'DELETE FROM %s' % self.table(model_class))
+
+    def search(self, model_class, query, offset=0, limit=None):
+        match = self.match(query)
+        if match is None:
+            return []
+        table = self.table(model_class)
+        # bm25 is lower for better matches
+        cursor = self.cursor()
+        cursor.execute(
+            'SELECT rowid, -bm25(%s) FROM %s WHERE %s MATCH %%s '
+            'ORDER BY bm25(%s), rowid LIMIT %%s OFFSET %%s' % (
+                table, table, table, table),
+            [match, -1 if limit is None else limit, offset])
+        return cursor.fetchall()
+
+    def count(self, model_class, query):
+        match = self.match(query)
+        if match is None:
+            return 0
+        table = self.table(model_class)
+        cursor = self.cursor()
+        cursor.execute('SELECT COUNT(*) FROM %s WHERE %s MATCH %%s' % (
+            table, table), [match])
+        return cursor.fetchone()[0]
+
+    def filter(self, queryset, query):
+        match = self.match(query)
+        if match is None:
+            return queryset.none()
+        qn = connections[self.using].ops.quote_name
+        table = self.table(queryset.model)
+        return queryset.extra(
+            where=['%s.%s IN (SELECT rowid FROM %s WHERE %s MATCH %%s)' % (
+                qn(queryset.model._meta.db_table),
+                qn(queryset.model._meta.pk.column), table, table)],
+            params=[match])
+
+
+# Outside of transaction management, Model.save and utils.bulk_upsert
+# have committed their writes by the time they send their signals, which
+# leaves nothing of the caller's to commit along with the index, so the
+# index is committed right away, like the save. Under transaction
+# management, commit_unless_managed only marks the caller's transaction
+# dirty. Deletions always run in a transaction of their own, committed
+# once every post_delete signal has been sent.
+
+
+@receiver(post_save, sender=Release)
+@receiver(post_save, sender=Note)
+def index_saved(sender, instance, using=None, **kwargs):
+    get_backend(using).index(sender, [instance])
+    transaction.commit_unless_managed(using=using)
+
+
+@receiver(bulk_saved, sender=Release)
+@receiver(bulk_saved, sender=Note)
+def index_bulk_saved(sender, created=(), updated=(), using=None, **kwargs):
+    get_backend(using).index(sender, list(created) + list(updated))
+    transaction.commit_unless_managed(using=using)
+
+
+@receiver(post_delete, sender=Release)
+@receiver(post_delete, sender=Note)
+def unindex_deleted(sender, instance, using=None, **kwargs):
+    get_backend(using).delete(sender, [instance.pk])
@@ -2,16 +2,97 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from rest_framework import serializers
+from django.core.urlresolvers import NoReverseMatch
+from django.db import models as db_models
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import is_protected_type
+from django.utils.six import get_unbound_function
+from rest_framework import relations, serializers
 from rest_framework.compat import parse_datetime
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
+
+from . import models, utils
+
+
+_client_serializer_classes = {}
+_model_serializer_classes = {}
+_field_plans = {}
 
 
 def get_client_serializer_class(model_class):
+    """
+    Returns the ClientSerializer class of model_class, created on the first
+    call for each model.
+    """
+    try:
+        return _client_serializer_classes[model_class]
+    except KeyError:
+        pass
+
     class ClientSerializer(UnmodifiedTimestampSerializer):
         class Meta:
             model = model_class
 
-    return ClientSerializer
+    return _client_serializer_classes.setdefault(model_class, ClientSerializer)
+
+
+def get_model_serializer_class(model_class):
+    """
+    Returns a serializer class of model_class based on the
+    DEFAULT_MODEL_SERIALIZER_CLASS of the API settings, created on the
+    first call for each model and base class.
+    """
+    base = api_settings.DEFAULT_MODEL_SERIALIZER_CLASS
+    key = (base, model_class)
+    try:
+        return _model_serializer_classes[key]
+    except KeyError:
+        pass
+
+    class ModelSerializer(base):
+        class Meta:
+            model = model_class
+
+    return _model_serializer_classes.setdefault(key, ModelSerializer)
+
+
+def get_field_plan(model_class):
+    """
+    Returns the FieldPlan of the ClientSerializer of model_class, created
+    on the first call for each model.
+    """
+    try:
+        return _field_plans[model_class]
+    except KeyError:
+        return _field_plans.setdefault(model_class, FieldPlan(
+            get_client_serializer_class(model_class)()))
+
+
+class FieldPlan(object):
+    """
+    The fields of a serializer, set up once to serialize any number of
+    objects straight into dicts, without the per object field
+    initialization and metadata of Serializer.to_native. The dicts hold the
+    same data as serializer.data would, for serializers without
+    transform_<field> methods.
+    """
+
+    def __init__(self, serializer):
+        self.fields = []
+        for field_name, field in serializer.fields.items():
+            field.initialize(parent=serializer, field_name=field_name)
+            self.fields.append(
+                (serializer.get_field_key(field_name), field_name, field))
+
+    def serialize(self, obj):
+        data = SortedDict()
+        for key, field_name, field in self.fields:
+            data[key] = field.field_to_native(obj, field_name)
+        return data
+
+    def serialize_many(self, objs):
+        return [self.serialize(obj) for obj in objs]
 
 
 class HyperlinkedModelSerializerWithPkField(
@@ -39,3 +120,182 @@ class UnmodifiedTimestampSerializer(serializers.ModelSerializer):
         kwargs['modified'] = False
         return super(UnmodifiedTimestampSerializer, self).save_object(
             obj, **kwargs)
+
+
+class ReleaseEquivalentsSerializer(HyperlinkedModelSerializerWithPkField):
+    """
+    Serializes releases together with links to their equivalent releases,
+    looked up in the equivalents context, a dict as returned by
+    models.Release.equivalent_releases, or else queried for each release,
+    as for the release of a create request.
+    """
+    equivalent_android_release = serializers.SerializerMethodField(
+        'get_equivalent_android_release')
+    equivalent_desktop_release = serializers.SerializerMethodField(
+        'get_equivalent_desktop_release')
+
+    class Meta:
+        model = models.Release
+
+    def get_equivalent_android_release(self, obj):
+        if obj.product == 'Firefox':
+            return self.get_equivalent_url(obj)
+
+    def get_equivalent_desktop_release(self, obj):
+        if obj.product == 'Firefox for Android':
+            return self.get_equivalent_url(obj)
+
+    def get_equivalent_url(self, obj):
+        equivalents = self.context.get('equivalents') or {}
+        if obj.id in equivalents:
+            equivalent = equivalents[obj.id]
+        else:
+            equivalent = (obj.equivalent_android_release() or
+                          obj.equivalent_desktop_release())
+        if equivalent is not None:
+            return reverse('release-detail', kwargs={'pk': equivalent.pk},
+                           request=self.context.get('request'))
+
+
+class Row(object):
+    """A values() row as an object with attributes."""
+
+    def __init__(self, row):
+        self.__dict__.update(row)
+
+
+class URLPlaceholder(object):
+    """Stands in for an object when making a URL template out of a field."""
+    pk = 'rna-pk-placeholder'
+
+
+class ValuesListSerializer(object):
+    """
+    Serializes a queryset from values() rows instead of model instances,
+    giving the same data as a hyperlinked ModelSerializer would. The ids of
+    each ManyToManyField are fetched for all the rows at once, and
+    hyperlinks are built from URL templates that the serializer's own
+    fields reverse once, instead of once per object.
+
+    Use for_class, which returns None for serializers with fields that
+    can't be reproduced from a row, such as method fields.
+    """
+
+    def __init__(self, serializer, queryset):
+        """
+        Raises ValueError if a field of serializer is not supported, and
+        NoReverseMatch if a hyperlink can't be reversed.
+        """
+        self.context = serializer.context
+        self.queryset = queryset
+        self.object = None
+        self._data = None
+        self.fields = []
+        opts = serializer.opts.model._meta
+        model_fields = dict((f.name, f) for f in opts.fields)
+        m2m_fields = dict((f.name, f) for f in opts.many_to_many)
+        for field_name, field in serializer.fields.items():
+            field.initialize(parent=serializer, field_name=field_name)
+            key = serializer.get_field_key(field_name)
+            source = field.source or field_name
+            model_field = model_fields.get(source)
+            if isinstance(field, relations.HyperlinkedIdentityField):
+                self.fields.append(
+                    (key, 'url', opts.pk.attname, self.url_template(field)))
+            elif isinstance(field, relations.HyperlinkedRelatedField):
+                if field.many and source in m2m_fields:
+                    self.fields.append((key, 'many', m2m_fields[source],
+                                        self.url_template(field)))
+                elif (not field.many and
+                      isinstance(model_field, db_models.ForeignKey)):
+                    self.fields.append((key, 'url', model_field.attname,
+                                        self.url_template(field)))
+                else:
+                    raise ValueError('Unsupported field %s' % field_name)
+            elif isinstance(field, serializers.ModelField):
+                self.fields.append(
+                    (key, 'model', field.model_field.attname, field))
+            elif (get_unbound_function(type(field).field_to_native) is
+                  get_unbound_function(serializers.Field.field_to_native) and
+                  not isinstance(field, relations.RelatedField) and
+                  model_field is not None and not model_field.rel):
+                self.fields.append((key, 'value', model_field.attname, field))
+            else:
+                raise ValueError('Unsupported field %s' % field_name)
+
+    @classmethod
+    def for_class(cls, serializer_class, queryset, context=None):
+        """
+        Returns a ValuesListSerializer for queryset with the fields of
+        serializer_class, or None if they are not supported.
+        """
+        try:
+            return cls(serializer_class(context=context), queryset)
+        except (ValueError, NoReverseMatch):
+            return None
+
+    def url_template(self, field):
+        """
+        Returns the parts of the URLs of field before and after the pk, as
+        the field reverses them for the request and format in context.
+        """
+        if field.lookup_field != 'pk':
+            raise ValueError('Unsupported lookup field %s' % field.lookup_field)
+        format = self.context.get('format')
+        if isinstance(field, relations.HyperlinkedIdentityField):
+            if format and field.format and field.format != format:
+                format = field.format
+        else:
+            format = field.format or format
+        url = field.get_url(URLPlaceholder(), field.view_name,
+                            self.context.get('request'), format)
+        parts = url.split(URLPlaceholder.pk)
+        if len(parts) != 2:
+            raise ValueError('Unsupported URL %s' % url)
+        return parts
+
+    @property
+    def data(self):
+        if self._data is None:
+            self.object = list(self.queryset.values())
+            related = dict((f[0], self.related_pks(f[2], self.object))
+                           for f in self.fields if f[1] == 'many')
+            self._data = [self.serialize(row, related) for row in self.object]
+        return self._data
+
+    def related_pks(self, field, rows, batch_size=500):
+        """
+        Returns a dict mapping the pk of each row to the pks of the objects
+        related to it by the ManyToManyField field, in the default order of
+        the related model, as its related manager would list them.
+        """
+        pk = self.queryset.model._meta.pk.attname
+        query_name = field.related_query_name()
+        related = dict((row[pk], []) for row in rows)
+        for pks in utils.chunked(list(related), batch_size):
+            for source, target in field.rel.to._default_manager.filter(
+                    **{query_name + '__in': pks}).values_list(
+                    query_name, 'pk'):
+                related[source].append(target)
+        return related
+
+    def serialize(self, row, related):
+        pk = row[self.queryset.model._meta.pk.attname]
+        data = SortedDict()
+        for key, kind, source, extra in self.fields:
+            if kind == 'value':
+                data[key] = extra.to_native(row[source])
+            elif kind == 'model':
+                # as ModelField.field_to_native does
+                value = row[source]
+                if not is_protected_type(value):
+                    value = extra.model_field.value_to_string(Row(row))
+                data[key] = value
+            elif kind == 'url':
+                value = row[source]
+                data[key] = (None if value is None else
+                             '%s%s%s' % (extra[0], value, extra[1]))
+            else:
+                data[key] = ['%s%s%s' % (extra[0], value, extra[1])
+                             for value in related[key][pk]]
+        return data
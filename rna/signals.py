@@ -0,0 +1,10 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django.dispatch import Signal
+
+
+# Sent by utils.bulk_upsert once a batch of instances has been committed,
+# in place of the post_save and m2m_changed signals it does not send.
+bulk_saved = Signal(providing_args=['created', 'updated', 'using'])
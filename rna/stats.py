@@ -0,0 +1,221 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from contextlib import contextmanager
+from datetime import datetime
+import sys
+import threading
+import time
+
+from django.db.models.signals import post_save
+
+from . import signals
+from .models import model_label
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+PHASES = ('fetch', 'decode', 'resolve', 'save')
+
+
+@contextmanager
+def null_timer():
+    yield
+
+
+class SyncStats(object):
+    """
+    Thread safe telemetry of a sync: per model counts of the objects
+    fetched, skipped as already synced, created and updated, the time
+    spent in each phase, and the newest upstream modified timestamp, along
+    with HTTP requests, bytes and cache hits, throughput and peak memory.
+
+    Phases run concurrently with rnasync --pipeline, so their times may add
+    up to more than the elapsed time.
+    """
+
+    def __init__(self, model_classes=None):
+        """
+        Args:
+            model_classes (list): Only count the saves of these models.
+                Defaults to counting the saves of every model.
+        """
+        self.lock = threading.Lock()
+        self.models = {}
+        self.labels = None
+        if model_classes is not None:
+            self.labels = set(model_label(m) for m in model_classes)
+        self.http = {'requests': 0, 'bytes': 0, 'cache_hits': 0,
+                     'not_modified': 0}
+        self.started = self.finished = self.elapsed = None
+        self.peak_memory = self.memory_source = None
+        self.tracing = False
+
+    def model(self, model_class):
+        """Returns the counters of model_class. Call with the lock held."""
+        label = model_label(model_class)
+        if label not in self.models:
+            counters = dict((name, 0) for name in (
+                'fetched', 'skipped', 'created', 'updated'))
+            counters['time'] = dict((phase, 0.0) for phase in PHASES)
+            counters['newest_modified'] = None
+            self.models[label] = counters
+        return self.models[label]
+
+    def count(self, model_class, name, n=1):
+        with self.lock:
+            self.model(model_class)[name] += n
+
+    def count_http(self, name, n=1):
+        with self.lock:
+            self.http[name] += n
+
+    @contextmanager
+    def timer(self, model_class, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self.lock:
+                self.model(model_class)['time'][phase] += elapsed
+
+    def fetched(self, model_class, data, page, modified=None):
+        """
+        Records a page of serialized objects, data, of which page were kept
+        after skipping those already synced. modified is the newest
+        modified timestamp in data.
+        """
+        with self.lock:
+            counters = self.model(model_class)
+            counters['fetched'] += len(page)
+            counters['skipped'] += len(data) - len(page)
+        if modified is not None:
+            self.saw_modified(model_class, modified)
+
+    def saw_modified(self, model_class, modified):
+        with self.lock:
+            counters = self.model(model_class)
+            if (counters['newest_modified'] is None or
+                    modified > counters['newest_modified']):
+                counters['newest_modified'] = modified
+
+    def record_response(self, response):
+        with self.lock:
+            self.http['requests'] += 1
+            self.http['bytes'] += len(response.content or '')
+            if response.status_code == 304:
+                self.http['not_modified'] += 1
+
+    def tracks(self, model_class):
+        return self.labels is None or model_label(model_class) in self.labels
+
+    def saved(self, sender, instance=None, created=False, **kwargs):
+        if self.tracks(sender):
+            self.count(sender, 'created' if created else 'updated')
+
+    def bulk_saved(self, sender, created=(), updated=(), **kwargs):
+        if not self.tracks(sender):
+            return
+        with self.lock:
+            counters = self.model(sender)
+            counters['created'] += len(created)
+            counters['updated'] += len(updated)
+
+    def start(self):
+        """Starts the clock and memory tracing, and counting saves."""
+        self.started = datetime.now()
+        self.start_time = time.time()
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+        post_save.connect(self.saved, weak=False,
+                          dispatch_uid='rna.stats.%d' % id(self))
+        signals.bulk_saved.connect(self.bulk_saved, weak=False,
+                                   dispatch_uid='rna.stats.%d' % id(self))
+
+    def stop(self):
+        self.finished = datetime.now()
+        self.elapsed = time.time() - self.start_time
+        post_save.disconnect(dispatch_uid='rna.stats.%d' % id(self))
+        signals.bulk_saved.disconnect(dispatch_uid='rna.stats.%d' % id(self))
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            self.memory_source = 'tracemalloc'
+            if self.tracing:
+                tracemalloc.stop()
+        elif resource is not None:
+            # ru_maxrss is in kilobytes, except on OS X
+            scale = 1 if sys.platform == 'darwin' else 1024
+            self.peak_memory = resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss * scale
+            self.memory_source = 'rusage'
+
+    def as_dict(self, now=None):
+        """
+        Returns the stats as a JSON serializable dict, with the lag of each
+        model behind upstream, in seconds, as of now.
+        """
+        now = now or self.finished or datetime.now()
+        models = {}
+        objects = 0
+        for label, counters in self.models.items():
+            counters = dict(counters, time=dict(counters['time']))
+            newest = counters['newest_modified']
+            counters['lag'] = None
+            if newest is not None:
+                lag = now - newest
+                counters['lag'] = lag.days * 86400 + lag.seconds
+                counters['newest_modified'] = newest.isoformat()
+            objects += counters['created'] + counters['updated']
+            models[label] = counters
+        elapsed = self.elapsed
+        return {
+            'started': self.started and self.started.isoformat(),
+            'finished': self.finished and self.finished.isoformat(),
+            'elapsed': elapsed,
+            'objects': objects,
+            'objects_per_second': objects / elapsed if elapsed else None,
+            'peak_memory': self.peak_memory,
+            'memory_source': self.memory_source,
+            'http': dict(self.http),
+            'models': models,
+        }
+
+    def format(self, now=None):
+        """Returns a human readable summary of as_dict."""
+        data = self.as_dict(now)
+        lines = []
+        for label in sorted(data['models']):
+            counters = data['models'][label]
+            lines.append(
+                '%s: fetched %d, created %d, updated %d, skipped %d; %s; '
+                'lag %s' % (
+                    label, counters['fetched'], counters['created'],
+                    counters['updated'], counters['skipped'],
+                    ', '.join('%s %.2fs' % (p, counters['time'][p])
+                              for p in PHASES),
+                    'unknown' if counters['lag'] is None
+                    else '%ds' % counters['lag']))
+        lines.append(
+            'HTTP: %(requests)d requests, %(bytes)d bytes, '
+            '%(cache_hits)d cache hits, %(not_modified)d not modified'
+            % data['http'])
+        line = 'Total: %d objects in %.2fs' % (
+            data['objects'], data['elapsed'] or 0)
+        if data['objects_per_second'] is not None:
+            line += ' (%.1f/s)' % data['objects_per_second']
+        if data['peak_memory'] is not None:
+            line += ', peak memory %.1f MB (%s)' % (
+                data['peak_memory'] / 1048576.0, data['memory_source'])
+        lines.append(line)
+        return '\n'.join(lines) + '\n'
@@ -3,16 +3,68 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from datetime import datetime
-
+from io import BytesIO
+import json
+import os
+import tempfile
+import time
+import zlib
+
+from django.conf.urls import url
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Count, Max
 from django.db.models.query import EmptyQuerySet
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.test.utils import override_settings
-from mock import Mock, patch
+from django.utils.http import http_date
+from mock import MagicMock, Mock, patch
 from nose.tools import eq_, ok_
-
-from . import clients, fields, filters, models, serializers, views
-from .management.commands import rnasync
+import requests
+from rest_framework import routers
+from rest_framework.authtoken.models import Token
+from rest_framework.response import Response
+from rest_framework.viewsets import ModelViewSet
+
+from . import (admin, caches, clients, fields, filters, middleware, models,
+               pagination, pipeline, search, serializers, signals, stats,
+               utils, views)
+from .benchmarks import generator, scenarios, server
+from .management.commands import rnabench, rnaimport, rnareindex, rnasync
+
+
+def create_tables(*model_classes):
+    """
+    Creates the missing tables of model_classes in the test database,
+    which syncdb leaves them out of. SQLite commits before creating a
+    table, so the tables outlive the test, but not their rows.
+    """
+    cursor = connection.cursor()
+    tables = connection.introspection.table_names()
+    for model_class in model_classes:
+        if model_class._meta.db_table in tables:
+            continue
+        sql, references = connection.creation.sql_create_model(
+            model_class, no_style())
+        for statement in sql:
+            cursor.execute(statement)
+
+
+class RouterURLConf(object):
+    router = routers.DefaultRouter()
+    router.register('notes', views.NoteViewSet)
+    router.register('releases', views.ReleaseViewSet)
+    urlpatterns = router.urls
+
+
+class NestedURLConf(RouterURLConf):
+    urlpatterns = RouterURLConf.urlpatterns + [
+        url(r'^releases/(?P<pk>\d+)/notes/$',
+            views.NestedNoteView.as_view())]
 
 
 class TimeStampedModelTest(TestCase):
@@ -24,6 +76,17 @@ class TimeStampedModelTest(TestCase):
         ok_(model.modified > start)
         mock_super_save.assert_called_once_with(db='test')
 
+    def test_prepare_save(self):
+        """
+        Should only update the modified timestamp if modified is True
+        """
+        model = models.TimeStampedModel()
+        model.modified = space_odyssey = datetime(2001, 1, 1)
+        model.prepare_save(modified=False)
+        eq_(model.modified, space_odyssey)
+        model.prepare_save()
+        ok_(model.modified > space_odyssey)
+
     @patch('rna.rna.models.models.Model.save')
     def test_unmodified(self, mock_super_save):
         model = models.TimeStampedModel()
@@ -33,6 +96,334 @@ class TimeStampedModelTest(TestCase):
         mock_super_save.assert_called_once_with(db='test')
 
 
+class DatasetTest(TestCase):
+    def test_deterministic(self):
+        """
+        Should generate the same objects for the same seed
+        """
+        dataset = generator.Dataset(releases=50, notes=100, seed=3)
+        eq_(dataset.note(42),
+            generator.Dataset(releases=50, notes=100, seed=3).note(42))
+        ok_(dataset.note(42) != generator.Dataset(
+            releases=50, notes=100, seed=4).note(42))
+
+    def test_release_versions(self):
+        """
+        Should give every release of a product a different version
+        """
+        dataset = generator.Dataset(releases=200)
+        releases = [dataset.release(i) for i in range(1, 201)]
+        eq_(len(set((r['product'], r['version']) for r in releases)), 200)
+
+    def test_note_releases(self):
+        """
+        Should link every note to between 1 and fanout existing releases
+        """
+        dataset = generator.Dataset(releases=10, notes=100, fanout=3)
+        for i in range(1, 101):
+            releases = dataset.note(i)['releases']
+            ok_(1 <= len(releases) <= 3)
+            ok_(all(1 <= r <= 10 for r in releases))
+
+    def test_index(self):
+        """
+        Should return the first object modified at or after a timestamp
+        """
+        dataset = generator.Dataset()
+        eq_(dataset.index(dataset.timestamp(7)), 7)
+        eq_(dataset.index(dataset.timestamp(7) + dataset.interval / 2), 8)
+        eq_(dataset.index(datetime(2001, 1, 1)), 1)
+
+
+class StubServerTest(TestCase):
+    def stub(self):
+        stub = server.StubServer.__new__(server.StubServer)
+        stub.dataset = generator.Dataset(releases=5, notes=10)
+        stub.url = 'http://thedu.de/'
+        return stub
+
+    def test_collection_page(self):
+        """
+        Should return a page of objects and a link to the next one
+        """
+        page = self.stub().collection('notes', None, {'page_size': ['4']})
+        eq_([n['id'] for n in page['results']], [1, 2, 3, 4])
+        eq_(page['next'], 'http://thedu.de/notes/?page_size=4&cursor=4')
+        page = self.stub().collection(
+            'notes', None, {'page_size': ['4'], 'cursor': ['8']})
+        eq_([n['id'] for n in page['results']], [9, 10])
+        eq_(page['next'], None)
+
+    def test_collection_modified_after(self):
+        """
+        Should skip the objects modified before modified_after
+        """
+        stub = self.stub()
+        modified = stub.dataset.timestamp(3).isoformat()
+        page = stub.collection('releases', None, {'modified_after': [modified]})
+        eq_([r['id'] for r in page['results']], [3, 4, 5])
+
+    def test_collection_detail(self):
+        """
+        Should return one serialized object, with hyperlinks, or None
+        """
+        stub = self.stub()
+        note = stub.collection('notes', '2', {})
+        eq_(note['url'], 'http://thedu.de/notes/2/')
+        ok_(note['releases'][0].startswith('http://thedu.de/releases/'))
+        eq_(stub.collection('notes', '11', {}), None)
+
+
+class ScenariosTest(TestCase):
+    def test_summarize(self):
+        result = scenarios.summarize([0.4, 0.1, 0.2, 0.3], 7)
+        eq_(result['median'], 0.25)
+        eq_(result['min'], 0.1)
+        eq_(result['max'], 0.4)
+        eq_(result['queries'], 7)
+
+    def test_compare(self):
+        """
+        Should flag the scenarios whose median slowed down beyond threshold
+        """
+        baseline = {'a': {'median': 1.0}, 'b': {'median': 1.0}}
+        results = {'a': {'median': 1.05}, 'b': {'median': 1.5},
+                   'c': {'median': 1.0}}
+        comparison = dict((c[0], c) for c in scenarios.compare(
+            baseline, results, threshold=0.1))
+        eq_(sorted(comparison), ['a', 'b'])
+        ok_(not comparison['a'][4])
+        ok_(comparison['b'][4])
+        eq_(comparison['b'][3], 1.5)
+
+    @patch('rna.rna.benchmarks.scenarios.SCENARIOS')
+    def test_run(self, mock_scenarios):
+        """
+        Should set up and run each scenario repeat times after a warm up
+        """
+        func, setup = Mock(), Mock()
+        mock_scenarios.__getitem__.return_value = (func, setup)
+        results = scenarios.run('context', ['a'], repeat=3)
+        eq_(func.call_count, 4)
+        eq_(setup.call_count, 4)
+        func.assert_called_with('context')
+        eq_(len(results['a']['times']), 3)
+
+
+class RNABenchCommandTest(TestCase):
+    def test_urlconf(self):
+        """
+        Should run the scenarios against the urls of its own package
+        """
+        eq_(rnabench.URLCONF, 'rna.rna.urls')
+
+
+class QueryRecorderTest(TestCase):
+    def connections(self):
+        connection = Mock(use_debug_cursor=False,
+                          queries=[{'sql': 'old', 'time': '1.000'}])
+        return connection, {'default': connection}
+
+    def test_record(self):
+        """
+        Should record the queries run within the block with the debug cursor
+        """
+        connection, connections = self.connections()
+        with patch('rna.rna.middleware.connections', connections):
+            with middleware.QueryRecorder() as recorder:
+                ok_(connection.use_debug_cursor)
+                connection.queries.extend([{'sql': 'a', 'time': '0.010'},
+                                           {'sql': 'b', 'time': '0.030'}])
+        ok_(not connection.use_debug_cursor)
+        eq_(recorder.count, 2)
+        eq_(round(recorder.time, 3), 0.04)
+        eq_([q['sql'] for q in recorder.slowest(1)], ['b'])
+
+    @patch('rna.rna.middleware.request_started')
+    def test_across_requests(self, mock_request_started):
+        """
+        Should keep the queries of every request until the outermost
+        recorder stops
+        """
+        connection, connections = self.connections()
+        with patch('rna.rna.middleware.connections', connections):
+            with middleware.QueryRecorder():
+                with middleware.QueryRecorder():
+                    pass
+                ok_(not mock_request_started.connect.called)
+            with middleware.QueryRecorder(across_requests=False):
+                pass
+        mock_request_started.disconnect.assert_called_once_with(
+            middleware.reset_queries)
+        mock_request_started.connect.assert_called_once_with(
+            middleware.reset_queries)
+
+    def test_assert_max_queries(self):
+        """
+        Should fail when the block runs more queries than the budget
+        """
+        connection, connections = self.connections()
+        query = {'sql': 'SELECT 1', 'time': '0.001'}
+        with patch('rna.rna.middleware.connections', connections):
+            with middleware.assert_max_queries(1):
+                connection.queries.append(query)
+            try:
+                with middleware.assert_max_queries(1):
+                    connection.queries.extend([query, query])
+            except AssertionError as e:
+                ok_('2 queries exceeded the budget of 1' in str(e))
+            else:
+                ok_(False, 'AssertionError not raised')
+
+
+class QueryCountMiddlewareTest(TestCase):
+    @patch('rna.rna.middleware.logger')
+    def test_headers(self, mock_logger):
+        """
+        Should add the query count and time of the request to the response
+        and log them
+        """
+        connection = Mock(use_debug_cursor=False, queries=[])
+        request = Mock(method='GET', path='/notes/')
+        response = MagicMock(status_code=200)
+        with patch('rna.rna.middleware.connections',
+                   {'default': connection}):
+            query_count = middleware.QueryCountMiddleware()
+            query_count.process_request(request)
+            connection.queries.extend([{'sql': 'a', 'time': '0.002'},
+                                       {'sql': 'b', 'time': '0.001'}])
+            eq_(query_count.process_response(request, response), response)
+        response.__setitem__.assert_any_call('X-RNA-Queries', '2')
+        response.__setitem__.assert_any_call('X-RNA-DB-Time', '3.0')
+        eq_(mock_logger.info.call_args[1]['extra']['slowest'], ['a', 'b'])
+        ok_(not connection.use_debug_cursor)
+
+    def test_no_recorder(self):
+        """
+        Should leave responses to requests it did not record untouched
+        """
+        response = MagicMock()
+        eq_(middleware.QueryCountMiddleware().process_response(
+            object(), response), response)
+        ok_(not response.__setitem__.called)
+
+
+@override_settings(ROOT_URLCONF=NestedURLConf)
+@patch('rna.rna.search.get_backend')
+class QueryBudgetTest(TestCase):
+    """
+    Keeps the number of queries of the hot API views constant, whatever
+    the number of objects they serialize.
+    """
+
+    def setUp(self):
+        create_tables(models.Release, models.Note,
+                      models.Note.releases.through, models.Tombstone)
+        with patch('rna.rna.search.get_backend'):
+            self.releases = [models.Release.objects.create(
+                product=product, channel='Release', version='27.0',
+                release_date=datetime(2014, 2, 4), is_public=True)
+                for product in ('Firefox', 'Firefox for Android')]
+            self.notes = []
+            for i in range(10):
+                note = models.Note.objects.create(
+                    note='Fixed', tag='Fixed',
+                    fixed_in_release=self.releases[0])
+                note.releases.add(*self.releases)
+                self.notes.append(note)
+
+    def get(self, path, budget):
+        with middleware.assert_max_queries(budget):
+            response = self.client.get(path)
+        eq_(response.status_code, 200)
+        return response
+
+    def test_notes(self, mock_get_backend):
+        """
+        Should list and retrieve notes within their query budgets
+        """
+        eq_(len(json.loads(self.get('/notes/', 3).content)), 10)
+        self.get('/notes/?page_size=5', 3)
+        self.get('/notes/%d/' % self.notes[0].pk, 3)
+
+    def test_releases(self, mock_get_backend):
+        """
+        Should list and retrieve releases, with or without their
+        equivalents, within their query budgets
+        """
+        eq_(len(json.loads(self.get('/releases/', 2).content)), 2)
+        self.get('/releases/?page_size=1', 2)
+        self.get('/releases/?include=equivalents', 5)
+        self.get('/releases/%d/' % self.releases[0].pk, 1)
+        self.get('/releases/%d/?include=equivalents' % self.releases[0].pk,
+                 3)
+
+    def test_nested_notes(self, mock_get_backend):
+        """
+        Should list the notes of a release within their query budget
+        """
+        path = '/releases/%d/notes/' % self.releases[0].pk
+        eq_(len(json.loads(self.get(path, 4).content)), 10)
+
+
+class SyncStatsTest(TestCase):
+    def test_saves(self):
+        """
+        Should count the created and updated instances of tracked models
+        """
+        sync_stats = stats.SyncStats([models.Note])
+        sync_stats.saved(models.Note, created=True)
+        sync_stats.saved(models.Release, created=True)
+        sync_stats.bulk_saved(models.Note, created=[1, 2], updated=[3])
+        sync_stats.bulk_saved(models.Release, created=[4])
+        counters = sync_stats.as_dict()['models']
+        eq_(list(counters), ['rna.note'])
+        eq_(counters['rna.note']['created'], 3)
+        eq_(counters['rna.note']['updated'], 1)
+
+    @patch('rna.rna.search.get_backend')
+    def test_start_stop(self, mock_get_backend):
+        """
+        Should only count saves between start and stop
+        """
+        sync_stats = stats.SyncStats()
+        sync_stats.start()
+        signals.bulk_saved.send(sender=models.Note, created=[1], updated=[])
+        sync_stats.stop()
+        signals.bulk_saved.send(sender=models.Note, created=[2], updated=[])
+        eq_(sync_stats.model(models.Note)['created'], 1)
+        ok_(sync_stats.elapsed >= 0)
+        ok_(sync_stats.memory_source in ('tracemalloc', 'rusage'))
+
+    @patch('rna.rna.stats.time.time')
+    def test_timer(self, mock_time):
+        mock_time.side_effect = [10, 12.5]
+        sync_stats = stats.SyncStats()
+        with sync_stats.timer(models.Release, 'save'):
+            pass
+        eq_(sync_stats.model(models.Release)['time']['save'], 2.5)
+
+    def test_lag(self):
+        """
+        Should report the lag behind the newest upstream modified timestamp
+        """
+        sync_stats = stats.SyncStats()
+        sync_stats.saw_modified(models.Note, datetime(2013, 10, 22))
+        sync_stats.saw_modified(models.Note, datetime(2013, 10, 23))
+        sync_stats.saw_modified(models.Note, datetime(2013, 10, 21))
+        counters = sync_stats.as_dict(now=datetime(2013, 10, 23, 0, 1))[
+            'models']['rna.note']
+        eq_(counters['newest_modified'], '2013-10-23T00:00:00')
+        eq_(counters['lag'], 60)
+
+    def test_record_response(self):
+        sync_stats = stats.SyncStats()
+        sync_stats.record_response(Mock(content='abc', status_code=200))
+        sync_stats.record_response(Mock(content='', status_code=304))
+        eq_(sync_stats.http, {'requests': 2, 'bytes': 3, 'cache_hits': 0,
+                              'not_modified': 1})
+
+
 class NoteTest(TestCase):
     def test_unicode(self):
         """
@@ -41,6 +432,14 @@ class NoteTest(TestCase):
         note = models.Note(note='test')
         eq_(unicode(note), 'test')
 
+    def test_prepare_save(self):
+        """
+        Should set the summary
+        """
+        note = models.Note(note='# Fixed\n\nA [crash](https://bugzil.la/1)')
+        note.prepare_save()
+        eq_(note.summary, 'Fixed A crash')
+
     def test_is_known_issue_for_not_known(self):
         """
         Should be False if is_known_issue is False.
@@ -107,29 +506,40 @@ class ReleaseTest(TestCase):
             'bug_status=RESOLVED&bug_status=VERIFIED&bug_status=CLOSED&'
             'v1=mozilla42&v2=fixed%2Cverified&limit=0')
 
-    def test_notes(self):
+    @patch('rna.rna.models.Release.ordered_notes')
+    def test_notes(self, mock_ordered_notes):
         """
-        Should split notes into new features and known issues.
+        Should split the ordered notes into new features and known issues.
         """
-        new_feature_1 = Mock(**{'is_known_issue_for.return_value': False,
-                                'tag': 'Changed'})
-        new_feature_2 = Mock(**{'is_known_issue_for.return_value': False})
-        dot_fix = Mock(**{'is_known_issue_for.return_value': False,
-                          'tag': 'Fixed',
-                          'note': '42.0.1 rendering glitches'})
-        known_issue_1 = Mock(**{'is_known_issue_for.return_value': True})
-        known_issue_2 = Mock(**{'is_known_issue_for.return_value': True})
+        release = models.Release(id=42)
+        notes = mock_ordered_notes.return_value
+        new_features, known_issues = release.notes(public_only=True)
+        mock_ordered_notes.assert_called_once_with(public_only=True)
+        eq_(new_features, notes.exclude.return_value)
+        eq_(known_issues, notes.filter.return_value)
+        known_issue = notes.filter.call_args[0][0]
+        eq_(str(notes.exclude.call_args[0][0]), str(known_issue))
+        eq_(str(known_issue),
+            str(models.models.Q(is_known_issue=True) &
+                ~models.models.Q(fixed_in_release=release)))
 
+    def test_ordered_notes(self):
+        """
+        Should classify and sort the notes in a single query.
+        """
         with patch.object(models.Release, 'note_set') as note_set:
-            release = models.Release()
-            note_set.order_by.return_value = [
-                new_feature_2, new_feature_1, dot_fix, known_issue_1,
-                known_issue_2]
-            new_features, known_issues = release.notes()
-            note_set.order_by.assert_called_with('-sort_num')
-
-        eq_(new_features, [dot_fix, new_feature_2, new_feature_1])
-        eq_(known_issues, [known_issue_1, known_issue_2])
+            release = models.Release(id=42, version='42.0.1')
+            notes = release.ordered_notes()
+            kwargs = note_set.extra.call_args[1]
+            eq_(kwargs['select'].keys(), ['known_issue', 'dot_fix',
+                                          'tag_rank'])
+            eq_(kwargs['select_params'],
+                [True, 42, True, 42, 'Fixed', 6, '42.0.1', True, 42] +
+                list(models.Note.TAGS))
+            note_set.extra.return_value.order_by.assert_called_once_with(
+                'known_issue', '-dot_fix', 'tag_rank', '-sort_num', 'id')
+            eq_(notes, note_set.extra.return_value.order_by.return_value)
+            ok_(not note_set.extra.return_value.filter.called)
 
     def test_notes_public_only(self):
         """
@@ -137,26 +547,30 @@ class ReleaseTest(TestCase):
         """
         with patch.object(models.Release, 'note_set') as note_set:
             release = models.Release()
-            release.notes(public_only=True)
-            note_set.order_by.return_value.filter.assert_called_with(
+            release.ordered_notes(public_only=True)
+            note_set.extra.return_value.filter.assert_called_with(
                 is_public=True)
 
     @override_settings(DEV=True)
     def test_equivalent_release_for_product_dev(self):
         """
         Should return the release for the specified product with
-        the same channel and major version
+        the same channel and major version with the highest version key
         """
         release = models.Release(version='42.0', channel='Release')
         release._default_manager = Mock()
         mock_order_by = release._default_manager.filter.return_value.order_by
-        mock_order_by.return_value = [
-            models.Release(version='42.0'), models.Release(version='42.0.1')]
+        mock_order_by.return_value.__getitem__ = Mock(
+            return_value=[models.Release(version='42.0.1')])
         eq_(release.equivalent_release_for_product('Firefox').version,
             '42.0.1')
-        release._default_manager.filter.assert_called_once_with(
-            version__startswith='42.', channel='Release', product='Firefox')
-        mock_order_by.assert_called_once_with('-version')
+        eq_(str(release._default_manager.filter.call_args[0][0]),
+            str(models.models.Q(product='Firefox', channel='Release',
+                                version_key__gte='00042.',
+                                version_key__lt='00042/')))
+        mock_order_by.assert_called_once_with('-version_key')
+        mock_order_by.return_value.__getitem__.assert_called_once_with(
+            slice(None, 1))
 
     @override_settings(DEV=False)
     def test_equivalent_release_for_product_prod(self):
@@ -168,15 +582,12 @@ class ReleaseTest(TestCase):
         release = models.Release(version='42.0', channel='Release')
         release._default_manager = Mock()
         mock_order_by = release._default_manager.filter.return_value.order_by
-        mock_public_filter = Mock(
-            return_value=[
-                models.Release(version='42.0'), models.Release(version='42.0.1')])
-        mock_order_by.return_value = Mock(filter=mock_public_filter)
+        mock_public_filter = mock_order_by.return_value.filter
+        mock_public_filter.return_value.__getitem__ = Mock(
+            return_value=[models.Release(version='42.0.1')])
         eq_(release.equivalent_release_for_product('Firefox').version,
             '42.0.1')
-        release._default_manager.filter.assert_called_once_with(
-            version__startswith='42.', channel='Release', product='Firefox')
-        mock_order_by.assert_called_once_with('-version')
+        mock_order_by.assert_called_once_with('-version_key')
         mock_public_filter.assert_called_once_with(is_public=True)
 
     def test_no_equivalent_release_for_product(self):
@@ -189,6 +600,56 @@ class ReleaseTest(TestCase):
             EmptyQuerySet())
         eq_(release.equivalent_release_for_product('Firefox'), None)
 
+    @override_settings(DEV=False)
+    def test_equivalent_releases(self):
+        """
+        Should resolve the equivalents of all releases with one query,
+        picking the highest version of each product, channel and major
+        version
+        """
+        desktop = models.Release(id=1, product='Firefox', version='42.0',
+                                 channel='Release')
+        android = models.Release(id=2, product='Firefox for Android',
+                                 version='42.0.1', channel='Release')
+        os = models.Release(id=3, product='Firefox OS', version='1.0')
+        candidates = [
+            models.Release(id=4, product='Firefox for Android',
+                           channel='Release', version_key=models.version_key(
+                               '42.0')),
+            models.Release(id=5, product='Firefox for Android',
+                           channel='Release', version_key=models.version_key(
+                               '42.0.2')),
+            models.Release(id=6, product='Firefox', channel='Release',
+                           version_key=models.version_key('42.0.1')),
+        ]
+        with patch.object(models.Release, '_default_manager') as manager:
+            manager.filter.return_value.filter.return_value = candidates
+            equivalents = models.Release.equivalent_releases(
+                [desktop, android, os])
+        eq_(dict((k, getattr(v, 'id', None))
+                 for k, v in equivalents.items()), {1: 5, 2: 6, 3: None})
+        eq_(manager.filter.call_count, 1)
+        manager.filter.return_value.filter.assert_called_once_with(
+            is_public=True)
+
+    def test_equivalent_releases_none(self):
+        """
+        Should not query for releases without equivalent products
+        """
+        with patch.object(models.Release, '_default_manager') as manager:
+            eq_(models.Release.equivalent_releases(
+                [models.Release(id=3, product='Firefox OS')]), {3: None})
+        ok_(not manager.filter.called)
+
+    def test_prepare_save(self):
+        """
+        Should set the version key
+        """
+        release = models.Release(version='42.0b3', text='*Fixed* bugs')
+        release.prepare_save()
+        eq_(release.version_key, models.version_key('42.0b3'))
+        eq_(release.summary, 'Fixed bugs')
+
     def test_equivalent_android_release(self):
         """
         Should return the equivalent_release_for_product where the
@@ -234,6 +695,167 @@ class ReleaseTest(TestCase):
         eq_(release.equivalent_release_for_product.called, 0)
 
 
+class ReleaseEquivalentsSerializerTest(TestCase):
+    @patch('rna.rna.serializers.reverse', return_value='/releases/5/')
+    def test_equivalents(self, mock_reverse):
+        """
+        Should link the equivalent release for the other platform
+        """
+        serializer = serializers.ReleaseEquivalentsSerializer(
+            context={'equivalents': {1: models.Release(id=5), 2: None},
+                     'request': 'request'})
+        desktop = models.Release(id=1, product='Firefox')
+        eq_(serializer.get_equivalent_android_release(desktop),
+            '/releases/5/')
+        eq_(serializer.get_equivalent_desktop_release(desktop), None)
+        mock_reverse.assert_called_once_with(
+            'release-detail', kwargs={'pk': 5}, request='request')
+        eq_(serializer.get_equivalent_desktop_release(
+            models.Release(id=2, product='Firefox for Android')), None)
+
+    @patch('rna.rna.serializers.reverse', return_value='/releases/5/')
+    def test_equivalents_missing(self, mock_reverse):
+        """
+        Should query the equivalent of a release missing from the
+        equivalents context
+        """
+        serializer = serializers.ReleaseEquivalentsSerializer(context={})
+        desktop = models.Release(id=1, product='Firefox')
+        desktop.equivalent_release_for_product = Mock(
+            return_value=models.Release(id=5))
+        eq_(serializer.get_equivalent_android_release(desktop),
+            '/releases/5/')
+        desktop.equivalent_release_for_product.assert_called_once_with(
+            'Firefox for Android')
+
+
+class ReleaseViewSetTest(TestCase):
+    @patch('rna.rna.views.models.Release.equivalent_releases')
+    def test_include_equivalents(self, mock_equivalent_releases):
+        """
+        Should resolve the equivalents of all listed releases at once
+        """
+        view = views.ReleaseViewSet()
+        view.request = Mock(QUERY_PARAMS={'include': 'equivalents'})
+        view.format_kwarg = None
+        releases = [models.Release(id=1), models.Release(id=2)]
+        serializer = view.get_serializer(releases, many=True)
+        ok_(isinstance(serializer,
+                       serializers.ReleaseEquivalentsSerializer))
+        mock_equivalent_releases.assert_called_once_with(releases)
+        eq_(serializer.context['equivalents'],
+            mock_equivalent_releases.return_value)
+
+    @patch('rna.rna.views.models.Release.equivalent_releases')
+    def test_no_include(self, mock_equivalent_releases):
+        view = views.ReleaseViewSet()
+        view.request = Mock(QUERY_PARAMS={})
+        view.format_kwarg = None
+        serializer = view.get_serializer(models.Release(id=1))
+        ok_(not isinstance(serializer,
+                           serializers.ReleaseEquivalentsSerializer))
+        ok_(not mock_equivalent_releases.called)
+
+    @override_settings(ROOT_URLCONF=RouterURLConf)
+    @patch('rna.rna.search.get_backend')
+    def test_create_include_equivalents(self, mock_get_backend):
+        """
+        Should create a release and link its equivalent
+        """
+        create_tables(models.Release, models.Note,
+                      models.Note.releases.through)
+        android = models.Release.objects.create(
+            product='Firefox for Android', channel='Release', version='27.0',
+            release_date=datetime(2014, 2, 4), is_public=True)
+        user = User.objects.create_superuser('admin', 'a@b.c', 'admin')
+        token = Token.objects.create(user=user)
+        response = self.client.post(
+            '/releases/?include=equivalents', json.dumps({
+                'product': 'Firefox', 'channel': 'Release',
+                'version': '27.0', 'release_date': '2014-02-04T00:00:00'}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='Token %s' % token.key)
+        eq_(response.status_code, 201)
+        data = json.loads(response.content)
+        ok_(data['equivalent_android_release'].endswith(
+            '/releases/%d/' % android.pk))
+        eq_(data['equivalent_desktop_release'], None)
+
+    @override_settings(ROOT_URLCONF=RouterURLConf)
+    @patch('rna.rna.search.get_backend')
+    def test_get_equivalent_changed(self, mock_get_backend):
+        """
+        Should change the ETag of releases with their equivalents when a
+        new equivalent is created
+        """
+        create_tables(models.Release, models.Note,
+                      models.Note.releases.through)
+        desktop = models.Release.objects.create(
+            product='Firefox', channel='Release', version='42.0',
+            release_date=datetime(2015, 11, 3), is_public=True)
+        models.Release.objects.create(
+            product='Firefox for Android', channel='Release', version='42.0',
+            release_date=datetime(2015, 11, 3), is_public=True)
+        paths = ('/releases/%d/?include=equivalents' % desktop.pk,
+                 '/releases/?include=equivalents&product=Firefox')
+        etags = [self.client.get(path)['ETag'] for path in paths]
+        for path, etag in zip(paths, etags):
+            eq_(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code,
+                304)
+
+        android = models.Release.objects.create(
+            product='Firefox for Android', channel='Release',
+            version='42.0.1', release_date=datetime(2015, 11, 3),
+            is_public=True)
+        for path, etag in zip(paths, etags):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            eq_(response.status_code, 200)
+            ok_(response['ETag'] != etag)
+        ok_(json.loads(response.content)[0]['equivalent_android_release']
+            .endswith('/releases/%d/' % android.pk))
+
+
+class VersionKeyTest(TestCase):
+    def test_version_key(self):
+        """
+        Should sort numerically, with pre-releases before releases and
+        ESRs after them
+        """
+        versions = ['9.0', '10.0a1', '10.0a2', '10.0beta', '10.0b3',
+                    '10.0rc1', '10.0', '10.0esr', '10.0.0.0.1', '10.0.1',
+                    '10.0.1esr', '10.1', '24.0a2']
+        eq_(sorted(reversed(versions), key=models.version_key), versions)
+        eq_(models.version_key('10.0'), '00010.00000.00000.00000-400000')
+        eq_(models.version_key('10.0'), models.version_key('10.0.0'))
+
+    def test_version_key_not_numeric(self):
+        """
+        Should sort versions that do not start with a number first
+        """
+        ok_(models.version_key('beta') < models.version_key('0.1'))
+
+
+class SummarizeTest(TestCase):
+    def test_markdown(self):
+        """
+        Should keep the text of links, and drop other markup and extra
+        whitespace
+        """
+        eq_(models.summarize('## New\n\n* __Faster__ `startup`, see '
+                             '[bug 1](https://bugzil.la/1) <br>\n> snake_case'),
+            'New Faster startup, see bug 1 snake_case')
+        eq_(models.summarize(None), '')
+
+    def test_truncate(self):
+        """
+        Should cut long text at a word boundary, with an ellipsis
+        """
+        eq_(models.summarize('word ' * 30, length=22),
+            u'word word word word\u2026')
+        eq_(models.summarize('x' * 30, length=10), u'x' * 9 + u'\u2026')
+        eq_(models.summarize('word ' * 2, length=9), 'word word')
+
+
 class ISO8601DateTimeFieldTest(TestCase):
     @patch('rna.rna.fields.parse_datetime')
     def test_strptime(self, mock_parse_datetime):
@@ -329,6 +951,201 @@ class TimestampedFilterBackendTest(TestCase):
             ['created_after', 'modified_before', 'modified_after', 'test'])
         eq_(mock_super_get_filter_class.called, 0)
 
+    def test_order_by_pk(self):
+        """
+        Should break ordering ties on pk, in the same direction
+        """
+        queryset = Mock(model=TimeStampedModelSubclass)
+        filter_backend = filters.TimestampedFilterBackend()
+        filter_class = filter_backend.get_filter_class(
+            'nice', queryset=queryset)
+        filterset = filter_class(queryset=queryset)
+        eq_(filterset.get_order_by('modified'), ['modified', 'pk'])
+        eq_(filterset.get_order_by('-modified'), ['-modified', '-pk'])
+
+    def test_cached(self):
+        """
+        Should compile one filter class per model and excluded fields
+        """
+        queryset = Mock(model=TimeStampedModelSubclass)
+        filter_backend = filters.TimestampedFilterBackend()
+        filter_class = filter_backend.get_filter_class(
+            Mock(filter_class=None, filter_fields=None,
+                 filter_fields_exclude=('test',)), queryset=queryset)
+        ok_(filters.TimestampedFilterBackend().get_filter_class(
+            Mock(filter_class=None, filter_fields=None,
+                 filter_fields_exclude=['test']),
+            queryset=queryset) is filter_class)
+        ok_(filter_backend.get_filter_class(
+            'nice', queryset=queryset) is not filter_class)
+
+    @override_settings(RNA={'FILTER_POLICY': 'indexed'})
+    def test_indexed_policy(self):
+        """
+        Should only filter and order on indexed fields, by default on the
+        first of them
+        """
+        queryset = Mock(model=TimeStampedModelSubclass)
+        filter_class = filters.TimestampedFilterBackend().get_filter_class(
+            'nice', queryset=queryset)
+        eq_(sorted(filter_class.base_filters),
+            ['id', 'modified_after', 'modified_before'])
+        filterset = filter_class({}, queryset=queryset)
+        eq_([c[0] for c in filterset.ordering_field.choices],
+            ['modified', '-modified', 'id', '-id'])
+
+    @override_settings(RNA={'FILTER_POLICY': 'reject'})
+    def test_reject_policy(self):
+        """
+        Should reject filters and orderings on unindexed fields
+        """
+        queryset = Mock(model=TimeStampedModelSubclass)
+        filter_backend = filters.TimestampedFilterBackend()
+        filter_class = filter_backend.get_filter_class(
+            'nice', queryset=queryset)
+        filter_backend.check_policy(
+            Mock(QUERY_PARAMS={'modified_after': '2013-01-01', 'o': '-id'}),
+            filter_class)
+        for params in ({'test': 'True'}, {'created_after': '2013-01-01'},
+                       {'o': '-created'}):
+            try:
+                filter_backend.check_policy(Mock(QUERY_PARAMS=params),
+                                            filter_class)
+            except filters.UnindexedFilter as e:
+                eq_(e.status_code, 400)
+            else:
+                ok_(False, '%r was not rejected' % params)
+
+    @override_settings(RNA={'FILTER_POLICY': 'warn'})
+    @patch('rna.rna.filters.logger')
+    def test_warn_policy(self, mock_logger):
+        """
+        Should log filters and orderings on unindexed fields
+        """
+        queryset = Mock(model=TimeStampedModelSubclass)
+        filter_backend = filters.TimestampedFilterBackend()
+        filter_class = filter_backend.get_filter_class(
+            'nice', queryset=queryset)
+        filter_backend.check_policy(
+            Mock(QUERY_PARAMS={'test': 'True', 'o': 'created'},
+                 path='/rna/notes/'), filter_class)
+        mock_logger.warning.assert_called_once_with(
+            'path=%s %s', '/rna/notes/',
+            'Filtering or ordering on unindexed fields: test, o=created')
+
+
+class GetCacheTest(TestCase):
+    @override_settings(RNA={})
+    def test_default(self):
+        """
+        Should return an empty dict if no backend is configured
+        """
+        eq_(caches.get_cache(), {})
+
+    @override_settings(RNA={'CACHE': {
+        'BACKEND': 'rna.rna.caches.LRUCache',
+        'OPTIONS': {'max_entries': 10, 'ttl': 60}}})
+    def test_settings(self):
+        """
+        Should import the backend from settings and apply its options,
+        overridden by keyword arguments
+        """
+        cache = caches.get_cache(ttl=5)
+        ok_(isinstance(cache, caches.LRUCache))
+        eq_(cache.max_entries, 10)
+        eq_(cache.ttl, 5)
+
+
+class LRUCacheTest(TestCase):
+    def test_max_entries(self):
+        """
+        Should evict the least recently used entry
+        """
+        cache = caches.LRUCache(max_entries=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        eq_(cache.get('a'), 1)
+        cache['c'] = 3
+        ok_('b' not in cache)
+        eq_(cache['a'], 1)
+        eq_(cache['c'], 3)
+        eq_(cache.stats()['evictions'], 1)
+
+    def test_max_bytes(self):
+        """
+        Should evict entries until the total size of response bodies
+        fits within max_bytes
+        """
+        cache = caches.LRUCache(max_bytes=10)
+        cache['a'] = Mock(content='12345')
+        cache['b'] = Mock(content='12345')
+        eq_(cache.size, 10)
+        cache['c'] = Mock(content='123')
+        ok_('a' not in cache)
+        eq_(cache.size, 8)
+
+    def test_ttl(self):
+        """
+        Should miss once an entry is older than its ttl
+        """
+        now = [1000]
+        cache = caches.LRUCache(ttl=30, timer=lambda: now[0])
+        cache['a'] = 'abides'
+        cache.set('b', 'abides', ttl=60)
+        now[0] += 30
+        eq_(cache.get('a'), None)
+        eq_(cache.get('b'), 'abides')
+        eq_(len(cache), 1)
+
+    def test_stats(self):
+        """
+        Should count hits and misses
+        """
+        cache = caches.LRUCache()
+        cache['a'] = 'abides'
+        cache.get('a')
+        cache.get('b')
+        eq_(cache.pop('a'), 'abides')
+        eq_(cache.stats(), {'entries': 0, 'bytes': 0, 'hits': 1,
+                            'misses': 1, 'evictions': 0})
+
+
+class SQLiteCacheTest(TestCase):
+    def response(self, content='{"the": "dude"}'):
+        response = requests.Response()
+        response.url = 'http://thedu.de/'
+        response.status_code = 200
+        response.headers['ETag'] = '"abides"'
+        response.encoding = 'utf-8'
+        response._content = content
+        return response
+
+    def test_fresh_in_process(self):
+        """
+        Should not flag responses stored by this instance for revalidation
+        """
+        cache = caches.SQLiteCache(':memory:')
+        cache['http://thedu.de/'] = self.response()
+        response = cache['http://thedu.de/']
+        eq_(response.json(), {'the': 'dude'})
+        eq_(response.headers['etag'], '"abides"')
+        eq_(response.needs_revalidation, False)
+
+    def test_persistent(self):
+        """
+        Should flag responses stored by another instance for revalidation
+        """
+        path = tempfile.mktemp()
+        try:
+            caches.SQLiteCache(path)['key'] = self.response()
+            cache = caches.SQLiteCache(path)
+            ok_('key' in cache)
+            eq_(cache.get('key').needs_revalidation, True)
+            eq_(cache.pop('key').content, '{"the": "dude"}')
+            eq_(len(cache), 0)
+        finally:
+            os.remove(path)
+
 
 class RestClientTest(TestCase):
     def test_init_kwargs(self):
@@ -349,7 +1166,39 @@ class RestClientTest(TestCase):
         eq_(rc.base_url, 'http://thedu.de')
         eq_(rc.token, 'midnight')
 
-    @patch('rna.rna.clients.requests.request')
+    def test_init_session(self):
+        """
+        Should use the given session instead of creating a new one
+        """
+        session = Mock()
+        rc = clients.RestClient(base_url='http://thedu.de', session=session)
+        eq_(rc.session, session)
+
+    @override_settings(RNA={'BASE_URL': 'http://thedu.de',
+                            'POOL_CONNECTIONS': 2, 'POOL_MAXSIZE': 20,
+                            'POOL_BLOCK': True})
+    @patch('rna.rna.clients.HTTPAdapter')
+    def test_get_session(self, mock_adapter):
+        """
+        Should mount an adapter sized from settings for http and https
+        """
+        session = clients.RestClient().session
+        mock_adapter.assert_called_once_with(
+            pool_connections=2, pool_maxsize=20, pool_block=True)
+        eq_(session.adapters['http://'], mock_adapter.return_value)
+        eq_(session.adapters['https://'], mock_adapter.return_value)
+
+    def test_close(self):
+        """
+        Should close the session when leaving the context manager
+        """
+        session = Mock()
+        with clients.RestClient(base_url='http://thedu.de',
+                                session=session) as rc:
+            eq_(rc.session, session)
+        session.close.assert_called_once_with()
+
+    @patch('rna.rna.clients.requests.Session.request')
     def test_request_base_url_concat(self, mock_request):
         """
         Should concatenate base_url and url
@@ -361,7 +1210,7 @@ class RestClientTest(TestCase):
         mock_request.assert_called_once_with('get', 'http://thedu.de/abides')
         eq_(response, 'response')
 
-    @patch('rna.rna.clients.requests.request')
+    @patch('rna.rna.clients.requests.Session.request')
     def test_request_redundant_url(self, mock_request):
         """
         Should not concatenate base_url if url starts with it
@@ -373,7 +1222,7 @@ class RestClientTest(TestCase):
         eq_(response.content, '{"aggression": "not stand"}')
         mock_request.assert_called_once_with('get', 'http://thedu.de/abides')
 
-    @patch('rna.rna.clients.requests.request')
+    @patch('rna.rna.clients.requests.Session.request')
     def test_request_token(self, mock_request):
         """
         Should set Authorization header to expected format
@@ -386,7 +1235,7 @@ class RestClientTest(TestCase):
             headers={'Authorization': 'Token midnight'})
         eq_(response, 'this aggression will not stand!')
 
-    @patch('rna.rna.clients.requests.request')
+    @patch('rna.rna.clients.requests.Session.request')
     def test_request_token_preserves_headers(self, mock_request):
         """
         Should set Authorization header to expected format without removing
@@ -402,7 +1251,7 @@ class RestClientTest(TestCase):
             headers={'Authorization': 'Token midnight', 'White': 'Russian'})
         eq_(response, 'this aggression will not stand!')
 
-    @patch('rna.rna.clients.requests.request')
+    @patch('rna.rna.clients.requests.Session.request')
     def test_request_delete(self, mock_request):
         """
         Should return unmodified response from requests.request
@@ -446,7 +1295,7 @@ class RestClientTest(TestCase):
         Should return cached response without calling self.request
         """
         rc = clients.RestClient(base_url='http://thedu.de')
-        rc.cache = {'': 'abides'}
+        rc.cache = {'http://thedu.de': 'abides'}
         response = rc.get()
         eq_(response, 'abides')
         ok_(not mock_request.called)
@@ -461,7 +1310,7 @@ class RestClientTest(TestCase):
         response = rc.get()
         mock_request.assert_called_once_with('get', '')
         eq_(response.status_code, 200)
-        eq_(rc.cache[''].status_code, 200)
+        eq_(rc.cache['https://nucleus.mozilla.org/rna/'].status_code, 200)
 
     @patch('rna.rna.clients.RestClient.request')
     def test_get_cache_miss_500(self, mock_request):
@@ -475,6 +1324,40 @@ class RestClientTest(TestCase):
         mock_request.assert_called_once_with('get', '')
         eq_(rc.cache, {})
 
+    @patch('rna.rna.clients.RestClient.request')
+    def test_get_revalidate_not_modified(self, mock_request):
+        """
+        Should send the validators of a cached response that needs
+        revalidation and return the cached response on 304
+        """
+        cached = Mock(status_code=200, needs_revalidation=True,
+                      headers={'ETag': '"abides"',
+                               'Last-Modified': 'Sun, 06 Nov 1994'})
+        mock_request.return_value = Mock(status_code=304, headers={})
+        rc = clients.RestClient(base_url='http://thedu.de')
+        rc.cache = {'http://thedu.de/rug': cached}
+        response = rc.get('/rug')
+        eq_(response, cached)
+        eq_(response.needs_revalidation, False)
+        mock_request.assert_called_once_with(
+            'get', '/rug', headers={'If-None-Match': '"abides"',
+                                    'If-Modified-Since': 'Sun, 06 Nov 1994'})
+
+    @patch('rna.rna.clients.RestClient.request')
+    def test_get_revalidate_modified(self, mock_request):
+        """
+        Should replace a cached response that needs revalidation when the
+        server returns a new body
+        """
+        cached = Mock(status_code=200, needs_revalidation=True, headers={})
+        mock_request.return_value = Mock(status_code=200)
+        rc = clients.RestClient(base_url='http://thedu.de')
+        rc.cache = {'http://thedu.de/rug': cached}
+        response = rc.get('/rug')
+        eq_(response, mock_request.return_value)
+        eq_(rc.cache['http://thedu.de/rug'], mock_request.return_value)
+        mock_request.assert_called_once_with('get', '/rug', headers={})
+
     @patch('rna.rna.clients.RestClient.request')
     def test_options(self, mock_request):
         """
@@ -493,7 +1376,8 @@ class RestClientTest(TestCase):
         Should return cached value without calling self.request
         """
         rc = clients.RestClient(base_url='http://thedu.de')
-        rc.cache['OPTIONS'] = {'/drinks': {'white': 'russians'}}
+        rc.cache[('OPTIONS', 'http://thedu.de/drinks')] = {
+            'white': 'russians'}
         response = rc.options('/drinks')
         eq_(mock_request.called, 0)
         eq_(response, {'white': 'russians'})
@@ -537,7 +1421,8 @@ class RestModelClientTest(TestCase):
             base_url='http://thedu.de', token='midnight', model_class='super')
         eq_(rc.model_class, 'super')
         mock_super_init.assert_called_once_with(
-            base_url='http://thedu.de', cache=None, token='midnight')
+            base_url='http://thedu.de', cache=None, session=None,
+            token='midnight')
 
     @patch('rna.rna.clients.RestModelClient.serializer')
     @patch('rna.rna.clients.RestModelClient.restore')
@@ -557,10 +1442,12 @@ class RestModelClientTest(TestCase):
         mock_restore.assert_called_once_with(
             'mock serializer', data, False, False)
 
+    @patch('rna.rna.clients.RestModelClient.resolve_hyperlinks')
     @patch('rna.rna.clients.RestModelClient.serializer')
     @patch('rna.rna.clients.RestModelClient.restore')
     @patch('rna.rna.clients.RestModelClient.get')
-    def test_models(self, mock_get, mock_restore, mock_serializer):
+    def test_models(self, mock_get, mock_restore, mock_serializer,
+                    mock_resolve_hyperlinks):
         """
         Should return list of model instances if data from get is a list
         """
@@ -570,6 +1457,8 @@ class RestModelClientTest(TestCase):
         rc = clients.RestModelClient()
         rc.model(model_class='super')
         mock_serializer.assert_called_once_with('super')
+        mock_resolve_hyperlinks.assert_called_once_with(
+            'mock serializer', data, False)
         mock_restore.assert_any_call(
             'mock serializer', data[0], False, False)
         mock_restore.assert_any_call(
@@ -624,6 +1513,109 @@ class RestModelClientTest(TestCase):
         })
         eq_(mock_serializer.save_object.called, 0)
 
+    @patch('rna.rna.clients.RestClient.request')
+    def test_iter_pages(self, mock_request):
+        """
+        Should follow next links without resending params
+        """
+        mock_request.side_effect = [
+            Mock(json=lambda: {'next': 'http://thedu.de/?cursor=abc',
+                               'results': [1, 2]}),
+            Mock(json=lambda: {'next': None, 'results': [3]}),
+        ]
+        rc = clients.RestModelClient(base_url='http://thedu.de/')
+        pages = list(rc.iter_pages(params={'modified_after': 'now'}))
+        eq_(pages, [[1, 2], [3]])
+        mock_request.assert_any_call(
+            'get', '', params={'modified_after': 'now'})
+        mock_request.assert_any_call('get', 'http://thedu.de/?cursor=abc')
+
+    @patch('rna.rna.clients.RestClient.request')
+    def test_iter_pages_unpaginated(self, mock_request):
+        """
+        Should yield a list response as a single page
+        """
+        mock_request.return_value = Mock(json=lambda: [1, 2])
+        rc = clients.RestModelClient(base_url='http://thedu.de/')
+        eq_(list(rc.iter_pages()), [[1, 2]])
+        mock_request.return_value.raise_for_status.assert_called_once_with()
+
+    @patch('rna.rna.clients.RestClient.request')
+    def test_iter_pages_cursor(self, mock_request):
+        """
+        Should skip the objects up to the (modified, pk) cursor
+        """
+        mock_request.return_value = Mock(json=lambda: [
+            {'id': 3, 'modified': '2013-10-22T22:29:03'},
+            {'id': 5, 'modified': '2013-10-22T22:29:03'},
+            {'id': 1, 'modified': '2013-10-23T00:00:00'},
+        ])
+        rc = clients.RestModelClient(base_url='http://thedu.de/')
+        pages = list(rc.iter_pages(
+            cursor=(datetime(2013, 10, 22, 22, 29, 3), 4)))
+        eq_([[d['id'] for d in page] for page in pages], [[5, 1]])
+
+    @patch('rna.rna.clients.RestClient.request')
+    def test_iter_pages_stats(self, mock_request):
+        """
+        Should record the fetched and skipped objects of each page and the
+        newest modified timestamp with stats
+        """
+        mock_request.return_value = Mock(json=lambda: [
+            {'id': 3, 'modified': '2013-10-22T22:29:03'},
+            {'id': 5, 'modified': '2013-10-23T00:00:00'},
+        ])
+        rc = clients.RestModelClient(base_url='http://thedu.de/',
+                                     model_class=models.Note)
+        rc.stats = stats.SyncStats()
+        list(rc.iter_pages(cursor=(datetime(2013, 10, 22, 22, 29, 3), 4)))
+        counters = rc.stats.model(models.Note)
+        eq_(counters['fetched'], 1)
+        eq_(counters['skipped'], 1)
+        eq_(counters['newest_modified'], datetime(2013, 10, 23))
+
+    @patch('rna.rna.clients.RestModelClient.serializer')
+    @patch('rna.rna.clients.RestModelClient.restore_many',
+           side_effect=lambda serializer, data, *args: data)
+    @patch('rna.rna.clients.RestModelClient.iter_pages')
+    def test_iter_models(self, mock_iter_pages, mock_restore_many,
+                         mock_serializer):
+        """
+        Should restore each page in chunks of chunk_size objects
+        """
+        mock_iter_pages.return_value = iter([[1, 2, 3], [4]])
+        rc = clients.RestModelClient()
+        instances = rc.iter_models(model_class='super', save=True,
+                                   chunk_size=2, params={'the': 'dude'})
+        eq_(list(instances), [1, 2, 3, 4])
+        mock_iter_pages.assert_called_once_with('', params={'the': 'dude'})
+        serializer = mock_serializer.return_value
+        eq_(mock_restore_many.call_args_list, [
+            ((serializer, [1, 2], True, False, False),),
+            ((serializer, [3], True, False, False),),
+            ((serializer, [4], True, False, False),),
+        ])
+
+    @patch('rna.rna.clients.utils.bulk_upsert')
+    @patch('rna.rna.clients.RestModelClient.resolve_hyperlinks')
+    @patch('rna.rna.clients.RestModelClient.restore')
+    def test_restore_many_bulk(self, mock_restore, mock_resolve_hyperlinks,
+                               mock_bulk_upsert):
+        """
+        Should restore without saving and write all instances at once
+        """
+        mock_serializer = Mock()
+        data = [{'eyes': 'yellow'}, {'rank': 'lieutenant commander'}]
+        rc = clients.RestModelClient()
+        instances = rc.restore_many(mock_serializer, data, save=True,
+                                    bulk=True)
+        mock_resolve_hyperlinks.assert_called_once_with(
+            mock_serializer, data, True)
+        mock_restore.assert_any_call(mock_serializer, data[0])
+        mock_restore.assert_any_call(mock_serializer, data[1])
+        mock_bulk_upsert.assert_called_once_with(
+            mock_serializer.Meta.model, instances, modified=False)
+
     @patch('rna.rna.clients.RestModelClient.hypermodel')
     def test_restore_save_modified(self, mock_hypermodel):
         """
@@ -669,18 +1661,20 @@ class RestModelClientTest(TestCase):
         mock_serialize.assert_called_once_with(instance)
 
     @patch('rna.rna.clients.RestClient.__init__')
-    @patch('rna.rna.clients.RestModelClient.serializer')
-    def test_serialize(self, mock_serializer, mock_super_init):
+    @patch('rna.rna.serializers.get_field_plan')
+    def test_serialize(self, mock_get_field_plan, mock_super_init):
         """
-        Should pass instance through to serializer and return data attr
+        Should serialize instance with the field plan of model_class
         """
-        serialized_data = '{"eyes": "yellow"}'
-        mock_serializer.return_value = Mock(data=serialized_data)
+        serialized_data = {'eyes': 'yellow'}
+        mock_plan = mock_get_field_plan.return_value
+        mock_plan.serialize_many.return_value = [serialized_data]
         mock_instance = Mock(eyes='yellow')
-        rc = clients.RestModelClient()
+        rc = clients.RestModelClient(model_class='replicant')
         serialized = rc.serialize(instance=mock_instance)
         eq_(serialized, serialized_data)
-        mock_serializer.assert_called_once_with(instance=mock_instance)
+        mock_get_field_plan.assert_called_once_with('replicant')
+        mock_plan.serialize_many.assert_called_once_with([mock_instance])
 
     def test_model_client_default(self):
         rc = clients.RestModelClient(model_class='super')
@@ -689,6 +1683,26 @@ class RestModelClientTest(TestCase):
         eq_(model_client.model_class, 'amateur')
         eq_(rc.model_map['amateur'], model_client)
 
+    def test_model_client_shares_session(self):
+        """
+        Should pass the parent session on to new model clients
+        """
+        rc = clients.RestModelClient(model_class='super')
+        model_client = rc.model_client(model_class='session sharing')
+        eq_(model_client.session, rc.session)
+
+    def test_model_client_shares_cache(self):
+        """
+        Should pass the parent cache on to new model clients, and build
+        the client of a model only once
+        """
+        rc = clients.RestModelClient(model_class='super', cache={})
+        model_client = rc.model_client(model_class='cache sharing')
+        ok_(model_client.cache is rc.cache)
+        with patch.object(clients.RestModelClient, '__init__') as mock_init:
+            ok_(rc.model_client(model_class='cache sharing') is model_client)
+        ok_(not mock_init.called)
+
     @patch('rna.rna.clients.RestModelClient.get',
            return_value=Mock(json=lambda: {'the_dude': 'http://abid.es'}))
     def test_model_client_url_name(self, mock_get):
@@ -738,6 +1752,73 @@ class RestModelClientTest(TestCase):
             token='midnight')
         mock_model.assert_called_once_with(url='42/', save=False)
 
+    def test_hypermodel_identity_map(self):
+        """
+        Should return instances from the identity map without querying
+        """
+        mock_model_class = Mock()
+        rc = clients.RestModelClient()
+        rc.identity_map[(mock_model_class, '42')] = 'the answer'
+        eq_(rc.hypermodel('http://the.answ.er/is/42/', mock_model_class,
+                          False), 'the answer')
+        eq_(mock_model_class.objects.get.called, False)
+
+    @patch('rna.rna.clients.RestModelClient.hypermodels')
+    def test_resolve_hyperlinks(self, mock_hypermodels):
+        """
+        Should collect the hyperlinks of every FK and M2M field for all of
+        the data before resolving them per related model
+        """
+        mock_fk_field = Mock(spec=models.models.ForeignKey)
+        mock_fk_field.name = 'fk'
+        mock_fk_field.rel = Mock(to='to')
+        mock_m2m_field = Mock(spec=models.models.ManyToManyField)
+        mock_m2m_field.name = 'm2m'
+        mock_m2m_field.rel = Mock(to='to2')
+        mock_serializer = Mock()
+        mock_serializer.Meta.model._meta.fields = [mock_fk_field]
+        mock_serializer.Meta.model._meta.many_to_many = [mock_m2m_field]
+
+        rc = clients.RestModelClient()
+        rc.resolve_hyperlinks(mock_serializer, [
+            {'fk': 'http://a/1/', 'm2m': ['http://b/1/', 'http://b/2/']},
+            {'fk': None, 'm2m': ['http://b/2/']},
+            {'fk': 'http://a/2/'},
+        ], save=True)
+        mock_hypermodels.assert_any_call(
+            set(['http://a/1/', 'http://a/2/']), 'to', True)
+        mock_hypermodels.assert_any_call(
+            set(['http://b/1/', 'http://b/2/']), 'to2', True)
+
+    @patch('rna.rna.clients.RestModelClient.model_client')
+    def test_hypermodels(self, mock_model_client):
+        """
+        Should look up unresolved pks with one query and fetch the missing
+        instances from the API
+        """
+        mock_model_class = Mock()
+        mock_model_class.objects.filter.return_value = [Mock(pk=1)]
+        mock_client = mock_model_client.return_value
+        mock_client.get.return_value.json.return_value = {'id': 2}
+        mock_client.restore_many.return_value = ['fetched']
+
+        rc = clients.RestModelClient(token='midnight')
+        rc.identity_map[(mock_model_class, '3')] = 'known'
+        rc.hypermodels(['http://a/1/', 'http://a/2/', 'http://a/3/'],
+                       mock_model_class, False)
+
+        mock_model_class.objects.filter.assert_called_once_with(
+            pk__in=['1', '2'])
+        mock_model_client.assert_called_once_with(
+            base_url='http://a/', model_class=mock_model_class,
+            token='midnight')
+        mock_client.get.assert_called_once_with('2/')
+        mock_client.restore_many.assert_called_once_with(
+            mock_client.serializer.return_value, [{'id': 2}], False)
+        eq_(rc.identity_map[(mock_model_class, '1')].pk, 1)
+        eq_(rc.identity_map[(mock_model_class, '2')], 'fetched')
+        eq_(rc.identity_map[(mock_model_class, '3')], 'known')
+
     def test_hypermodel_url_none(self):
         """
         Should return None when url is None without querying
@@ -750,6 +1831,27 @@ class RestModelClientTest(TestCase):
 
 
 class RNASyncCommandTest(TestCase):
+    def test_sync(self):
+        """
+        Should save every model in chunks, checkpointing each one, and
+        count the instances
+        """
+        client = Mock(**{'iter_chunks.return_value': iter([['a', 'b'],
+                                                           ['c']])})
+        checkpoint = Mock()
+        complete = Mock()
+        counts = rnasync.Command().sync(
+            [('model', client)], {'model': {'modified_after': 'now'}},
+            bulk=True, cursors={'model': 'cursor'}, checkpoint=checkpoint,
+            complete=complete)
+        eq_(counts, {'model': 3})
+        client.iter_chunks.assert_called_once_with(
+            save=True, params={'modified_after': 'now'}, bulk=True,
+            cursor='cursor')
+        eq_(checkpoint.call_args_list, [(('model', ['a', 'b']),),
+                                        (('model', ['c']),)])
+        complete.assert_called_once_with('model')
+
     def test_model_params_no_latest(self):
         """
         Should return mapping of mock_model to empty dict
@@ -759,7 +1861,7 @@ class RNASyncCommandTest(TestCase):
 
         params = rnasync.Command().model_params([mock_model])
 
-        eq_(params, {mock_model: {}})
+        eq_(params, {mock_model: {'page_size': 500}})
         latest.assert_called_once_with('modified')
 
     def test_model_params_with_latest(self):
@@ -775,9 +1877,184 @@ class RNASyncCommandTest(TestCase):
 
         params = rnasync.Command().model_params([mock_model])
 
-        eq_(params, {mock_model: {'modified_after': mock_isoformat()}})
+        eq_(params, {mock_model: {'modified_after': mock_isoformat(),
+                                  'o': 'modified', 'page_size': 500}})
         latest.assert_called_once_with('modified')
 
+    def test_model_params_with_state(self):
+        """
+        Should start from the sync checkpoint rather than the latest object
+        """
+        mock_model = Mock()
+        state = models.SyncState(modified=datetime(2013, 10, 22), last_pk=4)
+
+        params = rnasync.Command().model_params(
+            [mock_model], {mock_model: state})
+
+        eq_(params, {mock_model: {'modified_after': '2013-10-22T00:00:00',
+                                  'o': 'modified', 'page_size': 500}})
+        ok_(not mock_model.objects.latest.called)
+
+    @patch('rna.rna.management.commands.rnasync.Command.sync')
+    @patch('rna.rna.management.commands.rnasync.Command.sync_states')
+    @patch('rna.rna.management.commands.rnasync.clients.RNAModelClient')
+    def test_handle_resume(self, mock_client, mock_sync_states, mock_sync):
+        """
+        Should only sync the models that did not complete, from their
+        checkpoint
+        """
+        rc = mock_client.return_value.__enter__.return_value
+        rc.model_map = {'notes': models.Note, 'releases': models.Release}
+        release_state = Mock(status='complete')
+        note_state = Mock(status='failed', modified=None)
+        note_state.cursor.return_value = 'cursor'
+        mock_sync_states.return_value = {models.Release: release_state,
+                                         models.Note: note_state}
+        mock_sync.return_value = {models.Note: 1}
+
+        with patch.object(models.Note.objects, 'latest',
+                          side_effect=ObjectDoesNotExist):
+            rnasync.Command().handle(
+                resume=True, pipeline=False, bulk=False, stats=False,
+                stats_file=None)
+
+        args, kwargs = mock_sync.call_args
+        eq_(args, ([(models.Note, rc.model_client.return_value)],
+                   {models.Note: {'page_size': 500}}))
+        eq_(kwargs['cursors'], {models.Note: 'cursor'})
+        note_state.start.assert_called_once_with()
+        ok_(not release_state.start.called)
+
+    @patch('rna.rna.management.commands.rnasync.Command.sync',
+           side_effect=ValueError)
+    @patch('rna.rna.management.commands.rnasync.Command.sync_states')
+    @patch('rna.rna.management.commands.rnasync.clients.RNAModelClient')
+    def test_handle_failed(self, mock_client, mock_sync_states, mock_sync):
+        """
+        Should mark the running models failed and re-raise
+        """
+        rc = mock_client.return_value.__enter__.return_value
+        rc.model_map = {'releases': models.Release}
+        state = Mock(status='running', modified=None)
+        mock_sync_states.return_value = {models.Release: state}
+
+        with patch.object(models.Release.objects, 'latest',
+                          side_effect=ObjectDoesNotExist):
+            with self.assertRaises(ValueError):
+                rnasync.Command().handle(
+                    resume=False, pipeline=False, bulk=False,
+                    stats=False, stats_file=None)
+        state.finish.assert_called_once_with('failed')
+
+    @patch('rna.rna.management.commands.rnasync.Command.report_stats',
+           side_effect=IOError)
+    @patch('rna.rna.management.commands.rnasync.Command.sync',
+           side_effect=ValueError)
+    @patch('rna.rna.management.commands.rnasync.Command.sync_states')
+    @patch('rna.rna.management.commands.rnasync.clients.RNAModelClient')
+    def test_handle_failed_stats(self, mock_client, mock_sync_states,
+                                 mock_sync, mock_report_stats):
+        """
+        Should raise the error of a failed sync rather than one in
+        reporting its stats
+        """
+        rc = mock_client.return_value.__enter__.return_value
+        rc.model_map = {'releases': models.Release}
+        state = Mock(status='running', modified=None)
+        mock_sync_states.return_value = {models.Release: state}
+
+        with patch.object(models.Release.objects, 'latest',
+                          side_effect=ObjectDoesNotExist):
+            with self.assertRaises(ValueError):
+                rnasync.Command().handle(
+                    resume=False, pipeline=False, bulk=False,
+                    stats=True, stats_file=None)
+        ok_(mock_report_stats.called)
+        state.finish.assert_called_once_with('failed')
+
+
+class SyncStateTest(TestCase):
+    @patch('rna.rna.models.SyncState.save')
+    def test_advance(self, mock_save):
+        """
+        Should move the cursor to the last instance in (modified, pk) order
+        """
+        state = models.SyncState()
+        state.advance([Mock(modified=datetime(2013, 1, 2), pk=1),
+                       Mock(modified=datetime(2013, 1, 3), pk=2),
+                       Mock(modified=datetime(2013, 1, 3), pk=3),
+                       Mock(modified=datetime(2013, 1, 1), pk=4)])
+        eq_(state.cursor(), (datetime(2013, 1, 3), 3))
+        mock_save.assert_called_once_with()
+
+    def test_model_label(self):
+        eq_(models.model_label(models.Release), 'rna.release')
+
+
+class DependencyOrderTest(TestCase):
+    def test_dependency_order(self):
+        """
+        Should put releases before the notes that reference them
+        """
+        eq_(pipeline.dependency_order([models.Note, models.Release]),
+            [models.Release, models.Note])
+        eq_(pipeline.dependencies(models.Note, [models.Note, models.Release]),
+            [models.Release])
+
+
+class SyncPipelineTest(TestCase):
+    def mock_client(self, pages):
+        client = MagicMock()
+        client.iter_pages.return_value = iter(pages)
+        client.restore_many.side_effect = lambda serializer, data: data
+        return client
+
+    @patch('rna.rna.pipeline.SyncPipeline.save_related')
+    @patch('rna.rna.pipeline.utils.bulk_upsert')
+    def test_run(self, mock_bulk_upsert, mock_save_related):
+        """
+        Should write every chunk of every model, in dependency order
+        """
+        release_client = self.mock_client([[1, 2, 3]])
+        note_client = self.mock_client([[4], [5, 6]])
+        checkpoint = Mock()
+        complete = Mock()
+        sync = pipeline.SyncPipeline(
+            [(models.Note, note_client), (models.Release, release_client)],
+            {models.Note: {'modified_after': 'now'}},
+            workers=1, queue_size=1, chunk_size=2, bulk=True,
+            cursors={models.Note: 'cursor'}, checkpoint=checkpoint,
+            complete=complete)
+        counts = sync.run()
+        eq_(counts, {models.Release: 3, models.Note: 3})
+        eq_(mock_bulk_upsert.call_args_list, [
+            ((models.Release, [1, 2]), {'modified': False}),
+            ((models.Release, [3]), {'modified': False}),
+            ((models.Note, [4]), {'modified': False}),
+            ((models.Note, [5, 6]), {'modified': False}),
+        ])
+        note_client.iter_pages.assert_called_once_with(
+            params={'modified_after': 'now'}, cursor='cursor')
+        release_client.iter_pages.assert_called_once_with(
+            params={}, cursor=None)
+        eq_(checkpoint.call_args_list[-1], ((models.Note, [5, 6]),))
+        eq_(complete.call_args_list, [((models.Release,),),
+                                      ((models.Note,),)])
+
+    def test_run_error(self):
+        """
+        Should stop all stages and re-raise the first error
+        """
+        release_client = self.mock_client([[1, 2, 3]])
+        release_client.restore_many.side_effect = ValueError('nihilists')
+        note_client = self.mock_client([[4]] * 10)
+        sync = pipeline.SyncPipeline(
+            [(models.Note, note_client), (models.Release, release_client)],
+            queue_size=1)
+        with self.assertRaises(ValueError):
+            sync.run()
+        ok_(sync.stopped.is_set())
+
 
 class GetClientSerializerClassTest(TestCase):
     def test_get_client_serializer_class(self):
@@ -787,6 +2064,91 @@ class GetClientSerializerClassTest(TestCase):
                        serializers.UnmodifiedTimestampSerializer))
         eq_(ClientSerializer.Meta.model, 'mock_model_class')
 
+    def test_memoized(self):
+        """
+        Should create one class per model
+        """
+        eq_(serializers.get_client_serializer_class(models.Note),
+            serializers.get_client_serializer_class(models.Note))
+        ok_(serializers.get_client_serializer_class(models.Note) is not
+            serializers.get_client_serializer_class(models.Release))
+
+
+class GetModelSerializerClassTest(TestCase):
+    def test_get_model_serializer_class(self):
+        """
+        Should subclass the default model serializer, once per model
+        """
+        serializer_class = serializers.get_model_serializer_class(
+            models.Note)
+        ok_(issubclass(serializer_class,
+                       serializers.HyperlinkedModelSerializerWithPkField))
+        eq_(serializer_class.Meta.model, models.Note)
+        ok_(serializers.get_model_serializer_class(models.Note) is
+            serializer_class)
+        ok_(serializers.get_model_serializer_class(models.Release) is not
+            serializer_class)
+
+
+class FieldPlanTest(TestCase):
+    def test_serialize(self):
+        """
+        Should serialize the same data as the serializer
+        """
+        release = models.Release(
+            id=42, product='Firefox', channel='Release', version='42.0',
+            release_date=datetime(2015, 11, 3), text='Warp drive',
+            created=datetime(2015, 1, 1), modified=datetime(2015, 1, 2))
+        serializer_class = serializers.get_client_serializer_class(
+            models.Release)
+        eq_(serializers.get_field_plan(models.Release).serialize_many(
+            [release]), [serializer_class(instance=release).data])
+        ok_(serializers.get_field_plan(models.Release) is
+            serializers.get_field_plan(models.Release))
+
+
+class NoteSerializer(serializers.HyperlinkedModelSerializerWithPkField):
+    class Meta:
+        model = models.Note
+
+
+class ValuesListSerializerTest(TestCase):
+    @override_settings(ROOT_URLCONF=RouterURLConf)
+    def test_data(self):
+        """
+        Should serialize values() rows like the serializer, with hyperlinks
+        built from URL templates
+        """
+        queryset = Mock(model=models.Note)
+        queryset.values.return_value = [{
+            'id': 4, 'bug': 42, 'note': 'Crashes', 'releases': None,
+            'is_known_issue': True, 'fixed_in_release_id': 2, 'tag': 'Fixed',
+            'sort_num': 1, 'is_public': True,
+            'created': datetime(2013, 1, 1), 'modified': datetime(2013, 1, 2)}]
+        serializer = serializers.ValuesListSerializer(
+            NoteSerializer(context={'request': None}), queryset)
+        with patch.object(serializer, 'related_pks',
+                          return_value={4: [3, 1]}):
+            data = serializer.data
+        eq_(list(data[0].items()), [
+            ('url', '/notes/4/'), ('id', 4),
+            ('created', datetime(2013, 1, 1)),
+            ('modified', datetime(2013, 1, 2)), ('bug', 42),
+            ('note', 'Crashes'), ('is_known_issue', True),
+            ('fixed_in_release', '/releases/2/'), ('tag', 'Fixed'),
+            ('sort_num', 1), ('is_public', True),
+            ('releases', ['/releases/3/', '/releases/1/'])])
+        eq_(serializer.object, queryset.values.return_value)
+
+    @override_settings(ROOT_URLCONF=RouterURLConf)
+    def test_unsupported(self):
+        """
+        Should not serialize method fields
+        """
+        eq_(serializers.ValuesListSerializer.for_class(
+            serializers.ReleaseEquivalentsSerializer, Mock(),
+            context={'request': None}), None)
+
 
 class HyperlinkedModelSerializerWithPkFieldTest(TestCase):
     @patch('rna.rna.serializers.HyperlinkedModelSerializerWithPkField'
@@ -827,6 +2189,1153 @@ class UnmodifiedTimestampSerializerTest(TestCase):
             'the dude', modified=False)
 
 
+class ChunkedTest(TestCase):
+    def test_chunked(self):
+        """
+        Should yield lists of up to size items
+        """
+        eq_(list(utils.chunked(xrange(5), 2)), [[0, 1], [2, 3], [4]])
+        eq_(list(utils.chunked([], 2)), [])
+
+
+class BulkUpdateTest(TestCase):
+    @patch('rna.rna.utils.connections')
+    def test_bulk_update(self, mock_connections):
+        """
+        Should update the fields of a batch of instances with one query,
+        a CASE on the pk per column
+        """
+        connection = mock_connections.__getitem__.return_value
+        connection.vendor = 'sqlite'
+        connection.ops.quote_name = lambda name: '"%s"' % name
+        connection.ops.bulk_batch_size.return_value = 2
+        fields = [models.Note._meta.get_field('note'),
+                  models.Note._meta.get_field('bug')]
+        notes = [models.Note(id=i, note='n%d' % i, bug=i * 10)
+                 for i in (1, 2, 3)]
+        utils.bulk_update(models.Note, notes, fields, 'default')
+        execute = connection.cursor.return_value.execute
+        eq_(execute.call_count, 2)
+        sql, params = execute.call_args_list[0][0]
+        eq_(sql, 'UPDATE "rna_note" SET '
+                 '"note" = CASE "id" WHEN %s THEN %s WHEN %s THEN %s END, '
+                 '"bug" = CASE "id" WHEN %s THEN %s WHEN %s THEN %s END '
+                 'WHERE "id" IN (%s, %s)')
+        eq_(params, [1, 'n1', 2, 'n2', 1, 10, 2, 20, 1, 2])
+        eq_(execute.call_args[0][1], [3, 'n3', 3, 30, 3])
+
+    @patch('rna.rna.utils.connections')
+    def test_bulk_update_postgresql(self, mock_connections):
+        """
+        Should cast each CASE to the column type on PostgreSQL
+        """
+        connection = mock_connections.__getitem__.return_value
+        connection.vendor = 'postgresql'
+        connection.ops.quote_name = lambda name: '"%s"' % name
+        connection.ops.bulk_batch_size.return_value = 500
+        field = Mock(column='bug', attname='bug')
+        field.db_type.return_value = 'integer'
+        field.get_db_prep_save.side_effect = lambda value, connection: value
+        utils.bulk_update(models.Note, [models.Note(id=1, bug=None)],
+                          [field], 'default')
+        sql, params = connection.cursor.return_value.execute.call_args[0]
+        ok_('"bug" = CAST(CASE "id" WHEN %s THEN %s END AS integer)' in sql)
+        eq_(params, [1, None, 1])
+
+
+class PaginationTest(TestCase):
+    def test_cursor(self):
+        """
+        Should decode the values encoded in a cursor, with datetimes in
+        ISO 8601 format
+        """
+        cursor = pagination.encode_cursor([datetime(2013, 10, 22), 1, 2])
+        eq_(pagination.decode_cursor(cursor), ['2013-10-22T00:00:00', 1, 2])
+        eq_(pagination.decode_cursor(''), None)
+
+    def test_invalid_cursor(self):
+        """
+        Should raise ValueError for cursors that were not encoded
+        """
+        for cursor in ('garbage', 'e30', u'\xe9'):
+            with self.assertRaises(ValueError):
+                pagination.decode_cursor(cursor)
+
+    @override_settings(RNA={'PAGE_SIZE': 10, 'MAX_PAGE_SIZE': 50})
+    def test_get_page_size(self):
+        """
+        Should bound the page_size param by MAX_PAGE_SIZE
+        """
+        def page_size(**params):
+            return pagination.get_page_size(Mock(QUERY_PARAMS=params))
+        eq_(page_size(), 10)
+        eq_(page_size(page_size='abides'), 10)
+        eq_(page_size(page_size='20'), 20)
+        eq_(page_size(page_size='100'), 50)
+        eq_(page_size(page_size='0'), 1)
+
+    def test_keyset_q(self):
+        """
+        Should match the rows after values, ordered by fields
+        """
+        q = pagination.keyset_q(('modified', 'pk'), ('now', 3))
+        eq_(str(q), str(models.models.Q(modified__gt='now') |
+                        models.models.Q(modified='now', pk__gt=3)))
+
+
+class KeysetViewSet(pagination.KeysetPaginationMixin, ModelViewSet):
+    model = models.Release
+    keyset_orderings = views.ReleaseViewSet.keyset_orderings
+
+
+class KeysetPaginationMixinTest(TestCase):
+    def view(self, **params):
+        view = KeysetViewSet()
+        view.request = Mock(QUERY_PARAMS=params)
+        view.request.build_absolute_uri.side_effect = lambda uri: uri
+        view.get_queryset = Mock()
+        view.filter_queryset = Mock()
+        view.get_serializer = Mock()
+        return view
+
+    def test_list_unpaginated(self):
+        """
+        Should list every object without page_size or cursor params
+        """
+        view = self.view()
+        with patch('rest_framework.mixins.ListModelMixin.list') as mock_list:
+            view.list(view.request)
+        mock_list.assert_called_once_with(view.request)
+
+    def test_list_first_page(self):
+        """
+        Should return page_size objects in keyset order, linking to the
+        next page with a cursor holding the values of the last object
+        """
+        view = self.view(page_size='2', ordering='release_date')
+        queryset = view.filter_queryset.return_value.order_by.return_value
+        queryset.__getitem__ = Mock()
+        serializer = view.get_serializer.return_value
+        serializer.object = [Mock(release_date=datetime(2013, 1, i), id=i)
+                             for i in (1, 2, 3)]
+        serializer.data = ['one', 'two', 'three']
+
+        response = view.list(view.request)
+
+        view.filter_queryset.return_value.order_by.assert_called_once_with(
+            'release_date', 'id')
+        queryset.__getitem__.assert_called_once_with(slice(None, 3))
+        ok_(not queryset.filter.called)
+        view.get_serializer.assert_called_once_with(
+            queryset.__getitem__.return_value, many=True)
+        cursor = pagination.encode_cursor(
+            ['release_date', datetime(2013, 1, 2), 2])
+        ok_('cursor=' + cursor in response.data['next'])
+        eq_(response.data['results'], ['one', 'two'])
+
+    def test_list_values_rows(self):
+        """
+        Should take the cursor values of the last object from values() rows
+        """
+        view = self.view(page_size='1')
+        view.filter_queryset.return_value.order_by.return_value\
+            .__getitem__ = Mock()
+        serializer = view.get_serializer.return_value
+        serializer.object = [{'modified': datetime(2013, 1, i), 'id': i}
+                             for i in (1, 2)]
+        serializer.data = ['one', 'two']
+
+        response = view.list(view.request)
+
+        cursor = pagination.encode_cursor(
+            ['modified', datetime(2013, 1, 1), 1])
+        ok_('cursor=' + cursor in response.data['next'])
+        eq_(response.data['results'], ['one'])
+
+    def test_list_last_page(self):
+        """
+        Should only return the objects after the cursor, without a next
+        link when there are no more
+        """
+        cursor = pagination.encode_cursor(
+            ['modified', datetime(2013, 1, 2), 2])
+        view = self.view(cursor=cursor)
+        queryset = view.filter_queryset.return_value.order_by.return_value
+        page = queryset.filter.return_value
+        page.__getitem__ = Mock()
+        view.get_serializer.return_value.object = ['last']
+        view.get_serializer.return_value.data = ['last']
+
+        response = view.list(view.request)
+
+        eq_(str(queryset.filter.call_args[0][0]),
+            str(pagination.keyset_q(('modified', 'id'),
+                                    [datetime(2013, 1, 2), 2])))
+        page.__getitem__.assert_called_once_with(slice(None, 101))
+        eq_(response.data['next'], None)
+
+    def test_list_invalid(self):
+        """
+        Should respond 400 to unknown orderings and invalid cursors
+        """
+        for params in ({'page_size': '1', 'ordering': 'version'},
+                       {'cursor': 'garbage'},
+                       {'cursor': pagination.encode_cursor(['modified'])}):
+            view = self.view(**params)
+            eq_(view.list(view.request).status_code, 400)
+
+    def test_list_malformed_cursor(self):
+        """
+        Should respond 400 to cursors that decode to no values, or to
+        values the ordering fields cannot hold
+        """
+        for values in ([], [1, 2, 3], [['modified'], 1, 2],
+                       ['modified', 'notadate', 1],
+                       ['modified', '2013-01-02T00:00:00', 'one'],
+                       ['modified', None, 1]):
+            view = self.view(cursor=pagination.encode_cursor(values))
+            eq_(view.list(view.request).status_code, 400)
+
+
+class ChangesViewTest(TestCase):
+    def test_parse_cursor(self):
+        view = views.ChangesView()
+        cursor = pagination.encode_cursor([datetime(2013, 10, 22), 1, 2])
+        eq_(view.parse_cursor(cursor), (datetime(2013, 10, 22), 1, 2))
+        eq_(view.parse_cursor(None), None)
+        for values in (['now', 1, 2], [None, 1, 2], [1, 2]):
+            with self.assertRaises(ValueError):
+                view.parse_cursor(pagination.encode_cursor(values))
+
+    def test_source_changes(self):
+        """
+        Should only include the changes of a source after the cursor,
+        depending on the rank of the source
+        """
+        view = views.ChangesView()
+        mock_model = MagicMock()
+        mock_model._meta.many_to_many = []
+        queryset = mock_model._default_manager.order_by.return_value
+        cursor = (datetime(2013, 10, 22), 1, 2)
+
+        list(view.source_changes(2, mock_model, cursor, 5))
+        queryset.filter.assert_called_with(modified__gte=cursor[0])
+        list(view.source_changes(0, mock_model, cursor, 5))
+        queryset.filter.assert_called_with(modified__gt=cursor[0])
+        list(view.source_changes(1, mock_model, cursor, 5))
+        eq_(str(queryset.filter.call_args[0][0]),
+            str(pagination.keyset_q(('modified', 'pk'), (cursor[0], 2))))
+        mock_model._default_manager.order_by.assert_called_with(
+            'modified', 'pk')
+
+    def test_changes(self):
+        """
+        Should merge the changes of every source in order, up to limit
+        """
+        view = views.ChangesView()
+        view.sources = ('a', 'b')
+        changes = {'a': [((1, 0, 1), 'a1'), ((3, 0, 2), 'a2')],
+                   'b': [((1, 1, 1), 'b1'), ((2, 1, 2), 'b2')]}
+        with patch.object(view, 'source_changes',
+                          lambda rank, source, cursor, limit:
+                          iter(changes[source])):
+            eq_([c[1] for c in view.changes(None, 3)], ['a1', 'b1', 'b2'])
+
+    @patch('rna.rna.views.ChangesView.serialize', return_value=['results'])
+    @patch('rna.rna.views.ChangesView.changes')
+    def test_get(self, mock_changes, mock_serialize):
+        """
+        Should link to the next page with the cursor of the last change
+        """
+        mock_changes.return_value = [((datetime(2013, 10, 22), 0, 1), 'a'),
+                                     ((datetime(2013, 10, 22), 0, 2), 'b')]
+        request = Mock(QUERY_PARAMS={'page_size': '1'})
+        request.build_absolute_uri.side_effect = lambda uri: uri
+        response = views.ChangesView().get(request)
+        cursor = pagination.encode_cursor([datetime(2013, 10, 22), 0, 1])
+        eq_(response.data['cursor'], cursor)
+        ok_(response.data['next'].startswith('?'))
+        ok_('cursor=' + cursor in response.data['next'])
+        mock_changes.assert_called_once_with(None, 2)
+        mock_serialize.assert_called_once_with(request, ['a'])
+
+    def test_get_invalid_cursor(self):
+        response = views.ChangesView().get(
+            Mock(QUERY_PARAMS={'cursor': 'garbage'}))
+        eq_(response.status_code, 400)
+
+    def test_serialize_tombstone(self):
+        tombstone = models.Tombstone(model='rna.note', object_id=4,
+                                     modified=datetime(2013, 10, 22))
+        eq_(views.ChangesView().serialize(Mock(), [tombstone]),
+            [{'model': 'rna.note', 'id': 4, 'deleted': True,
+              'modified': datetime(2013, 10, 22)}])
+
+
+class ExportViewTest(TestCase):
+    def test_gzip_stream(self):
+        chunks = ['{"id":1}\n', '', '{"id":2}\n']
+        eq_(zlib.decompress(''.join(views.gzip_stream(chunks)),
+                            zlib.MAX_WBITS | 16), ''.join(chunks))
+
+    def test_get_invalid_modified_after(self):
+        response = views.ExportView().get(
+            Mock(QUERY_PARAMS={'modified_after': 'yesterday'}), 'notes')
+        eq_(response.status_code, 400)
+
+    @patch('rna.rna.views.ExportView.chunks', return_value=iter(['a\n']))
+    def test_get(self, mock_chunks):
+        """
+        Should stream the chunks of the model, gzipped if accepted
+        """
+        request = Mock(QUERY_PARAMS={'modified_after': '2013-10-22T12:00'},
+                       META={})
+        response = views.ExportView().get(request, 'notes')
+        eq_(response['Content-Type'], 'application/x-ndjson')
+        ok_(not response.has_header('Content-Encoding'))
+        eq_(response.content, 'a\n')
+        mock_chunks.assert_called_once_with(
+            request, models.Note, datetime(2013, 10, 22, 12))
+
+        request.META['HTTP_ACCEPT_ENCODING'] = 'gzip, deflate'
+        mock_chunks.return_value = iter(['a\n'])
+        response = views.ExportView().get(request, 'releases')
+        eq_(response['Content-Encoding'], 'gzip')
+        eq_(zlib.decompress(response.content, zlib.MAX_WBITS | 16), 'a\n')
+
+    @override_settings(RNA={'EXPORT_CHUNK_SIZE': 2})
+    @patch('rna.rna.serializers.ValuesListSerializer.for_class')
+    def test_chunks(self, mock_for_class):
+        """
+        Should serialize a line per object, a keyset chunk at a time
+        """
+        rows = [{'id': 1, 'modified': datetime(2013, 10, 22)},
+                {'id': 2, 'modified': datetime(2013, 10, 23)},
+                {'id': 3, 'modified': datetime(2013, 10, 23)}]
+        mock_for_class.side_effect = [
+            Mock(data=rows[:2], object=rows[:2]),
+            Mock(data=rows[2:], object=rows[2:])]
+        model_class = MagicMock()
+        queryset = model_class._default_manager.order_by.return_value\
+            .filter.return_value
+        chunks = list(views.ExportView().chunks(
+            Mock(), model_class, datetime(2013, 10, 22)))
+        eq_(chunks, [
+            '{"id":1,"modified":"2013-10-22T00:00:00"}\n'
+            '{"id":2,"modified":"2013-10-23T00:00:00"}\n',
+            '{"id":3,"modified":"2013-10-23T00:00:00"}\n'])
+        model_class._default_manager.order_by.assert_called_once_with(
+            'modified', 'id')
+        model_class._default_manager.order_by.return_value.filter\
+            .assert_called_once_with(modified__gte=datetime(2013, 10, 22))
+        eq_(str(queryset.filter.call_args[0][0]), str(pagination.keyset_q(
+            ('modified', 'id'), [datetime(2013, 10, 23), 2])))
+        eq_(mock_for_class.call_count, 2)
+
+
+class SearchViewTest(TestCase):
+    def test_get_invalid(self):
+        """
+        Should answer 400 without search terms, or with an invalid type or
+        page
+        """
+        for params in ({}, {'q': '+-'}, {'q': 'crash', 'type': 'bugs'},
+                       {'q': 'crash', 'page': '0'},
+                       {'q': 'crash', 'page': 'last'}):
+            response = views.SearchView().get(Mock(QUERY_PARAMS=params))
+            eq_(response.status_code, 400)
+
+    @patch('rna.rna.views.SearchView.serialize', return_value=['results'])
+    @patch('rna.rna.search.get_backend')
+    def test_get(self, mock_get_backend, mock_serialize):
+        """
+        Should merge the hits of every model by score, and link to the
+        surrounding pages
+        """
+        hits = {models.Release: [(1, 5.0), (2, 1.0)],
+                models.Note: [(3, 4.0), (4, 3.0), (5, 2.0)]}
+        backend = mock_get_backend.return_value
+        backend.count.side_effect = lambda model_class, query: 10
+        backend.search.side_effect = (
+            lambda model_class, query, offset, limit:
+            hits[model_class][offset:limit])
+        request = Mock(QUERY_PARAMS={'q': 'crash', 'page': '2',
+                                     'page_size': '2'})
+        request.build_absolute_uri.side_effect = lambda uri: uri
+        response = views.SearchView().get(request)
+        eq_(response.data['count'], 20)
+        ok_('page=3' in response.data['next'])
+        ok_('page=1' in response.data['previous'])
+        eq_(response.data['results'], ['results'])
+        backend.search.assert_any_call(models.Note, 'crash', 0, 4)
+        mock_serialize.assert_called_once_with(
+            request, [(3.0, models.Note, 4), (2.0, models.Note, 5)])
+
+    @patch('rna.rna.search.get_backend')
+    def test_get_type(self, mock_get_backend):
+        """
+        Should only search the models of the type param
+        """
+        backend = mock_get_backend.return_value
+        backend.count.return_value = 0
+        backend.search.return_value = []
+        views.SearchView().get(Mock(QUERY_PARAMS={'q': 'crash',
+                                                  'type': 'notes'}))
+        backend.search.assert_called_once_with(models.Note, 'crash', 0, 100)
+
+    @patch('rna.rna.serializers.ValuesListSerializer.for_class')
+    def test_serialize(self, mock_for_class):
+        """
+        Should serialize the objects of each model together, in the order
+        of the hits, skipping deleted objects
+        """
+        mock_for_class.return_value.data = [{'id': 3}, {'id': 1}]
+        mock_for_class.return_value.object = [{'id': 3}, {'id': 1}]
+        with patch.object(models.Note, '_default_manager') as mock_manager:
+            results = views.SearchView().serialize(Mock(), [
+                (2.0, models.Note, 1), (1.5, models.Note, 2),
+                (1.0, models.Note, 3)])
+        mock_manager.filter.assert_called_once_with(pk__in=[1, 2, 3])
+        eq_(results, [
+            {'model': 'rna.note', 'id': 1, 'score': 2.0,
+             'object': {'id': 1}},
+            {'model': 'rna.note', 'id': 3, 'score': 1.0,
+             'object': {'id': 3}}])
+
+
+class SearchTest(TestCase):
+    def tearDown(self):
+        search._backends.clear()
+
+    def test_terms(self):
+        eq_(search.terms(u'Fixed "a crash" (NEAR*)'),
+            [u'Fixed', u'a', u'crash', u'NEAR'])
+        eq_(search.terms(None), [])
+
+    @override_settings(RNA={'SEARCH_BACKEND': 'rna.rna.search.LikeBackend'})
+    def test_get_backend(self):
+        """
+        Should create the backend in settings once for each database
+        """
+        backend = search.get_backend()
+        ok_(isinstance(backend, search.LikeBackend))
+        eq_(backend.using, 'default')
+        ok_(search.get_backend('default') is backend)
+
+    @override_settings(
+        RNA={'SEARCH_BACKEND': 'rna.rna.search.SQLiteFTS5Backend'})
+    @patch('rna.rna.search.SQLiteFTS5Backend.install')
+    @patch('rna.rna.search.SQLiteFTS5Backend.installed', return_value=False)
+    def test_get_backend_not_installed(self, mock_installed, mock_install):
+        """
+        Should fall back to LikeBackend until the index of the backend is
+        installed, without installing it
+        """
+        backend = search.get_backend()
+        eq_(type(backend), search.LikeBackend)
+        ok_(not mock_install.called)
+        backend = search.install()
+        mock_install.assert_called_once_with()
+        ok_(isinstance(backend, search.SQLiteFTS5Backend))
+        ok_(search.get_backend() is backend)
+
+    def test_like_filter(self):
+        """
+        Should match every word in any of the fields of the model
+        """
+        queryset = Mock(model=models.Release)
+        queryset.filter.return_value = queryset
+        backend = search.LikeBackend()
+        ok_(backend.filter(queryset, 'startup crash') is queryset)
+        eq_(queryset.filter.call_count, 2)
+        eq_(str(queryset.filter.call_args[0][0]), str(
+            models.models.Q(text__icontains='crash') |
+            models.models.Q(system_requirements__icontains='crash')))
+        eq_(backend.filter(queryset, '!'), queryset.none.return_value)
+
+    @patch('rna.rna.search.transaction.commit_unless_managed')
+    @patch('rna.rna.search.get_backend')
+    def test_receivers(self, mock_get_backend, mock_commit_unless_managed):
+        """
+        Should index saved instances, committing unless managed like the
+        save, and remove deleted ones within the deletion's transaction
+        """
+        backend = mock_get_backend.return_value
+        search.index_saved(models.Note, instance='a', using='other')
+        backend.index.assert_called_with(models.Note, ['a'])
+        mock_get_backend.assert_called_with('other')
+        mock_commit_unless_managed.assert_called_with(using='other')
+        search.index_bulk_saved(models.Note, created=['a'], updated=['b'])
+        backend.index.assert_called_with(models.Note, ['a', 'b'])
+        eq_(mock_commit_unless_managed.call_count, 2)
+        search.unindex_deleted(models.Note, instance=Mock(pk=4))
+        backend.delete.assert_called_with(models.Note, [4])
+        eq_(mock_commit_unless_managed.call_count, 2)
+
+    @patch('rna.rna.search.transaction.commit_unless_managed')
+    def test_like_index(self, mock_commit_unless_managed):
+        """
+        Should keep no index, and never commit
+        """
+        backend = search.LikeBackend()
+        backend.index(models.Note, [Mock(pk=1)])
+        backend.delete(models.Note, [1])
+        backend.clear(models.Note)
+        ok_(not mock_commit_unless_managed.called)
+
+
+class SQLiteFTS5BackendTest(TestCase):
+    def setUp(self):
+        self.backend = search.SQLiteFTS5Backend()
+        self.backend.install()
+        self.backend.index(models.Note, [
+            Mock(pk=1, note='Fixed a crash on startup'),
+            Mock(pk=2, note='Crash, crash and crash'),
+            Mock(pk=3, note='Improved startup performance')])
+
+    def test_search(self):
+        """
+        Should rank the matches of all the terms by relevance, paginated
+        """
+        eq_([hit[0] for hit in self.backend.search(models.Note, 'crash')],
+            [2, 1])
+        eq_([hit[0] for hit in self.backend.search(
+            models.Note, 'crash', 1, 1)], [1])
+        eq_([hit[0] for hit in self.backend.search(
+            models.Note, 'STARTUP crashes')], [1])
+        eq_(self.backend.count(models.Note, 'startup'), 2)
+
+    def test_operators(self):
+        """
+        Should search for the words of FTS5 operators and syntax
+        """
+        eq_(self.backend.search(models.Note, 'crash OR'), [])
+        eq_(self.backend.count(models.Note, '"crash" NEAR('), 0)
+        eq_(self.backend.search(models.Note, '*'), [])
+
+    def test_update(self):
+        """
+        Should replace reindexed objects and remove deleted ones
+        """
+        self.backend.index(models.Note, [Mock(pk=2, note='No match')])
+        self.backend.delete(models.Note, [1])
+        eq_(self.backend.count(models.Note, 'crash'), 0)
+        self.backend.clear(models.Note)
+        eq_(self.backend.count(models.Note, 'startup'), 0)
+
+    @patch('rna.rna.search.transaction.commit_unless_managed')
+    def test_no_commit(self, mock_commit_unless_managed):
+        """
+        Should leave the commit of index writes to the caller
+        """
+        self.backend.index(models.Note, [Mock(pk=4, note='Crash')])
+        self.backend.delete(models.Note, [4])
+        self.backend.clear(models.Note)
+        ok_(not mock_commit_unless_managed.called)
+
+
+class SQLiteFTS5BackendTransactionTest(TransactionTestCase):
+    def tearDown(self):
+        search._backends.clear()
+
+    def test_rollback(self):
+        """
+        Should index saves within the transaction of the caller, so that
+        a failed one is rolled back along with the save
+        """
+        create_tables(models.Release, models.Note,
+                      models.Note.releases.through, models.Tombstone)
+        ok_(search.install().installed())
+        search._backends.clear()
+        ok_(isinstance(search.get_backend(), search.SQLiteFTS5Backend))
+        try:
+            with transaction.commit_on_success():
+                models.Release.objects.create(
+                    product='Firefox', channel='Release', version='27.0',
+                    release_date=datetime(2014, 2, 4), text='Crash')
+                raise ValueError
+        except ValueError:
+            pass
+        eq_(models.Release.objects.count(), 0)
+        eq_(search.get_backend().count(models.Release, 'crash'), 0)
+
+
+class SearchChangeListTest(TestCase):
+    def changelist(self, query, exact_fields):
+        changelist = admin.SearchChangeList.__new__(admin.SearchChangeList)
+        changelist.model = models.Note
+        changelist.lookup_opts = models.Note._meta
+        changelist.model_admin = Mock(search_exact_fields=exact_fields)
+        changelist.search_fields = ('note',)
+        changelist.query = query
+        return changelist
+
+    @patch('rna.rna.search.get_backend')
+    @patch('rna.rna.admin.ChangeList.get_query_set')
+    def test_get_query_set(self, mock_get_query_set, mock_get_backend):
+        """
+        Should search with the backend, or the exact fields the query is a
+        valid value of, instead of the search fields
+        """
+        queryset = mock_get_query_set.return_value
+        queryset.filter.side_effect = [ValueError, MagicMock()]
+        changelist = self.changelist('crash', ('bug', 'releases__version'))
+        mock_get_query_set.side_effect = lambda request: (
+            eq_(changelist.search_fields, ()) or queryset)
+        matches = mock_get_backend.return_value.filter.return_value
+        eq_(changelist.get_query_set('request'),
+            matches.__or__.return_value.distinct.return_value)
+        eq_(changelist.search_fields, ('note',))
+        mock_get_backend.return_value.filter.assert_called_once_with(
+            queryset, 'crash')
+        queryset.filter.assert_called_with(releases__version='crash')
+
+    @patch('rna.rna.search.get_backend')
+    @patch('rna.rna.admin.ChangeList.get_query_set')
+    def test_no_query(self, mock_get_query_set, mock_get_backend):
+        changelist = self.changelist('', ('bug',))
+        eq_(changelist.get_query_set('request'),
+            mock_get_query_set.return_value)
+        ok_(not mock_get_backend.called)
+
+    def test_get_changelist(self):
+        eq_(admin.NoteAdmin(models.Note, None).get_changelist('request'),
+            admin.SearchChangeList)
+
+
+class EstimatedCountQuerySetTest(TestCase):
+    def tearDown(self):
+        cache.clear()
+
+    @patch('rna.rna.admin.QuerySet.count', return_value=7)
+    @patch('rna.rna.admin.estimate_count', return_value=200000)
+    def test_count(self, mock_estimate_count, mock_count):
+        """
+        Should estimate the count of large unfiltered querysets only
+        """
+        queryset = admin.EstimatedCountQuerySet(models.Note)
+        eq_(queryset.count(), 200000)
+        mock_estimate_count.assert_called_once_with(models.Note, 'default')
+        eq_(queryset.filter(bug=1).count(), 7)
+        eq_(queryset[:10].count(), 7)
+        mock_estimate_count.return_value = 20
+        eq_(queryset.count(), 7)
+        mock_estimate_count.return_value = None
+        eq_(queryset.count(), 7)
+
+    def test_estimate_count_sqlite(self):
+        eq_(admin.estimate_count(models.Note), None)
+
+    def test_queryset(self):
+        """
+        Should use EstimatedCountQuerySet, and prefetch note releases
+        """
+        queryset = admin.NoteAdmin(models.Note, None).queryset(Mock())
+        ok_(isinstance(queryset, admin.EstimatedCountQuerySet))
+        eq_(queryset._prefetch_related_lookups, ['releases'])
+
+
+class AdminFilterTest(TestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_cached_choices(self):
+        """
+        Should cache the choices until a release or note changes
+        """
+        choices = Mock(return_value=[('a', 'a')])
+        eq_(admin.cached_choices('Firefox OS', choices), [('a', 'a')])
+        eq_(admin.cached_choices('Firefox OS', choices), [('a', 'a')])
+        eq_(choices.call_count, 1)
+        models.bump_notes_version()
+        admin.cached_choices('Firefox OS', choices)
+        eq_(choices.call_count, 2)
+
+    @patch('rna.rna.admin.cached_choices', return_value=[('1.0', '1.0')])
+    def test_version_lookups(self, mock_cached_choices):
+        """
+        Should only list the versions of the chosen product
+        """
+        version_filter = admin.ReleaseVersionFilter.__new__(
+            admin.ReleaseVersionFilter)
+        eq_(version_filter.lookups(Mock(GET={}), None), [])
+        eq_(version_filter.lookups(
+            Mock(GET={'release_product': 'Firefox'}), None), [('1.0', '1.0')])
+        eq_(mock_cached_choices.call_args[0][0], 'versions:Firefox')
+
+    def test_product_queryset(self):
+        """
+        Should filter notes with a subquery of their releases
+        """
+        product_filter = admin.ReleaseProductFilter.__new__(
+            admin.ReleaseProductFilter)
+        product_filter.used_parameters = {'release_product': 'Firefox'}
+        queryset = Mock()
+        eq_(product_filter.queryset(None, queryset),
+            queryset.filter.return_value)
+        subquery = queryset.filter.call_args[1]['pk__in']
+        ok_('"rna_release"."product" = Firefox' in str(subquery.query))
+
+    def test_release_versions(self):
+        note = Mock()
+        note.releases.all.return_value = [Mock(version='1.0'),
+                                          Mock(version='1.1')]
+        eq_(admin.NoteAdmin(models.Note, None).release_versions(note),
+            '1.0, 1.1')
+
+
+class RNAReindexCommandTest(TestCase):
+    @patch('rna.rna.search.install')
+    def test_reindex(self, mock_install):
+        """
+        Should install the index, then replace the index of a model with
+        its objects, a batch at a time in pk order
+        """
+        queryset = MagicMock()
+        queryset.__getitem__.return_value = [Mock(pk=1), Mock(pk=2)]
+        queryset.filter.return_value.__getitem__.side_effect = [
+            [Mock(pk=3)], []]
+        model_class = MagicMock()
+        model_class._default_manager.db_manager.return_value.only\
+            .return_value.order_by.return_value = queryset
+        with patch.dict(search.SEARCH_FIELDS, {model_class: ('text',)}):
+            eq_(rnareindex.Command().reindex(model_class, 2), 3)
+        mock_install.assert_called_once_with('default')
+        backend = mock_install.return_value
+        backend.clear.assert_called_once_with(model_class)
+        eq_(backend.index.call_count, 2)
+        queryset.filter.assert_called_with(pk__gt=3)
+
+
+class RNAImportCommandTest(TestCase):
+    def test_read_dump(self):
+        """
+        Should read an object per non blank line of NDJSON, or the objects
+        of a JSON array
+        """
+        eq_(list(rnaimport.read_dump(BytesIO('{"id":1}\n\n{"id":2}\n'))),
+            [{'id': 1}, {'id': 2}])
+        eq_(list(rnaimport.read_dump(BytesIO('[\n {"id":1},\n {"id":2}\n]'))),
+            [{'id': 1}, {'id': 2}])
+
+    def test_read_dump_invalid(self):
+        """
+        Should raise a CommandError with the number of an invalid line
+        """
+        with self.assertRaisesRegexp(CommandError, 'line 2'):
+            list(rnaimport.read_dump(BytesIO('{"id":1}\n{"id":\n')))
+
+    def test_hyperlink_pk(self):
+        """
+        Should return the pk at the end of a hyperlink, or the pk itself
+        """
+        eq_(rnaimport.hyperlink_pk('https://example.com/releases/12/'), 12)
+        eq_(rnaimport.hyperlink_pk(12), 12)
+        eq_(rnaimport.hyperlink_pk(None), None)
+        self.assertRaises(CommandError, rnaimport.hyperlink_pk, 'a/b/')
+
+    def test_decode(self):
+        """
+        Should restore the fields, foreign keys and many to many pks of an
+        object, and ignore the keys that are not fields
+        """
+        note = rnaimport.decode(models.Note, {
+            'url': 'https://example.com/notes/3/', 'id': 3,
+            'created': '2013-01-01T00:00:00',
+            'modified': '2013-01-02T00:00:00', 'bug': 42,
+            'note': 'Fixed', 'fixed_in_release':
+            'https://example.com/releases/5/',
+            'releases': ['https://example.com/releases/5/',
+                         'https://example.com/releases/6/']})
+        eq_(note.pk, 3)
+        eq_(note.modified, datetime(2013, 1, 2))
+        eq_(note.note, 'Fixed')
+        eq_(note.fixed_in_release_id, 5)
+        eq_(note.tag, '')
+        eq_(note._m2m_data, {'releases': [5, 6]})
+
+    @patch('rna.rna.management.commands.rnaimport.open_dump')
+    def test_dump_model(self, mock_open_dump):
+        """
+        Should detect the model of a dump from the url of its first object,
+        then its file name, unless one is given
+        """
+        command = rnaimport.Command()
+        mock_open_dump.return_value = BytesIO(
+            '{"url":"https://example.com/notes/1/"}\n')
+        eq_(command.dump_model('dump.ndjson'), models.Note)
+        mock_open_dump.return_value = BytesIO('{"id":1}\n')
+        eq_(command.dump_model('releases.ndjson.gz'), models.Release)
+        eq_(command.dump_model('dump.ndjson', 'notes'), models.Note)
+        mock_open_dump.return_value = BytesIO('{"id":1}\n')
+        self.assertRaises(CommandError, command.dump_model, 'dump.ndjson')
+
+    @patch('rna.rna.management.commands.rnaimport.utils.bulk_upsert')
+    @patch('rna.rna.management.commands.rnaimport.open_dump')
+    def test_load(self, mock_open_dump, mock_bulk_upsert):
+        """
+        Should upsert the objects of a dump a batch at a time, keeping
+        their timestamps, and report the progress
+        """
+        mock_open_dump.return_value = BytesIO(''.join(
+            '{"id":%d,"modified":"2013-01-0%dT00:00:00"}\n' % (i, i)
+            for i in range(1, 4)))
+        command = rnaimport.Command()
+        command.stdout = BytesIO()
+        import_stats = stats.SyncStats()
+        eq_(command.load(models.Release, 'releases.ndjson', 'default', 2,
+                         import_stats), 3)
+        eq_([[r.pk for r in c[0][1]] for c in mock_bulk_upsert.call_args_list],
+            [[1, 2], [3]])
+        eq_(mock_bulk_upsert.call_args[1],
+            {'modified': False, 'using': 'default', 'batch_size': 2})
+        counters = import_stats.model(models.Release)
+        eq_(counters['fetched'], 3)
+        eq_(counters['newest_modified'], datetime(2013, 1, 3))
+        eq_(command.stdout.getvalue().count('rna.release: '), 2)
+
+    @patch.object(models.Release, '_default_manager')
+    def test_check_references(self, mock_manager):
+        """
+        Should raise a CommandError naming the related objects missing from
+        the database, with a query for all the references to a model
+        """
+        mock_filter = mock_manager.db_manager.return_value.filter
+        mock_filter.return_value.values_list.return_value = [5, 6]
+        notes = [models.Note(pk=1, fixed_in_release_id=5),
+                 models.Note(pk=2, fixed_in_release_id=None)]
+        notes[0]._m2m_data = {'releases': [5, 6]}
+        notes[1]._m2m_data = {'releases': [7]}
+        with self.assertRaisesRegexp(CommandError, 'rna.release.*: 7$'):
+            rnaimport.check_references(models.Note, notes, 'default')
+        eq_(sorted(mock_filter.call_args[1]['pk__in']), [5, 6, 7])
+        mock_manager.db_manager.assert_called_once_with('default')
+        notes[1]._m2m_data = {}
+        rnaimport.check_references(models.Note, notes, 'default')
+
+    @patch('rna.rna.management.commands.rnaimport.utils.bulk_upsert')
+    @patch('rna.rna.management.commands.rnaimport.check_references',
+           side_effect=CommandError)
+    @patch('rna.rna.management.commands.rnaimport.open_dump')
+    def test_load_missing_reference(self, mock_open_dump,
+                                    mock_check_references, mock_bulk_upsert):
+        """
+        Should write nothing of a batch referencing missing objects
+        """
+        mock_open_dump.return_value = BytesIO('{"id":1,"releases":[9]}\n')
+        command = rnaimport.Command()
+        command.stdout = BytesIO()
+        self.assertRaises(CommandError, command.load, models.Note,
+                          'notes.ndjson', 'default', 2, stats.SyncStats())
+        ok_(not mock_bulk_upsert.called)
+
+    @patch('rna.rna.management.commands.rnaimport.connections')
+    @patch('rna.rna.management.commands.rnaimport.Command.load',
+           return_value=0)
+    @patch('rna.rna.management.commands.rnaimport.Command.dump_model')
+    def test_handle(self, mock_dump_model, mock_load, mock_connections):
+        """
+        Should load releases before the notes referencing them, with
+        constraint checks disabled, then reset their sequences
+        """
+        mock_dump_model.side_effect = [models.Note, models.Release]
+        connection = mock_connections.__getitem__.return_value
+        connection.vendor = 'mysql'
+        connection.ops.sequence_reset_sql.return_value = ['RESET']
+        command = rnaimport.Command()
+        command.stdout = BytesIO()
+        command.handle('notes.ndjson', 'releases.ndjson', model=None,
+                       batch_size=10, stats=False, stats_file=None)
+        eq_([c[0][:2] for c in mock_load.call_args_list],
+            [(models.Release, 'releases.ndjson'),
+             (models.Note, 'notes.ndjson')])
+        ok_(connection.constraint_checks_disabled.called)
+        connection.cursor.return_value.execute.assert_any_call(
+            'SET unique_checks=0')
+        connection.cursor.return_value.execute.assert_any_call(
+            'SET unique_checks=1')
+        connection.cursor.return_value.execute.assert_called_with('RESET')
+        eq_(connection.ops.sequence_reset_sql.call_args[0][1],
+            [models.Release, models.Note])
+        ok_('Total: 0 objects' in command.stdout.getvalue())
+
+    def test_handle_no_dumps(self):
+        """
+        Should require at least one dump
+        """
+        self.assertRaises(CommandError, rnaimport.Command().handle,
+                          model=None)
+
+
+class NotesVersionTest(TestCase):
+    def setUp(self):
+        cache.delete(models.NOTES_VERSION_KEY)
+
+    @patch('rna.rna.models.time.time', return_value=1382480943.718)
+    def test_notes_version(self, mock_time):
+        """
+        Should start from the current time in milliseconds and increase
+        with every bump, even after the version was evicted
+        """
+        eq_(models.notes_version(), 1382480943718)
+        eq_(models.bump_notes_version(), 1382480943719)
+        eq_(models.notes_version(), 1382480943719)
+        cache.delete(models.NOTES_VERSION_KEY)
+        mock_time.return_value += 1
+        eq_(models.bump_notes_version(), 1382480944718)
+
+    def test_invalidate_notes(self):
+        """
+        Should bump the version on change, and again once the request
+        is finished
+        """
+        version = models.notes_version()
+        models.invalidate_notes(models.Note)
+        eq_(models.notes_version(), version + 1)
+        models.invalidate_notes_after_request(None)
+        eq_(models.notes_version(), version + 2)
+        models.invalidate_notes_after_request(None)
+        eq_(models.notes_version(), version + 2)
+
+
+class ConditionalGetMixinTest(TestCase):
+    def view(self, **headers):
+        view = views.NoteViewSet()
+        view.get_queryset = Mock()
+        view.filter_queryset = Mock(**{
+            'return_value.aggregate.return_value': {
+                'latest': datetime(2013, 10, 22, 12, 29, 3), 'count': 3}})
+        request = Mock(META=headers, method='GET')
+        request.get_full_path.return_value = '/notes/'
+        request.accepted_renderer.format = 'json'
+        return view, request
+
+    def test_list(self):
+        """
+        Should add validators computed from the latest modified timestamp
+        and the number of notes
+        """
+        view, request = self.view()
+        mock_list = Mock(return_value=Response(['note']))
+        response = view.conditional_list(request, mock_list)
+        eq_(response.data, ['note'])
+        etag = view.get_etag(request, datetime(2013, 10, 22, 12, 29, 3), 3)
+        eq_(response['ETag'], '"%s"' % etag)
+        ok_(response['Last-Modified'].startswith('Tue, 22 Oct 2013'))
+        kwargs = view.filter_queryset.return_value.aggregate.call_args[1]
+        ok_(isinstance(kwargs['latest'], Max))
+        eq_(kwargs['latest'].lookup, 'modified')
+        ok_(isinstance(kwargs['count'], Count))
+        eq_(kwargs['count'].lookup, 'id')
+
+    def test_list_not_modified(self):
+        """
+        Should respond 304 without listing when a validator matches
+        """
+        view, request = self.view()
+        etag = view.get_etag(request, datetime(2013, 10, 22, 12, 29, 3), 3)
+        for headers in ({'HTTP_IF_NONE_MATCH': '"%s"' % etag},
+                        {'HTTP_IF_NONE_MATCH': '"other", "%s"' % etag},
+                        {'HTTP_IF_MODIFIED_SINCE':
+                         http_date(time.mktime(datetime(
+                             2013, 10, 22, 12, 29, 3).timetuple()))}):
+            view, request = self.view(**headers)
+            mock_list = Mock()
+            response = view.conditional_list(request, mock_list)
+            eq_(response.status_code, 304)
+            eq_(response['ETag'], '"%s"' % etag)
+            ok_(not mock_list.called)
+
+    def test_list_modified(self):
+        """
+        Should list when the validators do not match
+        """
+        for headers in ({'HTTP_IF_NONE_MATCH': '"other"'},
+                        {'HTTP_IF_MODIFIED_SINCE':
+                         'Tue, 22 Oct 2013 00:00:00 GMT'}):
+            view, request = self.view(**headers)
+            mock_list = Mock(return_value=Response(['note']))
+            eq_(view.conditional_list(request, mock_list).status_code, 200)
+
+    def test_etag_varies(self):
+        """
+        Should change the ETag with the path, format, timestamp and count
+        """
+        view, request = self.view()
+        latest = datetime(2013, 10, 22)
+        etag = view.get_etag(request, latest, 3)
+        ok_(etag != view.get_etag(request, latest, 2))
+        ok_(etag != view.get_etag(request, datetime(2013, 10, 23), 3))
+        ok_(etag != view.get_etag(request, None, 0))
+        request.accepted_renderer.format = 'api'
+        ok_(etag != view.get_etag(request, latest, 3))
+
+    def test_retrieve(self):
+        """
+        Should compute validators from the object without serializing it
+        when not modified
+        """
+        view, request = self.view()
+        view.get_object = Mock(return_value=Mock(
+            pk=1, modified=datetime(2013, 10, 22)))
+        view.get_serializer = Mock()
+        etag = view.get_etag(request, datetime(2013, 10, 22), 1)
+        request.META['HTTP_IF_NONE_MATCH'] = '"%s"' % etag
+        eq_(view.retrieve(request).status_code, 304)
+        ok_(not view.get_serializer.called)
+
+
+class ValuesListMixinTest(TestCase):
+    def view(self):
+        view = views.NoteViewSet()
+        view.request = Mock()
+        view.format_kwarg = None
+        return view
+
+    @patch('rna.rna.serializers.ValuesListSerializer.for_class')
+    def test_values_serializer(self, mock_for_class):
+        """
+        Should serialize querysets for lists with a ValuesListSerializer
+        """
+        view = self.view()
+        queryset = models.Note.objects.all()
+        eq_(view.get_serializer(queryset, many=True),
+            mock_for_class.return_value)
+        eq_(mock_for_class.call_args[0][1], queryset)
+
+    @patch('rna.rna.serializers.ValuesListSerializer.for_class',
+           return_value=None)
+    @patch('rest_framework.generics.GenericAPIView.get_serializer')
+    def test_fallback(self, mock_get_serializer, mock_for_class):
+        """
+        Should fall back to the serializer class for single objects, input
+        data and unsupported serializers
+        """
+        view = self.view()
+        queryset = models.Note.objects.all()
+        view.get_serializer(queryset, many=True)
+        view.get_serializer(models.Note())
+        view.get_serializer(data={'bug': 1})
+        eq_(mock_get_serializer.call_count, 3)
+        eq_(mock_for_class.call_count, 1)
+
+
+class NestedNoteViewTest(TestCase):
+    def view(self):
+        view = views.NestedNoteView()
+        view.kwargs = {'pk': '42'}
+        request = Mock()
+        request.build_absolute_uri.return_value = 'http://thedu.de/'
+        return view, request
+
+    @patch('rna.rna.views.cache')
+    @patch('rna.rna.views.generics.ListAPIView.list')
+    def test_list_cached(self, mock_list, mock_cache):
+        """
+        Should return the cached notes without listing them
+        """
+        view, request = self.view()
+        mock_cache.get.return_value = ['note']
+        eq_(view.cached_list(request).data, ['note'])
+        ok_(not mock_list.called)
+        key = mock_cache.get.call_args[0][0]
+        ok_(key.startswith('rna:notes:42:%s:' % models.notes_version()))
+
+    @patch('rna.rna.views.cache')
+    @patch('rna.rna.views.generics.ListAPIView.list')
+    def test_list_uncached(self, mock_list, mock_cache):
+        """
+        Should cache the listed notes until the notes version changes
+        """
+        view, request = self.view()
+        mock_cache.get.return_value = None
+        mock_list.return_value = Mock(status_code=200, data=['note'])
+        eq_(view.cached_list(request), mock_list.return_value)
+        key = mock_cache.get.call_args[0][0]
+        mock_cache.set.assert_called_once_with(key, ['note'], None)
+        models.bump_notes_version()
+        ok_(view.get_cache_key(request) != key)
+
+    @override_settings(ROOT_URLCONF=NestedURLConf)
+    @patch('rna.rna.search.get_backend')
+    def test_get_ordered(self, mock_get_backend):
+        """
+        Should list the notes of a release in the order of ordered_notes,
+        rather than the default ordering of the automatic filters
+        """
+        create_tables(models.Release, models.Note,
+                      models.Note.releases.through, models.Tombstone)
+        release = models.Release.objects.create(
+            product='Firefox', channel='Release', version='27.0',
+            release_date=datetime(2014, 2, 4))
+        for is_known_issue, tag in ((True, 'Fixed'), (False, 'Changed'),
+                                    (False, 'New')):
+            note = models.Note.objects.create(
+                note=tag, is_known_issue=is_known_issue, tag=tag)
+            note.releases.add(release)
+
+        response = self.client.get('/releases/%d/notes/' % release.pk)
+        eq_(response.status_code, 200)
+        ids = [n['id'] for n in json.loads(response.content)]
+        eq_(ids, [n.id for n in release.ordered_notes()])
+        eq_(ids, [3, 2, 1])
+
+    @override_settings(ROOT_URLCONF=NestedURLConf)
+    @patch('rna.rna.search.get_backend')
+    def test_get_release_changed(self, mock_get_backend):
+        """
+        Should change the ETag of the notes when their release changes
+        """
+        create_tables(models.Release, models.Note,
+                      models.Note.releases.through, models.Tombstone)
+        release = models.Release.objects.create(
+            product='Firefox', channel='Release', version='27.0',
+            release_date=datetime(2014, 2, 4))
+        note = models.Note.objects.create(note='Fixed', tag='Fixed')
+        note.releases.add(release)
+        path = '/releases/%d/notes/' % release.pk
+        etag = self.client.get(path)['ETag']
+        eq_(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        release.version = '27.0.1'
+        release.save()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 200)
+        ok_(response['ETag'] != etag)
+
+    @override_settings(ROOT_URLCONF=NestedURLConf)
+    @patch('rna.rna.search.get_backend')
+    def test_get_related_queries(self, mock_get_backend):
+        """
+        Should load the related releases of all the notes with a query,
+        rather than one per note
+        """
+        create_tables(models.Release, models.Note,
+                      models.Note.releases.through, models.Tombstone)
+        releases = [models.Release.objects.create(
+            product='Firefox', channel='Release', version=version,
+            release_date=datetime(2014, 2, 4)) for version in ('27.0', '28.0')]
+        for i in range(10):
+            note = models.Note.objects.create(
+                note='Fixed', tag='Fixed', fixed_in_release=releases[1])
+            note.releases.add(*releases)
+        with middleware.assert_max_queries(4):
+            response = self.client.get('/releases/%d/notes/' % releases[0].pk)
+        eq_(len(json.loads(response.content)), 10)
+
+
+class TombstoneTest(TestCase):
+    @patch('rna.rna.models.Tombstone.objects.create')
+    def test_create_tombstone(self, mock_create):
+        """
+        Should record the model and pk of deleted instances
+        """
+        models.create_tombstone(models.Note, models.Note(id=4))
+        kwargs = mock_create.call_args[1]
+        eq_(kwargs['model'], 'rna.note')
+        eq_(kwargs['object_id'], 4)
+
+
 class URLsTest(TestCase):
     @patch('rest_framework.routers.DefaultRouter.register')
     @patch('rest_framework.routers.DefaultRouter.urls')
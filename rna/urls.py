@@ -14,4 +14,8 @@ router.register('releases', views.ReleaseViewSet)
 urlpatterns = router.urls + patterns(
     '',
     url(r'^releases/(?P<pk>\d+)/notes/$', views.NestedNoteView.as_view()),
+    url(r'^changes/$', views.ChangesView.as_view()),
+    url(r'^search/$', views.SearchView.as_view()),
+    url(r'^export/(?P<name>releases|notes)\.ndjson$',
+        views.ExportView.as_view()),
     url(r'^auth_token/$', views.auth_token))
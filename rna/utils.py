@@ -1,15 +1,129 @@
-from .models import Release
+from itertools import islice
+
+from django.db import connections, router, transaction
+
+from . import signals
+from .models import Release, version_key
+
+
+def chunked(iterable, size):
+    """Yields successive lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def bulk_upsert(model_class, instances, modified=True, using=None,
+                batch_size=500):
+    """
+    Writes instances of model_class in a single transaction with as few
+    queries as possible, and returns a (created, updated) tuple of lists.
+
+    Instances are split by whether their pk already exists, then inserted
+    with bulk_create or updated with bulk_update, and the rows of
+    auto-created ManyToManyField through tables are replaced in bulk from
+    the _m2m_data attribute set by serializer.restore_object. Instead of
+    the per-instance model signals, signals.bulk_saved is sent once the
+    transaction is committed. Pass modified=False to keep the modified
+    timestamps of the instances, as for TimeStampedModel.save.
+    """
+    using = using or router.db_for_write(model_class)
+    manager = model_class._default_manager.db_manager(using)
+    opts = model_class._meta
+    fields = [f for f in opts.local_fields if not f.primary_key]
+
+    with transaction.commit_on_success(using=using):
+        existing = set()
+        for pks in chunked((i.pk for i in instances if i.pk is not None),
+                           batch_size):
+            existing.update(manager.filter(pk__in=pks).values_list(
+                'pk', flat=True))
+
+        created, updated = [], []
+        for instance in instances:
+            prepare_save = getattr(instance, 'prepare_save', None)
+            if prepare_save:
+                prepare_save(modified=modified)
+            if instance.pk in existing:
+                updated.append(instance)
+            else:
+                created.append(instance)
+
+        manager.bulk_create(created)
+        bulk_update(model_class, updated, fields, using, batch_size)
+
+        for field in opts.many_to_many:
+            through = field.rel.through
+            if not through._meta.auto_created:
+                continue
+            related = [(i, i._m2m_data[field.name]) for i in instances
+                       if field.name in getattr(i, '_m2m_data', {})]
+            if not related:
+                continue
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+            through_manager = through._default_manager.db_manager(using)
+            for pks in chunked((i.pk for i, objs in related
+                                if i.pk in existing), batch_size):
+                through_manager.filter(**{source + '__in': pks}).delete()
+            through_manager.bulk_create([
+                through(**{source + '_id': i.pk,
+                           target + '_id': getattr(obj, 'pk', obj)})
+                for i, objs in related for obj in objs])
+
+    for instance in instances:
+        instance._state.adding = False
+        instance._state.db = using
+    signals.bulk_saved.send(sender=model_class, created=created,
+                            updated=updated, using=using)
+    return created, updated
+
+
+def bulk_update(model_class, instances, fields, using, batch_size=500):
+    """
+    Writes the fields of instances of model_class that already exist with
+    one UPDATE per batch of up to batch_size instances, setting each
+    column to a CASE on the pk. On PostgreSQL each CASE is cast to the
+    column type, which NULL and string parameters alone do not determine.
+    """
+    if not instances or not fields:
+        return
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model_class._meta
+    pk = qn(opts.pk.column)
+    # Each instance takes two parameters per field, plus its pk
+    batch_size = min(batch_size, connection.ops.bulk_batch_size(
+        [opts.pk] + fields * 2, instances) or batch_size)
+    cursor = connection.cursor()
+    for chunk in chunked(instances, batch_size):
+        columns, params = [], []
+        for field in fields:
+            case = 'CASE %s %s END' % (pk, ' '.join(
+                ['WHEN %s THEN %s'] * len(chunk)))
+            if connection.vendor == 'postgresql':
+                case = 'CAST(%s AS %s)' % (case, field.db_type(connection))
+            columns.append('%s = %s' % (qn(field.column), case))
+            for instance in chunk:
+                params.append(instance.pk)
+                params.append(field.get_db_prep_save(
+                    getattr(instance, field.attname), connection))
+        params.extend(i.pk for i in chunk)
+        cursor.execute('UPDATE %s SET %s WHERE %s IN (%s)' % (
+            qn(opts.db_table), ', '.join(columns), pk,
+            ', '.join(['%s'] * len(chunk))), params)
 
 
 def migrate_versions():
+    suffixes = {'Release': '', 'Aurora': 'a2', 'Beta': 'beta'}
     for r in Release.objects.filter(version__endswith='.0.0').only(
             'channel', 'version'):
-        if r.channel == 'Release':
-            Release.objects.filter(id=r.id).update(version=r.version[:-2])
-        elif r.channel == 'Aurora':
-            Release.objects.filter(id=r.id).update(version=r.version[:-2] + 'a2')
-        elif r.channel == 'Beta':
-            Release.objects.filter(id=r.id).update(version=r.version[:-2] + 'beta')
+        if r.channel in suffixes:
+            version = r.version[:-2] + suffixes[r.channel]
+            Release.objects.filter(id=r.id).update(
+                version=version, version_key=version_key(version))
 
 
 def get_duplicate_product_versions():
@@ -2,16 +2,38 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from itertools import chain
+import hashlib
+import heapq
+from itertools import islice
 import json
+import time
+import zlib
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.db.models import Count, Max
+from django.db.models.query import QuerySet
 from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.cache import patch_vary_headers
+from django.utils.http import (http_date, parse_etags, parse_http_date_safe,
+                               quote_etag, urlencode)
 from django.shortcuts import get_object_or_404
-from rest_framework import generics
+from django.utils.datastructures import SortedDict
+from rest_framework import generics, permissions, status
 from rest_framework.authtoken.models import Token
+from rest_framework.compat import parse_datetime
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
-from . import models
+from . import models, pagination, search, serializers
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:  # Django < 1.5 streams iterators with HttpResponse
+    StreamingHttpResponse = HttpResponse
 
 
 def auth_token(request):
@@ -24,17 +46,479 @@ def auth_token(request):
         return HttpResponseForbidden()
 
 
-class NoteViewSet(ModelViewSet):
+class ConditionalGetMixin(object):
+    """
+    Adds ETag and Last-Modified validators to list and detail responses,
+    computed from the latest modified timestamp and the number of objects
+    with a single aggregate query, and answers conditional requests that
+    match them with 304 Not Modified before serializing anything.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_list(
+            request, super(ConditionalGetMixin, self).list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        self.object = self.get_object()
+
+        def retrieve(request, *args, **kwargs):
+            return Response(self.get_serializer(self.object).data)
+        return self.conditional_response(
+            request, self.object.modified, self.object.pk,
+            retrieve, request, *args, **kwargs)
+
+    def conditional_list(self, request, view, *args, **kwargs):
+        stats = self.filter_queryset(self.get_queryset()).aggregate(
+            latest=Max('modified'), count=Count('id'))
+        return self.conditional_response(
+            request, stats['latest'], stats['count'],
+            view, request, *args, **kwargs)
+
+    def conditional_response(self, request, latest, count, view, *args,
+                             **kwargs):
+        etag = self.get_etag(request, latest, count)
+        last_modified = latest and http_date(time.mktime(latest.timetuple()))
+        if self.not_modified(request, etag, latest):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = view(*args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = quote_etag(etag)
+            if last_modified:
+                response['Last-Modified'] = last_modified
+        return response
+
+    def get_etag(self, request, latest, count):
+        # The representation also depends on the path, query string and
+        # negotiated format
+        renderer = getattr(request, 'accepted_renderer', None)
+        key = '|'.join([request.get_full_path(),
+                        getattr(renderer, 'format', ''),
+                        latest.isoformat() if latest else '', str(count)])
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def not_modified(self, request, etag, latest):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return '*' in etags or etag in etags
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE'))
+        return bool(latest and if_modified_since and
+                    int(time.mktime(latest.timetuple())) <= if_modified_since)
+
+
+class ValuesListMixin(object):
+    """
+    Serializes the querysets of list responses with a
+    serializers.ValuesListSerializer, straight from values() rows, whenever
+    it supports the fields of the view's serializer class.
+    """
+
+    def get_serializer(self, instance=None, data=None, files=None,
+                       many=False, partial=False):
+        if (many and data is None and files is None and
+                isinstance(instance, QuerySet)):
+            serializer = serializers.ValuesListSerializer.for_class(
+                self.get_serializer_class(), instance,
+                context=self.get_serializer_context())
+            if serializer is not None:
+                return serializer
+        return super(ValuesListMixin, self).get_serializer(
+            instance, data, files, many, partial)
+
+
+class NoteViewSet(ConditionalGetMixin, pagination.KeysetPaginationMixin,
+                  ValuesListMixin, ModelViewSet):
     model = models.Note
 
 
-class ReleaseViewSet(ModelViewSet):
+class ReleaseViewSet(ConditionalGetMixin, pagination.KeysetPaginationMixin,
+                     ValuesListMixin, ModelViewSet):
+    """
+    Releases, with links to their equivalent releases for the other
+    platform when requested with ?include=equivalents.
+    """
     model = models.Release
+    keyset_orderings = {'modified': ('modified', 'id'),
+                        'release_date': ('release_date', 'id')}
+
+    def include_equivalents(self):
+        return 'equivalents' in self.request.QUERY_PARAMS.get(
+            'include', '').split(',')
+
+    def get_serializer_class(self):
+        if self.include_equivalents():
+            return serializers.ReleaseEquivalentsSerializer
+        return super(ReleaseViewSet, self).get_serializer_class()
+
+    def get_serializer(self, instance=None, *args, **kwargs):
+        serializer = super(ReleaseViewSet, self).get_serializer(
+            instance, *args, **kwargs)
+        if instance is not None and self.include_equivalents():
+            releases = list(instance) if kwargs.get('many') else [instance]
+            serializer.context['equivalents'] = (
+                models.Release.equivalent_releases(releases))
+        return serializer
+
+    def conditional_response(self, request, latest, count, view, *args,
+                             **kwargs):
+        # The equivalent releases are part of the representation, so the
+        # validators also change with the releases they are picked from
+        if self.include_equivalents():
+            if getattr(self, 'object', None) is not None:
+                releases = [self.object]
+            else:
+                releases = self.filter_queryset(self.get_queryset()).only(
+                    'id', 'product', 'channel', 'version')
+            equivalents_latest, equivalents_count = (
+                models.Release.equivalents_modified(releases))
+            latest = max(filter(None, [latest, equivalents_latest]) or
+                         [None])
+            count = '%s+%d' % (count, equivalents_count)
+        return super(ReleaseViewSet, self).conditional_response(
+            request, latest, count, view, *args, **kwargs)
 
 
-class NestedNoteView(generics.ListAPIView):
+class NestedNoteView(ConditionalGetMixin, generics.ListAPIView):
+    """
+    Lists the notes of a release. The serialized notes are kept in Django's
+    cache for settings.RNA['NOTES_CACHE_TIMEOUT'] seconds, under a key that
+    includes models.notes_version(), so that any change to a release or
+    note invalidates them.
+
+    The notes are listed in the order of Release.ordered_notes, which the
+    automatic filters would replace with their default ordering. Their
+    related releases are loaded with a query each for the whole page,
+    rather than one per note.
+    """
     model = models.Note
+    filter_backends = ()
+    release = None
 
     def get_queryset(self):
-        release = get_object_or_404(models.Release, pk=self.kwargs.get('pk'))
-        return chain(*release.notes())
+        # Called by both conditional_list and list
+        if self.release is None:
+            self.release = get_object_or_404(
+                models.Release, pk=self.kwargs.get('pk'))
+        return self.release.ordered_notes().select_related(
+            'fixed_in_release').prefetch_related('releases')
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_list(
+            request, self.cached_list, *args, **kwargs)
+
+    def conditional_response(self, request, latest, count, view, *args,
+                             **kwargs):
+        # The notes are ordered by the version and pk of the release, so
+        # the validators also change with it
+        latest = max(filter(None, [latest, self.release.modified]))
+        return super(NestedNoteView, self).conditional_response(
+            request, latest, count, view, *args, **kwargs)
+
+    def cached_list(self, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = super(ConditionalGetMixin, self).list(
+            request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data,
+                      settings.RNA.get('NOTES_CACHE_TIMEOUT'))
+        return response
+
+    def get_cache_key(self, request):
+        # Hyperlinks in the notes depend on the host, and the query string
+        # may change the representation
+        url = hashlib.md5(request.build_absolute_uri().encode('utf-8'))
+        return 'rna:notes:%s:%s:%s' % (
+            self.kwargs.get('pk'), models.notes_version(), url.hexdigest())
+
+
+class ChangesView(APIView):
+    """
+    Lists the releases and notes that were created, updated or deleted, in
+    (modified, model, pk) order, a page at a time. Each page includes an
+    opaque cursor to request the changes after it, which stays valid no
+    matter how many objects change in the meantime.
+    """
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    sources = (models.Release, models.Note, models.Tombstone)
+
+    def get(self, request):
+        try:
+            cursor = self.parse_cursor(request.QUERY_PARAMS.get('cursor'))
+        except ValueError:
+            return Response({'detail': 'Invalid cursor.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        page_size = pagination.get_page_size(request)
+        changes = self.changes(cursor, page_size + 1)
+        has_next = len(changes) > page_size
+        changes = changes[:page_size]
+        if changes:
+            cursor = pagination.encode_cursor(changes[-1][0])
+        elif cursor:
+            cursor = pagination.encode_cursor(cursor)
+        next_url = None
+        if has_next:
+            params = dict(request.QUERY_PARAMS.items())
+            params['cursor'] = cursor
+            next_url = request.build_absolute_uri('?' + urlencode(params))
+        return Response({
+            'next': next_url,
+            'cursor': cursor,
+            'results': self.serialize(request, [c[1] for c in changes]),
+        })
+
+    def parse_cursor(self, cursor):
+        values = pagination.decode_cursor(cursor)
+        if values is None:
+            return None
+        try:
+            modified, rank, pk = values
+            modified = parse_datetime(modified)
+            if modified is None:
+                raise ValueError
+            return modified, int(rank), int(pk)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+
+    def changes(self, cursor, limit):
+        """
+        Returns up to limit ((modified, rank, pk), instance) pairs after
+        cursor, merging the changes of each source, where rank is the
+        index of the source.
+        """
+        return list(islice(heapq.merge(*[
+            self.source_changes(rank, model_class, cursor, limit)
+            for rank, model_class in enumerate(self.sources)]), limit))
+
+    def source_changes(self, rank, model_class, cursor, limit):
+        queryset = model_class._default_manager.order_by('modified', 'pk')
+        if model_class._meta.many_to_many:
+            queryset = queryset.prefetch_related(
+                *[f.name for f in model_class._meta.many_to_many])
+        if cursor:
+            modified, cursor_rank, pk = cursor
+            if rank > cursor_rank:
+                queryset = queryset.filter(modified__gte=modified)
+            elif rank < cursor_rank:
+                queryset = queryset.filter(modified__gt=modified)
+            else:
+                queryset = queryset.filter(pagination.keyset_q(
+                    ('modified', 'pk'), (modified, pk)))
+        for instance in queryset[:limit]:
+            yield (instance.modified, rank, instance.pk), instance
+
+    def serialize(self, request, instances):
+        results = []
+        for instance in instances:
+            if isinstance(instance, models.Tombstone):
+                results.append({
+                    'model': instance.model,
+                    'id': instance.object_id,
+                    'modified': instance.modified,
+                    'deleted': True,
+                })
+            else:
+                serializer_class = serializers.get_model_serializer_class(
+                    instance.__class__)
+                serializer = serializer_class(
+                    instance, context={'request': request})
+                results.append({
+                    'model': models.model_label(instance.__class__),
+                    'id': instance.pk,
+                    'modified': instance.modified,
+                    'deleted': False,
+                    'object': serializer.data,
+                })
+        return results
+
+
+class SearchView(APIView):
+    """
+    Lists the releases and notes that match the words of the q query
+    param in the full-text search index, best first, a page at a time.
+    ?type=releases or ?type=notes restricts the results to one model.
+    """
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    types = SortedDict([('releases', models.Release),
+                        ('notes', models.Note)])
+
+    def get(self, request):
+        query = request.QUERY_PARAMS.get('q', '')
+        if not search.terms(query):
+            return Response({'detail': 'Missing search query.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        types = request.QUERY_PARAMS.get('type')
+        types = types.split(',') if types else list(self.types)
+        if [t for t in types if t not in self.types]:
+            return Response({'detail': 'Invalid type.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = int(request.QUERY_PARAMS.get('page', 1))
+            if page < 1:
+                raise ValueError
+        except ValueError:
+            return Response({'detail': 'Invalid page.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        page_size = pagination.get_page_size(request)
+        offset = (page - 1) * page_size
+
+        count = 0
+        hits = []
+        for t in types:
+            model_class = self.types[t]
+            backend = search.get_backend(router.db_for_read(model_class))
+            count += backend.count(model_class, query)
+            # Any of the first offset + page_size hits of each model may
+            # make it to the page
+            hits.extend((score, model_class, pk) for pk, score in
+                        backend.search(model_class, query, 0,
+                                       offset + page_size))
+        hits.sort(key=lambda hit: -hit[0])
+        hits = hits[offset:offset + page_size]
+
+        return Response({
+            'count': count,
+            'next': self.page_url(request, page + 1)
+            if offset + page_size < count else None,
+            'previous': self.page_url(request, page - 1) if page > 1 else None,
+            'results': self.serialize(request, hits),
+        })
+
+    def page_url(self, request, page):
+        params = dict(request.QUERY_PARAMS.items())
+        params['page'] = page
+        return request.build_absolute_uri('?' + urlencode(params))
+
+    def serialize(self, request, hits):
+        """
+        Returns the results for a list of (score, model class, pk) hits,
+        serializing the objects of each model together, and skipping those
+        deleted since they were indexed.
+        """
+        data = {}
+        for model_class in set(hit[1] for hit in hits):
+            queryset = model_class._default_manager.filter(
+                pk__in=[hit[2] for hit in hits if hit[1] is model_class])
+            serializer_class = serializers.get_model_serializer_class(
+                model_class)
+            context = {'request': request}
+            serializer = serializers.ValuesListSerializer.for_class(
+                serializer_class, queryset, context=context)
+            if serializer is not None:
+                objects = serializer.data
+                pks = [row[model_class._meta.pk.attname]
+                       for row in serializer.object]
+            else:
+                instances = list(queryset)
+                objects = serializer_class(
+                    instances, many=True, context=context).data
+                pks = [instance.pk for instance in instances]
+            data[model_class] = dict(zip(pks, objects))
+        results = []
+        for score, model_class, pk in hits:
+            if pk in data[model_class]:
+                results.append({
+                    'model': models.model_label(model_class),
+                    'id': pk,
+                    'score': score,
+                    'object': data[model_class][pk],
+                })
+        return results
+
+
+def gzip_stream(chunks):
+    """
+    Yields the gzip compression of the byte strings of chunks, flushing
+    after each one so that it reaches the client without waiting for the
+    next.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class ExportView(APIView):
+    """
+    Streams every release or note as newline delimited JSON, in (modified,
+    id) order, serializing settings.RNA['EXPORT_CHUNK_SIZE'] (1000 by
+    default) objects at a time, each chunk fetched with a keyset query, so
+    that memory use stays the same whatever the size of the table. With
+    ?modified_after= only the objects modified at or after that time are
+    exported, as with the modified_after filter of the other views. The
+    stream is gzipped for clients that accept it.
+
+    Middleware that reads the content of responses, such as GZipMiddleware
+    or ETags in CommonMiddleware, defeats the streaming on Django 1.4.
+    """
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    sources = {'releases': models.Release, 'notes': models.Note}
+    keyset_fields = ('modified', 'id')
+
+    def get(self, request, name):
+        model_class = self.sources[name]
+        modified_after = request.QUERY_PARAMS.get('modified_after')
+        if modified_after:
+            modified_after = parse_datetime(modified_after)
+            if modified_after is None:
+                return Response({'detail': 'Invalid modified_after.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        chunks = self.chunks(request, model_class, modified_after)
+        gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if gzip:
+            chunks = gzip_stream(chunks)
+        response = StreamingHttpResponse(
+            chunks, content_type='application/x-ndjson')
+        if gzip:
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ExportView, self).finalize_response(
+            request, response, *args, **kwargs)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    def chunks(self, request, model_class, modified_after=None):
+        """
+        Yields the serialized objects of model_class modified at or after
+        modified_after, a line each, a chunk of lines at a time.
+        """
+        chunk_size = settings.RNA.get('EXPORT_CHUNK_SIZE', 1000)
+        queryset = model_class._default_manager.order_by(*self.keyset_fields)
+        if modified_after:
+            queryset = queryset.filter(modified__gte=modified_after)
+        serializer_class = serializers.get_model_serializer_class(
+            model_class)
+        context = {'request': request}
+        values = None
+        while True:
+            chunk = queryset
+            if values is not None:
+                chunk = chunk.filter(
+                    pagination.keyset_q(self.keyset_fields, values))
+            chunk = chunk[:chunk_size]
+            serializer = serializers.ValuesListSerializer.for_class(
+                serializer_class, chunk, context=context)
+            if serializer is None:
+                serializer = serializer_class(
+                    list(chunk), many=True, context=context)
+            data = serializer.data
+            if not data:
+                return
+            yield ''.join(json.dumps(obj, cls=JSONEncoder,
+                                     separators=(',', ':')) + '\n'
+                          for obj in data)
+            if len(data) < chunk_size:
+                return
+            last = list(serializer.object)[-1]
+            values = [pagination.keyset_value(last, f)
+                      for f in self.keyset_fields]
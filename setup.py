@@ -15,7 +15,8 @@ setup(
     #url='',
     #license='',
     packages=[
-        'rna', 'rna.migrations', 'rna.management', 'rna.management.commands'],
+        'rna', 'rna.benchmarks', 'rna.migrations', 'rna.management',
+        'rna.management.commands'],
     install_requires=[
         'South',
         'Django>=1.4.9',